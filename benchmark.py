@@ -0,0 +1,863 @@
+#!/usr/bin/env python3
+"""
+AR Welding Mask - Render Benchmarks
+Measures per-frame cost of every render path stage and the end-to-end frame
+across camera resolutions and display scales (run on the target device).
+
+Usage:
+    python benchmark.py                                  # full sweep -> benchmark_results.json
+    python benchmark.py --quick --stages resize,fb_write
+    python benchmark.py --baseline baseline.json         # flag regressions (exit code 1)
+    python benchmark.py --quick --stages stripes_1,stripes_2,stripes_3,stripes_4   # core scaling
+    python benchmark.py --stall                          # camera stall -> recovery time
+    python benchmark.py --stall --sim-hang 2             # same, wedging after 2 s of frames
+    python benchmark.py --preview                        # frame time with / without preview viewers
+    python benchmark.py --alloc-check                    # render path allocations (exit code 1 over budget)
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+import multiprocessing
+import numpy as np
+import cv2
+import program
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+BENCH_FRAMES = 300          # Frames per measurement
+WARMUP_FRAMES = 10          # Untimed frames before each measurement (caches, lazy init)
+ALLOC_FRAMES = 30           # Frames traced with tracemalloc (slower, separate pass)
+SENSOR_CHANGE_EVERY = 9     # Sensor values change every N frames (~2x per second at 18 FPS)
+CAMERA_SIZES = [(320, 360), (480, 540), (640, 720)]   # Per-eye capture sizes to sweep
+DISPLAY_SCALES = [0.6, 0.8, 1.0]                        # DISPLAY_SCALE values to sweep
+RESULTS_FILE = "benchmark_results.json"
+REGRESSION_THRESHOLD = 0.10  # Flag stages >10% slower (mean or p50) than the baseline
+ALLOC_TOLERANCE_KB = 4.0     # Allocation growth below this is noise
+ALLOC_BUDGET_KB = 32.0       # --alloc-check: max heap allocated per steady-state frame by a render stage
+ALLOC_CHECK_STAGES = ("frame_stats", "denoise", "tonemap", "display_on_framebuffer", "display_hud",
+                      "display_packed", "pipeline_frame", "pipeline_frame_canvas", "pipeline_frame_yuv",
+                      "latency_record", "preview_publish")
+STRIPE_SCALING = (1, 2, 3, 4)  # Worker counts for the stripes_N stages (Pi Zero 2 W has 4 cores)
+
+# Arc response simulation (flash-to-corrected-frame latency)
+ARC_TRIALS = 40                  # Simulated strikes (flash phase varies per trial)
+ARC_SIM_SECONDS = 6.0            # Simulated time per trial
+ARC_AMBIENT_LIGHT = 520          # Light ADC before the strike
+ARC_CAMERA_FPS = 30              # Camera frame rate in the simulation
+CAMERA_CONTROL_DELAY_FRAMES = 2  # Frames before new controls take effect (libcamera pipeline depth)
+ARC_CORRECTED_RATIO = 2.0        # Frame counts as corrected within 2x of the arc gain x exposure
+
+# Capture stall recovery (simulated wedged camera)
+STALL_TRIALS = 3                 # Wedges per measurement
+STALL_HANG_AFTER = 0.5           # Seconds of good frames before the camera wedges
+STALL_SIM_SECONDS = 10.0         # Give up on a trial after this long
+WEDGED_STEP_DELAY = 0.1          # Governor step this long after the wedge (before the stall is detected)
+
+# Live preview viewer impact (render frame time with and without MJPEG viewers)
+PREVIEW_VIEWERS = 3              # Viewer processes reading the stream
+PREVIEW_BENCH_PORT = 8099        # Served on 127.0.0.1
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def sensor_values(i):
+    """
+    Synthetic sensor values that change every SENSOR_CHANGE_EVERY frames.
+
+    Args:
+        i (int): Frame index
+
+    Returns:
+        tuple: Arguments for render_osd / HudCompositor.update
+    """
+    step = i // SENSOR_CHANGE_EVERY
+    battery_v, battery_st, battery_crit = program.calculate_battery_voltage(400 + step % 40)
+    mq07_v, mq07_st, mq07_danger = program.calculate_mq07_status(200 + (step * 37) % 300)
+    light_val, light_st = program.calculate_light_level(500)
+    return (battery_v, battery_st, battery_crit, mq07_v, mq07_st, mq07_danger,
+            light_val, light_st, step % 4 != 0)
+
+def time_frames(fn, frames=BENCH_FRAMES):
+    """
+    Time fn(i) over a number of frames.
+
+    Returns:
+        ndarray: Per-frame durations in milliseconds
+    """
+    durations = np.empty(frames)
+    for i in range(frames):
+        start = time.perf_counter()
+        fn(i)
+        durations[i] = (time.perf_counter() - start) * 1000.0
+    return durations
+
+def alloc_per_frame(fn, frames=ALLOC_FRAMES):
+    """
+    Mean Python/NumPy heap allocated per frame (peak above the pre-frame level).
+    OpenCV's internal allocations are not visible to tracemalloc; NumPy
+    arrays it returns are.
+
+    Returns:
+        float: Kilobytes per frame
+    """
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(frames):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn(i)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / frames / 1024.0
+
+def measure(fn, frames=BENCH_FRAMES):
+    """
+    Warm up, time and trace a stage.
+
+    Returns:
+        dict: mean_ms, p50_ms, p99_ms, budget_pct (p99 share of FRAME_TIME_BUDGET), alloc_kb
+    """
+    for i in range(WARMUP_FRAMES):
+        fn(i)
+    durations = time_frames(fn, frames)
+    return {
+        "mean_ms": round(float(durations.mean()), 4),
+        "p50_ms": round(float(np.percentile(durations, 50)), 4),
+        "p99_ms": round(float(np.percentile(durations, 99)), 4),
+        "budget_pct": round(float(np.percentile(durations, 99)) / (program.FRAME_TIME_BUDGET * 10.0), 2),
+        "alloc_kb": round(alloc_per_frame(fn, min(frames, ALLOC_FRAMES)), 2),
+    }
+
+def report(result):
+    """Print one result line."""
+    budget = f" | budget {result['budget_pct']:5.1f}%" if "budget_pct" in result else ""
+    print(f"  {result['stage']:<26} mean {result['mean_ms']:7.3f} ms | p50 {result['p50_ms']:7.3f} ms"
+          f" | p99 {result['p99_ms']:7.3f} ms{budget} | alloc {result['alloc_kb']:9.1f} KB")
+
+def set_geometry(camera_size, scale):
+    """Point program's module config at a camera size / display scale."""
+    program.CAMERA_WIDTH, program.CAMERA_HEIGHT = camera_size
+    program.DISPLAY_SCALE = scale
+    program.configure_layout(program.FB_WIDTH, program.FB_HEIGHT)
+
+# ============================================================================
+# STAGES
+# ============================================================================
+# Each stage builder gets a shared context and returns fn(i) for one frame.
+
+def stage_hstack(ctx):
+    """Dual view by np.hstack (original path)."""
+    frame = ctx["frame"]
+    return lambda i: np.hstack((frame, frame))
+
+def stage_resize(ctx):
+    """cv2.resize(INTER_NEAREST) of the double-wide frame into a new array (original path)."""
+    double_frame = np.hstack((ctx["frame"], ctx["frame"]))
+    size = (program.frame_width, program.frame_height)
+    return lambda i: cv2.resize(double_frame, size, interpolation=cv2.INTER_NEAREST)
+
+def stage_resize_inplace(ctx):
+    """Per-eye resize into the canvas + copy to the right half (RenderPipeline path)."""
+    frame, canvas = ctx["frame"], ctx["canvas"]
+    x, y, w, h = program.x_offset, program.y_offset, program.frame_width, program.frame_height
+    left = canvas[y:y + h, x:x + w // 2]
+    right = canvas[y:y + h, x + w // 2:x + 2 * (w // 2)]
+
+    def run(i):
+        cv2.resize(frame, (left.shape[1], h), dst=left, interpolation=cv2.INTER_NEAREST)
+        cv2.copyTo(left, None, dst=right)
+    return run
+
+def stage_stereo_remap(ctx):
+    """Per-eye lens remap (StereoCompositor)."""
+    x, y, w, h = program.x_offset, program.y_offset, program.frame_width, program.frame_height
+    stereo = program.StereoCompositor((program.CAMERA_WIDTH, program.CAMERA_HEIGHT),
+                                      (w // 2, h), cache_dir=None)
+    video = ctx["canvas"][y:y + h, x:x + 2 * (w // 2)]
+    return lambda i: stereo.compose(ctx["frame"], video)
+
+def stage_cvtcolor(ctx):
+    """Full-frame cvtColor(BGR2BGR565) into a new array (original path)."""
+    canvas = ctx["canvas"]
+    return lambda i: cv2.cvtColor(canvas, cv2.COLOR_BGR2BGR565)
+
+def stage_fb_write(ctx):
+    """FramebufferWriter.write of video rect + OSD strips (convert into mmap)."""
+    fb_writer, canvas = ctx["fb_writer"], ctx["canvas"]
+    rects = [(program.x_offset, program.y_offset, program.frame_width, program.frame_height)]
+    rects += program.OSD_REGIONS
+    return lambda i: fb_writer.write(canvas, rects)
+
+def stage_fb_write_file(ctx):
+    """Original framebuffer write: cvtColor + tobytes + write() to a file."""
+    canvas, path = ctx["canvas"], ctx["fb_path"]
+
+    def run(i):
+        rgb565_image = cv2.cvtColor(canvas, cv2.COLOR_BGR2BGR565)
+        with open(path, 'wb') as fb:
+            fb.write(rgb565_image.tobytes())
+    return run
+
+def stage_render_osd(ctx):
+    """render_osd (putText on the full canvas)."""
+    canvas = ctx["canvas"]
+    return lambda i: program.render_osd(canvas, *sensor_values(i))
+
+def stage_hud(ctx):
+    """HudCompositor update + compose (cached sprites)."""
+    hud, canvas = program.HudCompositor(), ctx["canvas"]
+
+    def run(i):
+        hud.update(*sensor_values(i))
+        hud.compose(canvas)
+    return run
+
+def dual_view(frame, double_frame):
+    """Side-by-side view into a preallocated buffer (as main() does for the fallback path)."""
+    width = frame.shape[1]
+    np.copyto(double_frame[:, :width], frame)
+    np.copyto(double_frame[:, width:], frame)
+    return double_frame
+
+def stage_display(ctx):
+    """End-to-end fallback frame: dual view + display_on_framebuffer (render_osd)."""
+    frame, fb_writer = ctx["frame"], ctx["fb_writer"]
+    double_frame = np.hstack((frame, frame))
+
+    def run(i):
+        program.display_on_framebuffer(dual_view(frame, double_frame), *sensor_values(i)[:8], fb_writer,
+                                       sensor_values(i)[8])
+    return run
+
+def stage_display_hud(ctx):
+    """End-to-end fallback frame with the cached HUD."""
+    frame, fb_writer, hud = ctx["frame"], ctx["fb_writer"], program.HudCompositor()
+    double_frame = np.hstack((frame, frame))
+
+    def run(i):
+        program.display_on_framebuffer(dual_view(frame, double_frame), *sensor_values(i)[:8], fb_writer,
+                                       sensor_values(i)[8], hud)
+    return run
+
+def yuv_frame(ctx):
+    """The context frame as I420 (YUV420 capture format)."""
+    frame = ctx["frame"]
+    height, width = frame.shape[:2]
+    yuv = np.empty(program.capture_shape(width, height, "YUV420"), dtype=np.uint8)
+    program.bgr_to_yuv420(frame, yuv, np.empty_like(frame))
+    return yuv
+
+def stage_display_packed(ctx):
+    """End-to-end fallback frame: eye packed to RGB565, scaled straight into the framebuffer."""
+    frame, fb_writer, hud = ctx["frame"], ctx["fb_writer"], program.HudCompositor()
+    double_frame = np.hstack((frame, frame))
+
+    def run(i):
+        program.display_on_framebuffer(dual_view(frame, double_frame), *sensor_values(i)[:8], fb_writer,
+                                       sensor_values(i)[8], hud, return_frame=False)
+    return run
+
+def stage_pipeline(ctx, frame=None, canvas_video=False):
+    """End-to-end RenderPipeline frame: compose + wait until presented."""
+    stereo = None
+    if program.STEREO_REMAP_ENABLED:
+        stereo = program.StereoCompositor((program.CAMERA_WIDTH, program.CAMERA_HEIGHT),
+                                          (program.frame_width // 2, program.frame_height),
+                                          cache_dir=None)
+    pipeline = program.RenderPipeline(ctx["fb_writer"], program.HudCompositor(), stereo)
+    pipeline.canvas_video = canvas_video
+    ctx["cleanup"].append(pipeline.stop)
+    frame = ctx["frame"] if frame is None else frame
+
+    def run(i):
+        target = pipeline.presented + 1
+        pipeline.compose(frame, *sensor_values(i))
+        while pipeline.presented < target:
+            time.sleep(0.0002)
+    return run
+
+def stage_pipeline_canvas(ctx):
+    """End-to-end RenderPipeline frame with the video upscaled in the BGR canvas (pre-packing path)."""
+    return stage_pipeline(ctx, canvas_video=True)
+
+def stage_pipeline_yuv(ctx):
+    """End-to-end RenderPipeline frame from YUV420 capture (LUT to RGB565, remap into the framebuffer)."""
+    return stage_pipeline(ctx, yuv_frame(ctx))
+
+def stage_yuv565(ctx):
+    """Yuv565Converter.convert: I420 eye -> packed RGB565 at camera size."""
+    frame, converter = yuv_frame(ctx), program.Yuv565Converter()
+    eye = np.empty(ctx["frame"].shape[:2], dtype=np.uint16)
+    return lambda i: converter.convert(frame, eye)
+
+def stage_latency_record(ctx):
+    """LatencyStats.record per presented frame (must stay well under 1% of the frame budget)."""
+    stats = program.LatencyStats(stats_file=None, socket_path=None)
+    now = time.monotonic_ns()
+    return lambda i: stats.record(now, now + 400000, now + 25000000 + i, now + 28000000)
+
+def stage_telemetry_append(ctx):
+    """TelemetryLog.append + rolling CO averages (runs once per TELEMETRY_INTERVAL, off the render loop)."""
+    log = program.TelemetryLog(os.path.join(os.path.dirname(ctx["fb_path"]), "telemetry.bin"), (0, 1, 2),
+                               capacity=int(program.CO_TWA_LONG / program.TELEMETRY_INTERVAL) + 1024)
+    ctx["cleanup"].append(log.close)
+    start = time.time()
+    return lambda i: log.append(start + i * program.TELEMETRY_INTERVAL, [600, 300 + i % 200, 500])
+
+def stage_preroll_encode(ctx):
+    """PrerollRing.add: JPEG-compress a camera frame into the ring (runs in the encoder process)."""
+    ring = program.PrerollRing()
+    frame = ctx["frame"].copy()
+    def step(i):
+        frame[0, 0] = i  # Defeat any caching of identical frames
+        ring.add(frame, i / 20.0, (3.7, 0.5, 100))
+    return step
+
+def stage_preroll_submit(ctx):
+    """RecordingEncoder.submit between recordings: render-process cost of feeding the pre-roll."""
+    recorder = program.RecordingEncoder(ctx["frame"].shape, preroll_seconds=program.PREROLL_SECONDS)
+    ctx["cleanup"].append(recorder.close)
+    return lambda i: recorder.submit(ctx["frame"], (3.7, 0.5, 100))
+
+def stage_frame_stats(ctx):
+    """FrameStats.update (subsampled luminance histogram for auto-exposure)."""
+    stats = program.FrameStats(ctx["frame"].shape)
+    return lambda i: stats.update(ctx["frame"], i)
+
+def stage_tonemap(ctx):
+    """ToneMapper.apply on a dark frame with an arc: proxy moments + background/arc ROI LUTs."""
+    frame = (ctx["frame"] // 8).astype(np.uint8)
+    height, width = frame.shape[:2]
+    cv2.circle(frame, (width // 2, height // 2), max(width // 20, 2), (255, 255, 255), -1)
+    stats, tonemap = program.FrameStats(frame.shape), program.ToneMapper(enabled=True)
+    stats.update(frame, 0)
+    return lambda i: tonemap.apply(frame, stats, 1.0, program.EXPOSURE_TIME_MIN)
+
+def stage_denoise(ctx):
+    """TemporalDenoiser.apply at high gain: fixed-point EMA + motion mask into its output frame."""
+    base = ctx["frame"] // 2
+    noisy = (base + ctx["frame"] // 16).astype(np.uint8)  # Alternating frames: noise plus some motion
+    stats, denoiser = program.FrameStats(base.shape), program.TemporalDenoiser(enabled=True)
+    stats.update(base, 0)
+    return lambda i: denoiser.apply(noisy if i % 2 else base, stats, program.GAIN_MAX, seq=i + 1)
+
+def stage_preview_publish(ctx):
+    """PreviewPublisher.publish: frame + HUD state into the shared-memory ring (render-process cost)."""
+    preview = program.PreviewPublisher(ctx["frame"].shape, bind="127.0.0.1", port=PREVIEW_BENCH_PORT)
+    ctx["cleanup"].append(preview.close)
+    state = {"battery_v": 3.9, "battery": "Good", "co_v": 0.4, "air": "Good", "co_danger": False,
+             "light": 500, "recording": False, "stale": False}
+    return lambda i: preview.publish(ctx["frame"], state, float(i))
+
+def stage_stripes(workers):
+    """Build a stage: lens remap + BGR565 conversion of the video area on `workers` threads."""
+    def build(ctx):
+        saved_threads = cv2.getNumThreads()
+        cv2.setNumThreads(1)  # Scaling comes from the stripes, not from OpenCV's pool
+        pool = program.StripeWorkers(workers, program.STRIPE_COUNT)
+        ctx["cleanup"] += [pool.stop, lambda: cv2.setNumThreads(saved_threads)]
+        stereo = program.StereoCompositor((program.CAMERA_WIDTH, program.CAMERA_HEIGHT),
+                                          (program.frame_width // 2, program.frame_height),
+                                          cache_dir=None)
+        frame, canvas, fb_writer = ctx["frame"], ctx["canvas"], ctx["fb_writer"]
+        rect = (program.x_offset, program.y_offset, program.frame_width, program.frame_height)
+        x, y, w, h = rect
+        video = canvas[y:y + h, x:x + 2 * (w // 2)]
+
+        def run(i):
+            pool.run(lambda y0, y1: stereo.compose_rows(frame, video, y0, y1), h)
+            fb_writer.write(canvas, [rect], pool)
+        return run
+    return build
+
+STAGES = {
+    "hstack": stage_hstack,
+    "resize": stage_resize,
+    "resize_inplace": stage_resize_inplace,
+    "stereo_remap": stage_stereo_remap,
+    "cvtcolor_bgr565": stage_cvtcolor,
+    "fb_write": stage_fb_write,
+    "fb_write_file": stage_fb_write_file,
+    "render_osd": stage_render_osd,
+    "hud": stage_hud,
+    "display_on_framebuffer": stage_display,
+    "display_hud": stage_display_hud,
+    "display_packed": stage_display_packed,
+    "pipeline_frame": stage_pipeline,
+    "pipeline_frame_canvas": stage_pipeline_canvas,
+    "pipeline_frame_yuv": stage_pipeline_yuv,
+    "yuv565_convert": stage_yuv565,
+    "latency_record": stage_latency_record,
+    "frame_stats": stage_frame_stats,
+    "tonemap": stage_tonemap,
+    "denoise": stage_denoise,
+    "preview_publish": stage_preview_publish,
+    "telemetry_append": stage_telemetry_append,
+    "preroll_encode": stage_preroll_encode,
+    "preroll_submit": stage_preroll_submit,
+}
+STAGES.update({f"stripes_{n}": stage_stripes(n) for n in STRIPE_SCALING})
+
+# ============================================================================
+# ARC RESPONSE
+# ============================================================================
+
+class ControlLog:
+    """Camera stand-in that logs gain x exposure of every set_controls at simulated time."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.log = []
+
+    def set_controls(self, controls):
+        self.log.append((self.now, controls["AnalogueGain"] * controls["ExposureTime"]))
+
+def arc_response(event_driven, flash_at, rng):
+    """
+    Simulate one arc strike on a light trace and measure flash-to-corrected-frame latency.
+    The sampler (median filter, SENSOR_SAMPLE_RATE) and the main loop polling
+    (TARGET_FPS, LIGHT_ADJUST_INTERVAL) run on a virtual clock; controls take
+    effect CAMERA_CONTROL_DELAY_FRAMES camera frames after they are set.
+
+    Args:
+        event_driven (bool): ArcExposureController (True) or fixed-interval polling only
+        flash_at (float): Strike time in seconds
+        rng (Generator): Noise source
+
+    Returns:
+        float: Milliseconds from the strike to the start of the first corrected frame
+    """
+    ambient_gain, ambient_exposure = program.exposure_targets(ARC_AMBIENT_LIGHT)
+    program.adaptive_gain_state.update(current_gain=ambient_gain, current_exposure=ambient_exposure)
+    initial = ambient_gain * ambient_exposure
+    camera = ControlLog()
+    controller = program.ArcExposureController(camera, 0) if event_driven else None
+    saved_debug, program.DEBUG_MODE = program.DEBUG_MODE, False
+
+    dt = 1.0 / program.SENSOR_SAMPLE_RATE
+    loop_period = 1.0 / program.TARGET_FPS
+    raw = []
+    next_loop, last_adjust = 0.0, -1.0
+    try:
+        for n in range(int(ARC_SIM_SECONDS / dt)):
+            t = n * dt
+            camera.now = t
+            raw.append((980.0 if t >= flash_at else ARC_AMBIENT_LIGHT) + rng.normal(0.0, 3.0))
+            filtered = float(np.median(raw[-program.SENSOR_MEDIAN_WINDOW:]))
+            if controller is not None:
+                controller.on_sample(t, (filtered,))
+            if t >= next_loop:
+                next_loop += loop_period
+                if t - last_adjust > program.LIGHT_ADJUST_INTERVAL:
+                    if controller is not None:
+                        controller.update(int(filtered), t)
+                    else:
+                        program.adjust_camera_exposure(camera, int(filtered))
+                    last_adjust = t
+    finally:
+        program.DEBUG_MODE = saved_debug
+
+    arc_gain, arc_exposure = program.exposure_targets(program.ARC_PRESET_LIGHT)
+    target = arc_gain * arc_exposure * ARC_CORRECTED_RATIO
+    frame_time = 1.0 / ARC_CAMERA_FPS
+    for k in range(int(ARC_SIM_SECONDS * ARC_CAMERA_FPS)):
+        start = k * frame_time
+        if start < flash_at:
+            continue
+        cutoff = (k - CAMERA_CONTROL_DELAY_FRAMES) * frame_time
+        product = initial
+        for when, value in camera.log:
+            if when > cutoff:
+                break
+            product = value
+        if product <= target:
+            return (start - flash_at) * 1000.0
+    return ARC_SIM_SECONDS * 1000.0  # Never corrected within the simulation
+
+def arc_response_results(trials=ARC_TRIALS):
+    """
+    Flash-to-corrected-frame latency for polling vs event-driven exposure.
+
+    Returns:
+        list: Result dicts (latency distribution in the *_ms fields)
+    """
+    print("arc strike -> corrected frame (simulated light trace)")
+    results = []
+    for name, event_driven in (("arc_response_polling", False), ("arc_response_event", True)):
+        rng = np.random.default_rng(1)
+        latencies = np.array([arc_response(event_driven, 1.0 + rng.uniform(0.0, 0.1), rng)
+                              for _ in range(trials)])
+        result = {"stage": name, "camera": "sim", "scale": 0.0,
+                  "mean_ms": round(float(latencies.mean()), 2),
+                  "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+                  "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+                  "alloc_kb": 0.0}
+        results.append(result)
+        report(result)
+        uncorrected = int((latencies >= ARC_SIM_SECONDS * 1000.0).sum())
+        if uncorrected:
+            print(f"    {uncorrected}/{trials} strikes not corrected within {ARC_SIM_SECONDS:.0f} s")
+    return results
+
+# ============================================================================
+# CAPTURE STALL RECOVERY
+# ============================================================================
+
+def stall_recovery(hang_after=STALL_HANG_AFTER):
+    """
+    Wedge a synthetic camera once and let CaptureSupervisor restart it.
+
+    Returns:
+        tuple: (recovery_ms, outage_ms) - from stall detection / from the last good
+               frame to the first fresh frame (None if never recovered)
+    """
+    camera = program.SyntheticCamera(program.CAMERA_WIDTH, program.CAMERA_HEIGHT, {}, hang_after=hang_after)
+    camera.start()
+    processor = program.FrameProcessor(camera)
+    supervisor = program.CaptureSupervisor(processor)
+    try:
+        deadline = time.monotonic() + hang_after + STALL_SIM_SECONDS
+        while supervisor.recovery_ms is None and time.monotonic() < deadline:
+            supervisor.check()
+            time.sleep(0.005)
+        return supervisor.recovery_ms, supervisor.outage_ms
+    finally:
+        processor.stop()
+        camera.stop()
+
+def wedged_resize(hang_after=STALL_HANG_AFTER):
+    """
+    Governor quality step (camera resize) while the camera is wedged, before
+    the stall is detected. The step runs where the main loop would run it:
+    supervisor checks only resume once it returns.
+
+    Returns:
+        tuple: (step_ms, recovery_ms) - main thread time in apply_quality() /
+               stall detection to the first fresh frame at the new size
+               (None if the step blocked or the resize never arrived)
+    """
+    camera = program.SyntheticCamera(program.CAMERA_WIDTH, program.CAMERA_HEIGHT, {}, hang_after=hang_after)
+    camera.start()
+    processor = program.FrameProcessor(camera)
+    supervisor = program.CaptureSupervisor(processor)
+    quality = program.QUALITY_LADDER[-1]
+    try:
+        time.sleep(hang_after + WEDGED_STEP_DELAY)
+        start = time.perf_counter()
+        step = threading.Thread(target=program.apply_quality, args=(quality, processor), daemon=True)
+        step.start()
+        step.join(STALL_SIM_SECONDS)
+        if step.is_alive():
+            return None, None  # Main loop frozen on the wedged capture
+        step_ms = (time.perf_counter() - start) * 1000.0
+        deadline = time.monotonic() + STALL_SIM_SECONDS
+        while time.monotonic() < deadline:
+            supervisor.check()
+            if supervisor.recovery_ms is not None and processor.size == quality["camera"]:
+                return step_ms, supervisor.recovery_ms
+            time.sleep(0.005)
+        return step_ms, None
+    finally:
+        processor.stop()
+        camera.stop()
+
+def stall_recovery_results(trials=STALL_TRIALS, hang_after=STALL_HANG_AFTER):
+    """
+    Stall detection -> fresh frame time with a simulated hanging camera, and
+    a governor step fired into the wedge.
+
+    Returns:
+        list: Result dicts (recovery and outage distributions in the *_ms fields)
+    """
+    print("capture stall -> fresh frame (simulated wedged camera)")
+    runs = [stall_recovery(hang_after) for _ in range(trials)]
+    results = []
+    for index, name in enumerate(("capture_recovery", "capture_outage")):
+        times = np.array([run[index] if run[index] is not None else STALL_SIM_SECONDS * 1000.0
+                          for run in runs])
+        result = {"stage": name, "camera": f"{program.CAMERA_WIDTH}x{program.CAMERA_HEIGHT}", "scale": 0.0,
+                  "mean_ms": round(float(times.mean()), 2),
+                  "p50_ms": round(float(np.percentile(times, 50)), 2),
+                  "p99_ms": round(float(np.percentile(times, 99)), 2),
+                  "alloc_kb": 0.0}
+        results.append(result)
+        report(result)
+    failed = sum(run[0] is None for run in runs)
+    if failed:
+        print(f"    {failed}/{trials} stalls not recovered within {STALL_SIM_SECONDS:.0f} s")
+
+    print("governor step while the camera is wedged")
+    runs = [wedged_resize(hang_after) for _ in range(trials)]
+    for index, name in enumerate(("wedged_step", "wedged_resize_recovery")):
+        times = np.array([run[index] if run[index] is not None else STALL_SIM_SECONDS * 1000.0
+                          for run in runs])
+        result = {"stage": name, "camera": f"{program.CAMERA_WIDTH}x{program.CAMERA_HEIGHT}", "scale": 0.0,
+                  "mean_ms": round(float(times.mean()), 2),
+                  "p50_ms": round(float(np.percentile(times, 50)), 2),
+                  "p99_ms": round(float(np.percentile(times, 99)), 2),
+                  "alloc_kb": 0.0}
+        results.append(result)
+        report(result)
+    blocked = sum(run[0] is None for run in runs)
+    if blocked:
+        print(f"    {blocked}/{trials} governor steps blocked on the wedged camera")
+    lost = sum(run[0] is not None and run[1] is None for run in runs)
+    if lost:
+        print(f"    {lost}/{trials} resizes not applied after the restart")
+    return results
+
+def preview_viewer(url):
+    """Viewer process: read the MJPEG stream until killed."""
+    try:
+        with urllib.request.urlopen(url, timeout=10) as stream:
+            while stream.read(65536):
+                pass
+    except OSError:
+        pass
+
+def preview_impact(viewers=PREVIEW_VIEWERS, frames=BENCH_FRAMES):
+    """
+    Render frame time (pipeline frame + preview publish) without and with
+    MJPEG viewers connected; encoding and HTTP run in the preview process.
+
+    Returns:
+        list: Result dicts (preview_0_viewers, preview_N_viewers)
+    """
+    print(f"live preview: pipeline frame + publish, 0 vs {viewers} viewers")
+    rng = np.random.default_rng(0)
+    fb_writer = program.FramebufferWriter(None)
+    ctx = {"frame": rng.integers(0, 256, (program.CAMERA_HEIGHT, program.CAMERA_WIDTH, 3), dtype=np.uint8),
+           "fb_writer": fb_writer, "cleanup": []}
+    results = []
+    clients = []
+    try:
+        pipeline_frame, publish = stage_pipeline(ctx), stage_preview_publish(ctx)
+        start = time.monotonic()
+
+        def run(i):
+            pipeline_frame(i)
+            publish(time.monotonic() - start)
+
+        url = f"http://127.0.0.1:{PREVIEW_BENCH_PORT}/stream.mjpg"
+        for count in (0, viewers):
+            while len(clients) < count:
+                client = multiprocessing.get_context("spawn").Process(target=preview_viewer, args=(url,),
+                                                                      daemon=True)
+                client.start()
+                clients.append(client)
+            time.sleep(1.0 if count else 0.0)  # Let the viewers connect
+            result = {"stage": f"preview_{count}_viewers",
+                      "camera": f"{program.CAMERA_WIDTH}x{program.CAMERA_HEIGHT}", "scale": program.DISPLAY_SCALE}
+            result.update(measure(run, frames))
+            results.append(result)
+            report(result)
+    finally:
+        for client in clients:
+            client.terminate()
+        for stop in ctx["cleanup"]:
+            stop()
+        fb_writer.close()
+    return results
+
+# ============================================================================
+# SUITE
+# ============================================================================
+
+def run_suite(stages, camera_sizes, scales, frames):
+    """
+    Run every stage for every camera size / display scale.
+
+    Returns:
+        list: Result dicts (stage, camera, scale, mean_ms, p50_ms, p99_ms, alloc_kb)
+    """
+    saved = (program.CAMERA_WIDTH, program.CAMERA_HEIGHT), program.DISPLAY_SCALE
+    results = []
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        fb_path = os.path.join(tmp, "fb.raw")
+        fb_writer = program.FramebufferWriter(fb_path, device=False)
+        try:
+            for camera_size in camera_sizes:
+                for scale in scales:
+                    set_geometry(camera_size, scale)
+                    print(f"camera {camera_size[0]}x{camera_size[1]}, scale {scale}"
+                          f" -> video {program.frame_width}x{program.frame_height}")
+                    ctx = {
+                        "frame": rng.integers(0, 256, (camera_size[1], camera_size[0], 3), dtype=np.uint8),
+                        "canvas": np.zeros((program.FB_HEIGHT, program.FB_WIDTH, 3), dtype=np.uint8),
+                        "fb_writer": fb_writer,
+                        "fb_path": os.path.join(tmp, "fb_file.raw"),
+                        "cleanup": [],
+                    }
+                    for name in stages:
+                        try:
+                            result = {"stage": name, "camera": f"{camera_size[0]}x{camera_size[1]}",
+                                      "scale": scale}
+                            result.update(measure(STAGES[name](ctx), frames))
+                            results.append(result)
+                            report(result)
+                        finally:
+                            for stop in ctx["cleanup"]:
+                                stop()
+                            ctx["cleanup"].clear()
+        finally:
+            fb_writer.close()
+            set_geometry(*saved)
+    return results
+
+def stripe_scaling(results):
+    """Print the speed-up of each stripes_N stage over stripes_1 (same geometry)."""
+    single = {(r["camera"], r["scale"]): r for r in results if r["stage"] == "stripes_1"}
+    lines = []
+    for result in results:
+        base = single.get((result["camera"], result["scale"]))
+        if base is None or not result["stage"].startswith("stripes_") or result["mean_ms"] <= 0:
+            continue
+        lines.append(f"  {result['stage']:<26} {result['camera']:>8} x{result['scale']:<4} "
+                     f"speed-up {base['mean_ms'] / result['mean_ms']:5.2f}x")
+    if len(lines) > len(single):
+        print(f"\nStripe scaling vs 1 worker ({os.cpu_count()} CPUs):")
+        print("\n".join(lines))
+
+def result_key(result):
+    return (result["stage"], result["camera"], result["scale"])
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare results with a baseline run and print a per-stage delta table.
+
+    Args:
+        results (list): Current results
+        baseline (list): Baseline results (same format)
+        threshold (float): Relative slowdown of mean or p50 that counts as a regression
+
+    Returns:
+        list: Keys of regressed measurements
+    """
+    base = {result_key(r): r for r in baseline}
+    regressions = []
+    print(f"\nComparison with baseline (threshold {threshold * 100:.0f}%):")
+    for result in results:
+        key = result_key(result)
+        old = base.get(key)
+        if old is None:
+            continue
+        delta_mean = result["mean_ms"] / old["mean_ms"] - 1.0 if old["mean_ms"] > 0 else 0.0
+        delta_p50 = result["p50_ms"] / old["p50_ms"] - 1.0 if old["p50_ms"] > 0 else 0.0
+        delta_alloc = result["alloc_kb"] - old["alloc_kb"]
+        slower = delta_mean > threshold or delta_p50 > threshold
+        allocating = delta_alloc > ALLOC_TOLERANCE_KB
+        flag = "REGRESSION" if slower or allocating else ""
+        if slower or allocating:
+            regressions.append(key)
+        print(f"  {key[0]:<26} {key[1]:>8} x{key[2]:<4} mean {delta_mean * 100:+6.1f}% | "
+              f"p50 {delta_p50 * 100:+6.1f}% | alloc {delta_alloc:+8.1f} KB  {flag}")
+    return regressions
+
+def alloc_check(results, budget=ALLOC_BUDGET_KB):
+    """
+    Flag render stages that allocate more than the budget per steady-state frame.
+
+    Returns:
+        list: Stage names over budget
+    """
+    print(f"\nAllocation check (budget {budget:.0f} KB per frame):")
+    over = []
+    for result in results:
+        if result["stage"] not in ALLOC_CHECK_STAGES:
+            continue
+        flag = "OVER BUDGET" if result["alloc_kb"] > budget else "ok"
+        if result["alloc_kb"] > budget:
+            over.append(result["stage"])
+        print(f"  {result['stage']:<26} {result['alloc_kb']:9.1f} KB  {flag}")
+    return over
+
+def main(argv=None):
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description="Render path benchmarks")
+    parser.add_argument("--frames", type=int, default=BENCH_FRAMES, help="frames per measurement")
+    parser.add_argument("--stages", help="comma-separated subset of: " + ", ".join(STAGES))
+    parser.add_argument("--arc", action="store_true",
+                        help="only the simulated arc strike exposure response")
+    parser.add_argument("--stall", action="store_true",
+                        help="only the capture stall recovery (simulated wedged camera)")
+    parser.add_argument("--sim-hang", type=float, default=STALL_HANG_AFTER, metavar="SECONDS",
+                        help="seconds of good frames before the simulated camera wedges")
+    parser.add_argument("--preview", action="store_true",
+                        help="only the live preview viewer impact on the render frame time")
+    parser.add_argument("--alloc-check", action="store_true",
+                        help="only the render path stages; exit code 1 if one allocates over ALLOC_BUDGET_KB")
+    parser.add_argument("--quick", action="store_true",
+                        help="only the configured CAMERA_WIDTH/HEIGHT and DISPLAY_SCALE")
+    parser.add_argument("--output", default=RESULTS_FILE, help="JSON results file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown flagged as a regression")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    if args.alloc_check and not args.stages:
+        stages = list(ALLOC_CHECK_STAGES)
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    if args.quick:
+        camera_sizes, scales = [(program.CAMERA_WIDTH, program.CAMERA_HEIGHT)], [program.DISPLAY_SCALE]
+    else:
+        camera_sizes, scales = CAMERA_SIZES, DISPLAY_SCALES
+
+    only = args.arc or args.stall or args.preview
+    results = [] if only else run_suite(stages, camera_sizes, scales, args.frames)
+    stripe_scaling(results)
+    if args.arc or (not args.stages and not only and not args.alloc_check):
+        results += arc_response_results()
+    if args.stall or (not args.stages and not only and not args.alloc_check):
+        results += stall_recovery_results(hang_after=args.sim_hang)
+    if args.preview:
+        results += preview_impact(frames=args.frames)
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "machine": platform.machine(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "opencv": cv2.__version__,
+                "frames": args.frames,
+            },
+            "results": results,
+        }, f, indent=1)
+    print(f"Results written to {args.output}")
+
+    if args.alloc_check:
+        over = alloc_check(results)
+        if over:
+            print(f"{len(over)} stage(s) over the allocation budget")
+            return 1
+        print("Allocation budget met")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            return 1
+        print("No regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,26 +5,40 @@ Real-time camera feed with sensor overlay for AR goggles display
 Displays dual-view (VR mode) with battery and air quality (MQ-07)
 """
 
-import numpy as np
-from picamera2 import Picamera2
-import cv2
 import os
 import time
-from threading import Thread, Lock
-import spidev
+import mmap
+import fcntl
+import struct
+import hashlib
+import zlib
+import ctypes
+import resource
+import queue
+from collections import deque
+import multiprocessing
+from multiprocessing import shared_memory
+from threading import Thread, Lock, Condition, Event
+import argparse
+import json
+import socket
 import sys
 from datetime import datetime
 
+# numpy and cv2 are imported after the boot splash is up (see FAST BOOT)
+
 # ============================================================================
 # CONFIGURATION
 # ============================================================================
 
-# Framebuffer resolution (display)
+# Framebuffer resolution (display) - fallback when geometry can't be queried via ioctl
 FB_WIDTH, FB_HEIGHT = 1920, 1080
+FB_DEVICE = "/dev/fb0"
 
 # Camera preview size (half-width for dual view) - reduced for better FPS on RPi Zero
 CAMERA_WIDTH = 320  # Ultra-low res for speed (320x360 per eye = 640x360 dual)
 CAMERA_HEIGHT = 360
+CAPTURE_FORMAT = "RGB888"  # "RGB888" (BGR frames) or "YUV420" (I420, LUT-converted straight to RGB565)
 
 # SPI configuration for MCP3008
 SPI_BUS = 0
@@ -36,9 +50,26 @@ CH_BATTERY = 0      # 18650 battery with 10k/20k voltage divider
 CH_MQ07 = 1         # MQ-07 CO sensor with 2.2k/3.3k voltage divider
 CH_LIGHT = 2        # Photoresistor with 10k resistor
 
+# Sensor sampler thread (decoupled from the render loop)
+SENSOR_SAMPLE_RATE = 500     # Sample rounds per second (all channels per round)
+SENSOR_OVERSAMPLE = 4        # Conversions per channel per round (averaged)
+SENSOR_FILTER = "median"     # "median" (rejects spikes) or "ema"
+SENSOR_MEDIAN_WINDOW = 5     # Rounds in the median window (5 @ 500 Hz = 10 ms)
+SENSOR_EMA_ALPHA = 0.2       # EMA weight of the newest round
+SENSOR_HISTORY = 4096        # Ring buffer length in rounds (~8 s @ 500 Hz)
+
 # Display settings
 DISPLAY_SCALE = 0.8  # Scale factor for image frame within framebuffer (80% of screen)
 DEBUG_MODE = True   # Set to True to print FPS and sensor values to console and show cv2 preview
+HUD_CACHE_ENABLED = True  # Blend cached OSD sprites instead of calling putText every frame
+
+# VR lens pre-distortion (one remap per eye, built once and cached on disk)
+STEREO_REMAP_ENABLED = True
+LENS_K1 = 0.10                  # Barrel pre-distortion r^2 coefficient (0 = plain scaling)
+LENS_K2 = 0.02                  # Barrel pre-distortion r^4 coefficient
+LENS_CHROMA = (0.0, 0.0, 0.0)   # Per-channel (B, G, R) radial scale offset for lateral CA (0 = off, faster)
+LENS_IPD_OFFSET = 0             # Lens centre shift per eye in display pixels (+ = toward the nose)
+LENS_MAP_CACHE_DIR = "/home/maska/.cache/lens_maps"
 
 # Camera exposure/brightness adjustment based on light
 LIGHT_ADJUST_ENABLED = True
@@ -55,11 +86,112 @@ GAIN_RATE = 0.15                # Smooth adjustment rate (0.0-1.0, lower = smoot
 EXPOSURE_TIME_MIN = 1000         # Min exposure time (1ms) - reduce latency
 EXPOSURE_TIME_MAX = 20000        # Max exposure time (20ms)
 
+# Arc ignition response (event-driven presets from the sensor sampler thread)
+ARC_RESPONSE_ENABLED = True
+ARC_STEP_WINDOW = 0.010          # Seconds over which a light step is measured
+ARC_STEP_RISE = 200              # ADC rise within the window = arc strike
+ARC_STEP_FALL = 200              # ADC fall within the window = arc out
+ARC_LIGHT_MIN = 750              # A strike must end above this (ignores steps in dim light)
+ARC_PRESET_LIGHT = 980           # Light level the arc preset is precomputed for
+ARC_HOLD_TIME = 0.5              # Seconds smooth tracking stays off after a preset jump
+
+# Image-statistics auto-exposure (frame histogram steers gain/exposure; ADC is only the arc trigger)
+EXPOSURE_MODE = "image"          # "image" (frame histogram) or "light" (photoresistor only)
+AE_SUBSAMPLE = 4                 # Histogram over every Nth pixel in both directions
+AE_TARGET_PERCENTILE = 0.99      # Luminance percentile steered to AE_TARGET_LEVEL
+AE_TARGET_LEVEL = 220            # (keeps the arc glow just below clipping)
+AE_RATE = 0.5                    # Fraction of the (log) exposure error corrected per update
+AE_DEADBAND = 0.08               # Ignore errors below ~8%
+AE_CLIP_LEVEL = 250              # Luminance counted as clipped
+AE_CLIP_FRACTION = 0.02          # More than this clipped: halve exposure (percentile is saturated)
+AE_INTERVAL_FRAMES = 3           # Frames between updates (new controls take ~2 frames to apply)
+AE_EXPOSURE_MAX = 11000          # Longest exposure before raising gain (latency bound)
+
+# Arc-aware tone mapping (arc found on the FrameStats proxy, LUT curves at camera resolution)
+TONEMAP_ENABLED = True
+TONEMAP_ARC_LEVEL = 240          # Proxy luminance counted as arc
+TONEMAP_ARC_MIN_SAMPLES = 4      # Fewer arc samples than this: no arc in view, frame passed through
+TONEMAP_ROI_SIGMAS = 3.0         # Arc ROI half-size in standard deviations of the arc samples
+TONEMAP_ROI_MARGIN = 16          # Extra ROI border in camera pixels (glow around the arc)
+TONEMAP_ROI_MAX_FRACTION = 0.25  # ROI area cap (bounds the per-frame cost)
+TONEMAP_REFERENCE = 60000        # Gain x exposure (us) of an unlit scene; shorter = background lifted
+TONEMAP_BUCKET_STOPS = 0.5       # Gain / exposure quantisation of the cached curves (stops)
+TONEMAP_SHADOW_GAMMA = 0.12      # Background gamma reduction per stop below TONEMAP_REFERENCE
+TONEMAP_GAMMA_MIN = 0.5          # Strongest background lift
+TONEMAP_KNEE = 160               # Arc ROI: highlight roll-off above this input level
+TONEMAP_ARC_GAMMA = 1.8          # Arc ROI: roll-off exponent (separates the pool from the glow)
+
+# Temporal denoise (high-gain low light; in place, 8.8 fixed-point uint16 accumulators)
+DENOISE_ENABLED = True
+DENOISE_GAIN_ON = 11.0           # Filter switches on at this analogue gain...
+DENOISE_GAIN_OFF = 9.0           # ...and off again below this (hysteresis)
+DENOISE_SHIFT = 2                # EMA weight of the new frame = 1 / 2^N
+DENOISE_MOTION_LEVEL = 24        # Pixel differing from the average by more: new value taken as is
+DENOISE_RESET_LEVEL = 24.0       # Mean luminance jump (frame to frame) that restarts the filter
+DENOISE_RESET_FRAMES = 3         # Frames passed through after an arc event / jump (new controls settling)
+
 # Performance settings
 TARGET_FPS = 18                 # Target frame rate (reduced for sensor reads + larger display)
 FRAMEBUFFER_CACHE = None        # Cache framebuffer file handle
 FRAME_TIME_BUDGET = 1.0 / TARGET_FPS  # Time budget per frame (seconds)
-MIN_FRAME_TIME = 0.003  # Minimum sleep to avoid CPU spin
+PIPELINE_SLOTS = 3              # Preallocated buffers per pipeline stage (capture, compose)
+FRAME_WAIT_TIMEOUT = 0.5        # Max seconds the renderer waits for a new camera frame
+
+# Capture stall supervisor (a wedged camera must never leave an old frame on screen unmarked)
+CAPTURE_STALE_AFTER = 0.3       # Newest frame older than this: HUD shows the stale video warning
+CAPTURE_RESTART_AFTER = 1.5     # Newest frame older than this: camera re-created in the background
+CAPTURE_RESTART_RETRY = 5.0     # Min seconds between restart attempts while still stalled
+CAMERA_TEARDOWN_TIMEOUT = 2.0   # Max seconds to wait for a wedged camera to stop/close
+PRESENT_VSYNC = False           # Align framebuffer writes to FBIO_WAITFORVSYNC (if the driver supports it)
+
+# Stripe-parallel compose and RGB565 conversion (OpenCV releases the GIL inside each call)
+STRIPE_WORKERS = 4              # Threads per frame stage incl. the caller (1 = everything on one thread)
+STRIPE_COUNT = 8                # Horizontal stripes per frame (more than workers evens out the load)
+STRIPE_MIN_ROWS = 64            # Rectangles shorter than this are converted in one call
+OPENCV_THREADS = 1              # cv2.setNumThreads (1 = stripes own the cores; -1 = leave OpenCV default)
+
+# Frame-time governor (steps through QUALITY_LADDER to hold the frame budget)
+GOVERNOR_ENABLED = True
+GOVERNOR_START_LEVEL = 0        # Ladder index to start at (0 = best quality)
+GOVERNOR_HIGH = 0.85            # Frame work above this fraction of the budget counts as "over"
+GOVERNOR_LOW = 0.50             # Below this fraction counts as "under" (gap = hysteresis band)
+GOVERNOR_DOWN_FRAMES = 6        # Consecutive over-budget frames before stepping down
+GOVERNOR_UP_FRAMES = 90         # Consecutive under-budget frames before stepping up (~5 s)
+GOVERNOR_COOLDOWN_FRAMES = 36   # Frames ignored after a change (camera restart, cache warm-up)
+
+# Quality levels, best first: camera stream size, lens remap, upscale interpolation
+# (when the lens remap is off), HUD detail, recording resolution scale and arc tone mapping
+QUALITY_LADDER = [
+    {"name": "lens",    "camera": (320, 360), "lens": True,  "interpolation": "nearest",
+     "hud": "full",    "recording_scale": 1.0, "tonemap": True},
+    {"name": "smooth",  "camera": (320, 360), "lens": False, "interpolation": "linear", 
+     "hud": "full",    "recording_scale": 1.0, "tonemap": True},
+    {"name": "fast",    "camera": (320, 360), "lens": False, "interpolation": "nearest",
+     "hud": "full",    "recording_scale": 1.0, "tonemap": True},
+    {"name": "lite",    "camera": (320, 360), "lens": False, "interpolation": "nearest",
+     "hud": "minimal", "recording_scale": 0.5, "tonemap": False},
+    {"name": "low-res", "camera": (240, 270), "lens": False, "interpolation": "nearest",
+     "hud": "minimal", "recording_scale": 0.5, "tonemap": False},
+    {"name": "minimum", "camera": (160, 180), "lens": False, "interpolation": "nearest",
+     "hud": "minimal", "recording_scale": 0.5, "tonemap": False},
+]
+
+# Latency statistics (capture-to-photon histograms)
+LATENCY_STATS_ENABLED = True
+LATENCY_WINDOW = 10.0           # Seconds per rolling window (stats cover the last 1-2 windows)
+LATENCY_BIN_MS = 0.25           # Histogram bin width
+LATENCY_MAX_MS = 250.0          # Last bin collects everything slower
+LATENCY_STATS_FILE = "/tmp/welding-mask-stats.json"    # Rewritten once per second (None disables)
+LATENCY_STATS_SOCKET = "/tmp/welding-mask-stats.sock"  # Replies with the same JSON (None disables)
+
+# Sensor telemetry log (fixed-width records in a preallocated, mmap'd ring file)
+TELEMETRY_ENABLED = True
+TELEMETRY_FILE = "/home/maska/telemetry/telemetry.bin"  # Rotates in place (oldest records overwritten)
+TELEMETRY_INTERVAL = 1.0        # Seconds between records
+TELEMETRY_RECORDS = 172800      # Ring capacity (48 h @ 1 s, 36 bytes per record = ~6 MB)
+CO_TWA_SHORT = 15 * 60          # Short-term CO time-weighted average window (seconds)
+CO_TWA_LONG = 8 * 3600          # Shift CO time-weighted average window (seconds)
+CO_WARNING_VOLTAGE = 1.4        # MQ-07 sensor volts from which air is "Warning" (HUD CO averages turn red)
 
 # Recording settings
 RECORDING_TRIGGER_THRESHOLD = 50    # Light level below this triggers recording start/stop
@@ -67,6 +199,346 @@ RECORDING_TRIGGER_DURATION = 3.0    # Seconds to hold photoresistor covered
 RECORDING_OUTPUT_DIR = "/home/maska/recordings"  # Directory for saved recordings
 RECORDING_FPS = 18                  # Recording FPS (match target FPS)
 RECORDING_CODEC = "mp4v"            # MP4 codec (MJPEG: 'MJPG', H264: 'avc1', MPEG4: 'mp4v')
+RECORDING_SOURCE = "camera"         # "camera" (raw eye frames + sensor sidecar) or "composite" (HUD view)
+RECORDING_QUEUE_SLOTS = 36          # Shared-memory frame slots (~2 s of raw frames; composite slots are ~6 MB each)
+RECORDING_SEGMENT_SECONDS = 300     # Start a new output file every N seconds
+PREROLL_SECONDS = 8.0               # Camera frames from before the trigger added to each recording (0 = off)
+PREROLL_MEMORY_MB = 16              # Ceiling of the JPEG pre-roll ring in the encoder process
+PREROLL_JPEG_QUALITY = 80           # Pre-roll frames are kept JPEG-compressed (~25 KB at 320x360)
+
+# Live preview for a second viewer (shared-memory ring -> MJPEG over HTTP in a separate process)
+PREVIEW_ENABLED = False             # Also --preview
+PREVIEW_PORT = 8080                 # http://<mask>:8080/ (stream: /stream.mjpg, still: /frame.jpg)
+PREVIEW_BIND = "0.0.0.0"            # Listen address ("127.0.0.1" = this device only)
+PREVIEW_FPS = 6                     # Rate cap: frames published / encoded per second
+PREVIEW_WIDTH = 640                 # JPEG width (height keeps the camera aspect)
+PREVIEW_JPEG_QUALITY = 70          # JPEG quality (~30 KB per frame at 640 px)
+PREVIEW_SLOTS = 3                   # Shared-memory frame slots (reader takes the newest complete one)
+PREVIEW_STATE_BYTES = 512           # HUD state (JSON) per slot
+PREVIEW_NICE = 10                   # Server process CPU priority (higher = yields to the render process)
+
+# Session record/replay (--record-session / --replay: reproduce field problems off-device)
+SESSION_WRITE_BUFFER = 4 * 1024 * 1024  # Session file write buffer (raw frames are ~6 MB/s at 320x360)
+REPLAY_PRESENT_TIMEOUT = 1.0            # Max seconds to wait for a replayed frame to reach the framebuffer
+
+# Fast boot (splash before the heavy imports, camera opened in the background)
+SPLASH_ENABLED = True
+SPLASH_DIR = "/home/maska/.cache/splash"  # Precomputed raw RGB565 splash per panel size (written on first run)
+CAMERA_INIT_ATTEMPTS = 7        # Picamera2() attempts while libcamera is still starting
+CAMERA_INIT_BACKOFF = 0.25      # First retry delay (seconds), doubled per attempt
+CAMERA_INIT_BACKOFF_MAX = 4.0   # Retry delay ceiling (seconds)
+
+# Simulated hardware (off-device runs: --camera synthetic --adc sim --display memory)
+SIM_CAMERA_FPS = 30         # Synthetic/video camera frame rate
+SIM_ARC_PERIOD = 10.0       # Seconds between simulated arc strikes
+SIM_ARC_DURATION = 4.0      # Seconds the simulated arc burns
+SIM_CO_RAMP_PERIOD = 60.0   # Seconds for one simulated CO rise-and-fall cycle
+SIM_CAMERA_HANG_AFTER = None  # Synthetic/video camera wedges after N seconds until restarted (None = never)
+
+# ============================================================================
+# COMMAND LINE
+# ============================================================================
+
+def parse_args(argv=None):
+    """
+    Parse command line options (hardware backend selection).
+
+    Args:
+        argv (list): Arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="AR Welding Mask")
+    parser.add_argument("--camera", choices=("picamera2", "synthetic", "video"), default="picamera2",
+                        help="camera backend (default: picamera2)")
+    parser.add_argument("--video", metavar="PATH", help="video file for --camera video")
+    parser.add_argument("--capture-format", choices=("RGB888", "YUV420"), default=CAPTURE_FORMAT,
+                        help=f"camera stream format (default: {CAPTURE_FORMAT})")
+    parser.add_argument("--adc", choices=("spidev", "sim"), default="spidev",
+                        help="sensor ADC backend (default: spidev MCP3008)")
+    parser.add_argument("--display", choices=("fbdev", "file", "memory"), default="fbdev",
+                        help="display sink (default: fbdev)")
+    parser.add_argument("--fb-path", metavar="PATH",
+                        help=f"framebuffer device or file (default: {FB_DEVICE})")
+    parser.add_argument("--vsync", action="store_true", default=PRESENT_VSYNC,
+                        help="align framebuffer writes to vertical blank (FBIO_WAITFORVSYNC)")
+    parser.add_argument("--sim-hang", type=float, default=SIM_CAMERA_HANG_AFTER, metavar="SECONDS",
+                        help="synthetic/video camera wedges after this many seconds (tests the stall supervisor)")
+    parser.add_argument("--preview", action="store_true", default=PREVIEW_ENABLED,
+                        help="serve a live MJPEG preview over HTTP for a second viewer")
+    parser.add_argument("--preview-port", type=int, default=PREVIEW_PORT, metavar="PORT",
+                        help=f"preview HTTP port (default: {PREVIEW_PORT})")
+    parser.add_argument("--preview-fps", type=float, default=PREVIEW_FPS, metavar="FPS",
+                        help=f"preview rate cap (default: {PREVIEW_FPS})")
+    parser.add_argument("--preview-width", type=int, default=PREVIEW_WIDTH, metavar="PIXELS",
+                        help=f"preview JPEG width (default: {PREVIEW_WIDTH})")
+    parser.add_argument("--duration", type=float, default=0.0, metavar="SECONDS",
+                        help="exit after this many seconds (0 = run until Ctrl+C)")
+    parser.add_argument("--telemetry-file", metavar="PATH", default=TELEMETRY_FILE,
+                        help=f"sensor telemetry ring file (default: {TELEMETRY_FILE})")
+    parser.add_argument("--telemetry-report", action="store_true",
+                        help="print a shift summary of the telemetry file and exit")
+    parser.add_argument("--record-session", metavar="PATH",
+                        help="record ADC rounds, rendered frames and frame times for --replay")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="replay a recorded session instead of the camera/ADC (virtual clock)")
+    parser.add_argument("--replay-log", metavar="PATH",
+                        help="control calls and framebuffer checksums of the replay (default: <session>.log)")
+    parser.add_argument("--replay-speed", type=float, default=1.0, metavar="X",
+                        help="replay speed: 1 = real time, 0 = as fast as possible (default: 1)")
+    args = parser.parse_args(argv)
+    if args.camera == "video" and not args.video:
+        parser.error("--camera video requires --video PATH")
+    return args
+
+# ============================================================================
+# FAST BOOT
+# ============================================================================
+# Startup is staged so the display lights up before the slow parts run:
+#   1. standard library only: precomputed RGB565 splash + status bar on the framebuffer
+#   2. Picamera2 opened in a background thread (exponential backoff while libcamera starts)
+#      while numpy/cv2 are imported (seconds on the Pi Zero 2 W)
+#   3. main(): sensors, pipeline, first frame (time-to-first-frame is reported)
+
+# Linux fbdev ioctls (linux/fb.h)
+FBIOGET_VSCREENINFO = 0x4600
+FBIOGET_FSCREENINFO = 0x4602
+FBIO_WAITFORVSYNC = 0x40044620  # _IOW('F', 0x20, __u32)
+FB_VAR_SCREENINFO_SIZE = 160
+FB_FIX_SCREENINFO_SIZE = 128  # Larger than the struct on both 32/64-bit kernels
+
+# Status bar colours (RGB565)
+BOOT_COLOR_PROGRESS = 0xFD20  # Orange
+BOOT_COLOR_TRACK = 0x2104     # Dark grey
+BOOT_COLOR_ERROR = 0xF800     # Red
+
+def process_start_time():
+    """
+    Monotonic time at which this process was started (includes interpreter startup).
+
+    Returns:
+        float: time.monotonic() value, or now when /proc is unavailable
+    """
+    now = time.monotonic()
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+        return now - max(0.0, age)
+    except (OSError, ValueError, IndexError):
+        return now
+
+BOOT_START = process_start_time()
+
+def query_fb_geometry(fd):
+    """
+    Read visible resolution, depth and line length from the fbdev driver.
+
+    Args:
+        fd (int): Open framebuffer device
+
+    Returns:
+        tuple: (width, height, stride_bytes, bits_per_pixel)
+    """
+    var = bytearray(FB_VAR_SCREENINFO_SIZE)
+    fcntl.ioctl(fd, FBIOGET_VSCREENINFO, var)
+    xres, yres, _, _, _, _, bpp = struct.unpack_from("7I", var)
+
+    fix = bytearray(FB_FIX_SCREENINFO_SIZE)
+    fcntl.ioctl(fd, FBIOGET_FSCREENINFO, fix)
+    line_length = struct.unpack_from("16sLIIIIHHHI", fix)[-1]
+    return xres, yres, line_length, bpp
+
+def splash_path(width, height, splash_dir=SPLASH_DIR):
+    """Precomputed splash file for a panel size."""
+    return os.path.join(splash_dir, f"splash_{width}x{height}.rgb565")
+
+class BootSplash:
+    """
+    Splash screen written with the standard library only (numpy/cv2 not loaded yet).
+    Copies the precomputed raw RGB565 splash for the panel size into the
+    mapped framebuffer and draws a status bar under it; the bar turns red
+    while the camera is retrying. Without a cached splash only the bar is shown.
+    """
+
+    def __init__(self, device=FB_DEVICE, splash_dir=SPLASH_DIR):
+        self.fd = os.open(device, os.O_RDWR)
+        try:
+            self.width, self.height, self.stride, bpp = query_fb_geometry(self.fd)
+            if bpp != 16:
+                raise OSError(f"{bpp} bpp framebuffer")
+            self.mm = mmap.mmap(self.fd, self.stride * self.height,
+                                mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+        row = self.width * 2
+        try:
+            with open(splash_path(self.width, self.height, splash_dir), "rb") as f:
+                image = f.read()
+        except OSError:
+            image = b""
+        if len(image) == row * self.height:
+            if self.stride == row:
+                self.mm[:len(image)] = image
+            else:
+                for y in range(self.height):
+                    self.mm[y * self.stride:y * self.stride + row] = image[y * row:(y + 1) * row]
+        else:
+            self.mm[:] = bytes(len(self.mm))
+
+        # Status bar: centered, near the bottom edge
+        self.bar_x = self.width // 4
+        self.bar_width = self.width // 2
+        self.bar_y = self.height - self.height // 8
+        self.bar_height = max(4, self.height // 90)
+        self.status(0.0)
+
+    def status(self, fraction, color=BOOT_COLOR_PROGRESS):
+        """
+        Draw the status bar.
+
+        Args:
+            fraction (float): Boot progress 0..1
+            color (int): RGB565 colour of the filled part
+        """
+        filled = int(self.bar_width * max(0.0, min(1.0, fraction)))
+        line = (color.to_bytes(2, "little") * filled
+                + BOOT_COLOR_TRACK.to_bytes(2, "little") * (self.bar_width - filled))
+        for y in range(self.bar_y, self.bar_y + self.bar_height):
+            offset = y * self.stride + self.bar_x * 2
+            self.mm[offset:offset + len(line)] = line
+
+    def close(self, clear=True):
+        """Unmap the framebuffer (clear=True blanks it for the pipeline, which only draws its rects)."""
+        if clear:
+            self.mm[:] = bytes(len(self.mm))
+        self.mm.close()
+        os.close(self.fd)
+
+def open_picamera(attempts=CAMERA_INIT_ATTEMPTS, backoff=CAMERA_INIT_BACKOFF, on_retry=None):
+    """
+    Create Picamera2, retrying with exponential backoff while libcamera starts.
+
+    Args:
+        attempts (int): Tries before giving up
+        backoff (float): First retry delay in seconds (doubled up to CAMERA_INIT_BACKOFF_MAX)
+        on_retry (callable): Called with the attempt number before each retry
+
+    Returns:
+        Picamera2: Opened camera
+    """
+    from picamera2 import Picamera2
+    delay = backoff
+    for attempt in range(attempts):
+        try:
+            picam2 = Picamera2()
+            print("Camera initialized successfully")
+            return picam2
+        except RuntimeError as e:
+            if attempt == attempts - 1:
+                print(f"Camera init failed after {attempts} attempts: {e}")
+                raise
+            print(f"Camera init failed (attempt {attempt + 1}/{attempts}): {e}, retrying in {delay:.2f} s")
+            if on_retry is not None:
+                on_retry(attempt)
+            time.sleep(delay)
+            delay = min(delay * 2, CAMERA_INIT_BACKOFF_MAX)
+
+class CameraOpener:
+    """Opens Picamera2 in a background thread (the picamera2 import and libcamera start overlap the rest of startup)."""
+
+    def __init__(self, on_retry=None):
+        self.picam2 = None
+        self.error = None
+        self.opened_at = None  # time.monotonic() when the camera was ready
+        self.on_retry = on_retry
+        self.thread = Thread(target=self._open, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        try:
+            self.picam2 = open_picamera(on_retry=self.on_retry)
+            self.opened_at = time.monotonic()
+        except Exception as e:
+            self.error = e
+
+    def result(self):
+        """
+        Wait for the camera.
+
+        Returns:
+            Picamera2: Opened camera (raises the open error if it failed)
+        """
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.picam2
+
+class FastBoot:
+    """
+    Stage 1 of startup: splash and background camera open, before the heavy imports.
+
+    Args:
+        args (Namespace): Parsed command line
+    """
+
+    def __init__(self, args):
+        self.splash = None
+        self.camera = None
+        self.imports_done = None
+        if SPLASH_ENABLED and args.display == "fbdev" and not (args.telemetry_report or args.replay):
+            try:
+                self.splash = BootSplash(args.fb_path or FB_DEVICE)
+            except OSError as e:
+                print(f"Boot splash unavailable: {e}")
+        if args.camera == "picamera2" and not (args.telemetry_report or args.replay):
+            self.camera = CameraOpener(on_retry=self._camera_retry)
+        self.status(0.2)
+
+    def _camera_retry(self, attempt):
+        self.status(0.3, BOOT_COLOR_ERROR)
+
+    def status(self, fraction, color=BOOT_COLOR_PROGRESS):
+        """Advance the splash status bar (no-op without a splash)."""
+        if self.splash is not None:
+            try:
+                self.splash.status(fraction, color)
+            except (ValueError, OSError):
+                pass
+
+    def finish(self):
+        """Hand the framebuffer over to the pipeline."""
+        if self.splash is not None:
+            self.splash.close()
+            self.splash = None
+
+    def startup_ms(self, first_frame):
+        """
+        Boot stage timings.
+
+        Args:
+            first_frame (float): time.monotonic() when the first frame was presented
+
+        Returns:
+            dict: Milliseconds since process start: imports, camera (if opened early), first_frame
+        """
+        result = {"first_frame": round((first_frame - BOOT_START) * 1000.0, 1)}
+        if self.imports_done is not None:
+            result["imports"] = round((self.imports_done - BOOT_START) * 1000.0, 1)
+        if self.camera is not None and self.camera.opened_at is not None:
+            result["camera"] = round((self.camera.opened_at - BOOT_START) * 1000.0, 1)
+        return result
+
+boot = FastBoot(parse_args()) if __name__ == "__main__" else None
+
+import numpy as np  # noqa: E402 (after the splash: these take seconds on the Pi Zero 2 W)
+import cv2  # noqa: E402
+
+if boot is not None:
+    boot.imports_done = time.monotonic()
+    boot.status(0.6)
 
 # ============================================================================
 # SENSOR CALIBRATION (from sensor_test.py)
@@ -74,6 +546,8 @@ RECORDING_CODEC = "mp4v"            # MP4 codec (MJPEG: 'MJPG', H264: 'avc1', MP
 
 VREF = 3.3  # MCP3008 reference voltage
 
+spi = None  # spidev.SpiDev, opened by create_adc("spidev")
+
 def read_adc(channel):
     """
     Read ADC value from MCP3008 channel.
@@ -150,7 +624,7 @@ def calculate_mq07_status(adc_value):
     if v_sensor <= 0.8:
         status = "Good"
         dangerous = False
-    elif v_sensor < 1.4:
+    elif v_sensor < CO_WARNING_VOLTAGE:
         status = "Acceptable"
         dangerous = False
     elif v_sensor < 2.8:
@@ -188,181 +662,2484 @@ def calculate_light_level(adc_value):
         status = "Bright"
     else:
         status = "Very Bright"
-    
+
     return adc_value, status
 
 # ============================================================================
-# FRAME CAPTURE THREAD
+# SENSOR SAMPLER THREAD
 # ============================================================================
 
-class FrameProcessor:
-    """Thread-safe camera frame capture."""
-    
-    def __init__(self, picam2):
-        self.picam2 = picam2
+SPI_IOC_TRANSFER_SIZE = 32  # sizeof(struct spi_ioc_transfer)
+
+def spi_ioc_message(count):
+    """SPI_IOC_MESSAGE(count) ioctl request number (linux/spi/spidev.h)."""
+    return 0x40006B00 | ((count * SPI_IOC_TRANSFER_SIZE) << 16)
+
+class Mcp3008Reader:
+    """
+    Batched MCP3008 reader.
+    All conversions of a round (channels x oversample) go out as one
+    SPI_IOC_MESSAGE ioctl with chip-select toggled between transfers,
+    instead of one xfer2() syscall per conversion. Falls back to read_adc()
+    when the spidev node can't be driven directly.
+    """
+
+    def __init__(self, channels, oversample=SENSOR_OVERSAMPLE,
+                 bus=SPI_BUS, device=SPI_DEVICE, speed=SPI_SPEED):
+        self.channels = tuple(channels)
+        self.oversample = oversample
+        count = len(self.channels) * oversample
+        self.sums = [0] * len(self.channels)
+
+        # Fixed tx/rx buffers: 3 bytes per conversion (start bit, single-ended + channel, 0)
+        tx = bytearray()
+        for _ in range(oversample):
+            for channel in self.channels:
+                tx += bytes([1, (8 + channel) << 4, 0])
+        self.tx = ctypes.create_string_buffer(bytes(tx), len(tx))
+        self.rx = ctypes.create_string_buffer(len(tx))
+        self.rx_view = memoryview(self.rx).cast('B')
+
+        self.fd = None
+        try:
+            self.fd = os.open(f"/dev/spidev{bus}.{device}", os.O_RDWR)
+        except OSError as e:
+            if DEBUG_MODE:
+                print(f"DEBUG: batched SPI unavailable, using per-channel reads: {e}")
+
+        self.message = bytearray(count * SPI_IOC_TRANSFER_SIZE)
+        tx_addr, rx_addr = ctypes.addressof(self.tx), ctypes.addressof(self.rx)
+        for i in range(count):
+            cs_change = 1 if i < count - 1 else 0  # Release CS between conversions
+            struct.pack_into("=QQIIHBBBBBB", self.message, i * SPI_IOC_TRANSFER_SIZE,
+                             tx_addr + 3 * i, rx_addr + 3 * i, 3, speed, 0, 8, cs_change, 0, 0, 0, 0)
+        self.request = spi_ioc_message(count)
+
+    def read(self):
+        """
+        Run one sample round.
+
+        Returns:
+            list: Averaged ADC value (float, 0-1023) per channel, in channel order
+        """
+        n = len(self.channels)
+        sums = self.sums
+        for c in range(n):
+            sums[c] = 0
+
+        if self.fd is not None:
+            fcntl.ioctl(self.fd, self.request, self.message)
+            rx = self.rx_view
+            for i in range(n * self.oversample):
+                sums[i % n] += ((rx[3 * i + 1] & 3) << 8) | rx[3 * i + 2]
+        else:
+            for _ in range(self.oversample):
+                for c, channel in enumerate(self.channels):
+                    sums[c] += read_adc(channel)
+
+        return [s / self.oversample for s in sums]
+
+    def close(self):
+        """Close the spidev node."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class SensorSampler:
+    """
+    Dedicated sensor sampling thread.
+    Samples all channels at a fixed rate, filters them (median or EMA) and
+    appends timestamped raw + filtered values to a preallocated ring. The
+    writer publishes by bumping `count` after a slot is complete, so readers
+    never take a lock; the render loop just reads the latest snapshot.
+    """
+
+    def __init__(self, reader, rate=SENSOR_SAMPLE_RATE, history=SENSOR_HISTORY,
+                 filter_mode=SENSOR_FILTER, median_window=SENSOR_MEDIAN_WINDOW,
+                 ema_alpha=SENSOR_EMA_ALPHA, threaded=True):
+        self.reader = reader
+        self.period = 1.0 / rate
+        self.history = history
+        self.filter_mode = filter_mode
+        self.median_window = median_window
+        self.ema_alpha = ema_alpha
+
+        channels = len(reader.channels)
+        self.timestamps = np.zeros(history, dtype=np.float64)
+        self.raw = np.zeros((history, channels), dtype=np.float32)
+        self.filtered = np.zeros((history, channels), dtype=np.float32)
+        self.count = 0      # Rounds published; newest is at (count - 1) % history
+        self.overruns = 0   # Rounds that started late (sampling rate not met)
+        self.listeners = [] # Called as listener(timestamp, filtered_row) after every round
+
+        # threaded=False: the caller drives sample_once() (session replay)
         self.running = True
-        self.frame = None
-        self.lock = Lock()
-        self.thread = Thread(target=self._capture_frames, daemon=True)
-        self.thread.start()
-    
-    def _capture_frames(self):
-        """Continuously capture frames from camera."""
+        self.thread = None
+        if threaded:
+            self.thread = Thread(target=self._sample_loop, daemon=True)
+            self.thread.start()
+
+    def _filter(self, i):
+        """Compute filtered values for ring slot i from the raw history."""
+        if self.filter_mode == "ema" and self.count > 0:
+            prev = (i - 1) % self.history
+            self.filtered[i] = self.ema_alpha * self.raw[i] + (1.0 - self.ema_alpha) * self.filtered[prev]
+        elif self.filter_mode == "median":
+            window = min(self.count + 1, self.median_window)
+            start = i - window + 1
+            if start >= 0:
+                rows = self.raw[start:i + 1]
+            else:
+                rows = np.concatenate((self.raw[start:], self.raw[:i + 1]))
+            self.filtered[i] = np.median(rows, axis=0)
+        else:
+            self.filtered[i] = self.raw[i]
+
+    def sample_once(self):
+        """Read, filter and publish one round, then notify the listeners."""
+        values = self.reader.read()
+        i = self.count % self.history
+        self.timestamps[i] = clock.time()
+        self.raw[i] = values
+        self._filter(i)
+        self.count += 1  # Publish
+        for listener in self.listeners:
+            listener(self.timestamps[i], self.filtered[i])
+
+    def _sample_loop(self):
+        """Sample at a fixed rate until stopped."""
+        next_time = time.perf_counter()
         while self.running:
             try:
-                captured = self.picam2.capture_array()
-                with self.lock:
-                    self.frame = captured
+                self.sample_once()
             except Exception as e:
-                print(f"Frame capture error: {e}")
+                if DEBUG_MODE:
+                    print(f"Sensor sampler error: {e}")
                 time.sleep(0.1)
-    
-    def get_frame(self):
-        """Get the latest captured frame (thread-safe)."""
-        with self.lock:
-            return self.frame.copy() if self.frame is not None else None
-    
+
+            next_time += self.period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Late: don't try to catch up with a burst of back-to-back rounds
+                self.overruns += 1
+                next_time = time.perf_counter()
+
+    def latest(self):
+        """
+        Latest filtered snapshot.
+
+        Returns:
+            tuple: (timestamp, [adc per channel as int]) or None before the first round
+        """
+        count = self.count
+        if count == 0:
+            return None
+        i = (count - 1) % self.history
+        return float(self.timestamps[i]), [int(v + 0.5) for v in self.filtered[i]]
+
+    def recent(self, n):
+        """
+        Last n rounds, oldest first (copies; for analysis, not the render loop).
+
+        Returns:
+            tuple: (timestamps, raw, filtered) arrays
+        """
+        count = self.count
+        n = min(n, count, self.history)
+        idx = (np.arange(count - n, count)) % self.history
+        return self.timestamps[idx], self.raw[idx], self.filtered[idx]
+
     def stop(self):
-        """Stop the capture thread."""
+        """Stop the sampling thread."""
         self.running = False
-        self.thread.join(timeout=2.0)
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
 
 # ============================================================================
-# DISPLAY RENDERING
+# SENSOR TELEMETRY LOG
 # ============================================================================
+# File layout: 64-byte header (magic, record size, capacity, records written)
+# followed by `capacity` fixed-width records used as a ring. The header count
+# is bumped after each record is complete, so a reader never sees a torn one.
 
-# Pre-calculate frame positioning
-frame_width = int(FB_WIDTH * DISPLAY_SCALE)
-frame_height = int(FB_HEIGHT * DISPLAY_SCALE)
-x_offset = (FB_WIDTH - frame_width) // 2
-y_offset = (FB_HEIGHT - frame_height) // 2
+TELEMETRY_MAGIC = b"WMTELEM1"
+TELEMETRY_HEADER = struct.Struct("<8sIIQ")
+TELEMETRY_HEADER_SIZE = 64
+TELEMETRY_DTYPE = np.dtype([
+    ("time", "<f8"),            # Unix time of the sample
+    ("battery_adc", "<u2"),     # Filtered ADC readings (SensorSampler output)
+    ("mq07_adc", "<u2"),
+    ("light_adc", "<u2"),
+    ("flags", "<u2"),           # TELEMETRY_BATTERY_CRITICAL | TELEMETRY_CO_DANGEROUS
+    ("battery_v", "<f4"),       # calculate_battery_voltage()
+    ("mq07_v", "<f4"),          # calculate_mq07_status() sensor voltage
+    ("dt", "<f4"),              # Seconds this record stands for (time-weighting)
+    ("co_twa_short", "<f4"),    # CO averages at the time of the record
+    ("co_twa_long", "<f4"),
+])
+TELEMETRY_BATTERY_CRITICAL = 1
+TELEMETRY_CO_DANGEROUS = 2
+
+class RollingWindow:
+    """
+    Time-weighted average and min/max of one field over a sliding time window,
+    maintained incrementally over the telemetry ring: each new record adds
+    its value x dt, records that fall out of the window are subtracted, and
+    monotonic index queues give min/max. O(1) amortized per record.
+    The average divides by the full window (shift-exposure convention), so
+    it ramps up over the first `span` seconds.
+    """
 
-# Create background template (reused to avoid allocations)
-background_template = np.zeros((FB_HEIGHT, FB_WIDTH, 3), dtype=np.uint8)
+    def __init__(self, records, field, span):
+        self.records = records
+        self.capacity = len(records)
+        self.field = field
+        self.span = span
+        self.start = 0              # Oldest record (absolute index) inside the window
+        self.integral = 0.0
+        self.min_queue = deque()    # Absolute indices, values increasing
+        self.max_queue = deque()    # Absolute indices, values decreasing
 
-# Pre-allocate RGB565 buffer (reused for framebuffer writes)
-rgb565_buffer = np.zeros((FB_HEIGHT, FB_WIDTH), dtype=np.uint16)
+    def _value(self, n):
+        return float(self.records[n % self.capacity][self.field])
 
-def render_recording_icon(image, recording_active):
+    def add(self, n):
+        """Account for record n (absolute index, appended in order)."""
+        record = self.records[n % self.capacity]
+        now, value = float(record["time"]), float(record[self.field])
+        self.integral += value * float(record["dt"])
+        self.start = max(self.start, n - self.capacity + 1)
+        while self.start < n and float(self.records[self.start % self.capacity]["time"]) <= now - self.span:
+            old = self.records[self.start % self.capacity]
+            self.integral -= float(old[self.field]) * float(old["dt"])
+            self.start += 1
+
+        while self.min_queue and self._value(self.min_queue[-1]) >= value:
+            self.min_queue.pop()
+        self.min_queue.append(n)
+        while self.min_queue[0] < self.start:
+            self.min_queue.popleft()
+        while self.max_queue and self._value(self.max_queue[-1]) <= value:
+            self.max_queue.pop()
+        self.max_queue.append(n)
+        while self.max_queue[0] < self.start:
+            self.max_queue.popleft()
+
+    @property
+    def average(self):
+        return max(0.0, self.integral) / self.span
+
+    @property
+    def minimum(self):
+        return self._value(self.min_queue[0]) if self.min_queue else 0.0
+
+    @property
+    def maximum(self):
+        return self._value(self.max_queue[0]) if self.max_queue else 0.0
+
+class TelemetryLog:
     """
-    Render recording icon (red circle) on HUD.
-    
-    Args:
-        image (ndarray): Image to render icon on
-        recording_active (bool): Whether recording is active
+    Sensor telemetry in a preallocated, mmap'd ring file.
+    Registered as a SensorSampler listener: appends one record every
+    `interval` seconds from the sampler thread and keeps the CO averages
+    and min/max up to date, so the HUD reads plain attributes per frame.
+    An existing file with the same layout is resumed (averages included).
     """
-    if not recording_active:
-        return
-    
-    # Red circle in top-right corner with REC text
-    icon_x = FB_WIDTH - 120
-    icon_y = 50
-    
-    # Pulsing effect (blink every 0.5 seconds)
-    if int(time.time() * 2) % 2 == 0:
-        cv2.circle(image, (icon_x, icon_y), 20, (0, 0, 255), -1)  # Filled red circle
-        cv2.putText(image, "REC", (icon_x + 30, icon_y + 10), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
 
-def render_osd(image, battery_voltage, battery_status, battery_critical,
-               mq07_voltage, mq07_status, mq07_dangerous,
-               light_value, light_status, recording_active=False):
+    def __init__(self, path=TELEMETRY_FILE, channels=(CH_BATTERY, CH_MQ07, CH_LIGHT),
+                 capacity=TELEMETRY_RECORDS, interval=TELEMETRY_INTERVAL,
+                 short_span=CO_TWA_SHORT, long_span=CO_TWA_LONG):
+        if capacity * interval < long_span:
+            raise ValueError("TELEMETRY_RECORDS must cover the CO_TWA_LONG window")
+        self.path = path
+        self.channels = channels          # Positions of battery, MQ-07 and light in a sample row
+        self.capacity = capacity
+        self.interval = interval
+        size = TELEMETRY_HEADER_SIZE + capacity * TELEMETRY_DTYPE.itemsize
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        header = os.pread(self.fd, TELEMETRY_HEADER.size, 0)
+        resume = (len(header) == TELEMETRY_HEADER.size
+                  and TELEMETRY_HEADER.unpack(header)[:3] == (TELEMETRY_MAGIC, TELEMETRY_DTYPE.itemsize, capacity)
+                  and os.fstat(self.fd).st_size >= size)
+        if not resume:
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, size)
+        self.mm = mmap.mmap(self.fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.records = np.ndarray((capacity,), dtype=TELEMETRY_DTYPE, buffer=self.mm,
+                                  offset=TELEMETRY_HEADER_SIZE)
+        self.count = TELEMETRY_HEADER.unpack_from(self.mm)[3] if resume else 0
+        if not resume:
+            self._write_header()
+
+        self.short = RollingWindow(self.records, "mq07_v", short_span)
+        self.long = RollingWindow(self.records, "mq07_v", long_span)
+        self.last_time = 0.0
+        self.next_time = 0.0
+        self.co_twa_short = 0.0
+        self.co_twa_long = 0.0
+        self.co_min = 0.0
+        self.co_max = 0.0
+        if self.count:
+            self._resume()
+
+    def _write_header(self):
+        TELEMETRY_HEADER.pack_into(self.mm, 0, TELEMETRY_MAGIC, TELEMETRY_DTYPE.itemsize,
+                                   self.capacity, self.count)
+
+    def _resume(self):
+        """Rebuild the rolling windows from records still inside the long window."""
+        newest = self.records[(self.count - 1) % self.capacity]
+        self.last_time = float(newest["time"])
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            if float(self.records[n % self.capacity]["time"]) > self.last_time - self.long.span:
+                first = n
+                break
+        self.short.start = self.long.start = first
+        for n in range(first, self.count):
+            self.short.add(n)
+            self.long.add(n)
+        self._publish()
+
+    def _publish(self):
+        """Refresh the attributes the HUD reads."""
+        self.co_twa_short = self.short.average
+        self.co_twa_long = self.long.average
+        self.co_min = self.long.minimum
+        self.co_max = self.long.maximum
+
+    def on_sample(self, timestamp, values):
+        """SensorSampler listener: append a record once per interval."""
+        if timestamp < self.next_time:
+            return
+        self.next_time = timestamp + self.interval
+        try:
+            self.append(timestamp, [int(values[i] + 0.5) for i in self.channels])
+        except Exception as e:
+            if DEBUG_MODE:
+                print(f"Telemetry write error: {e}")
+
+    def append(self, timestamp, adc):
+        """
+        Append one record and update the rolling aggregates.
+
+        Args:
+            timestamp (float): Unix time of the sample
+            adc (list): Battery, MQ-07 and light ADC readings
+        """
+        battery_v, _, battery_critical = calculate_battery_voltage(adc[0])
+        mq07_v, _, mq07_dangerous = calculate_mq07_status(adc[1])
+        # A gap (restart, stall) counts as at most two intervals of the new value
+        dt = min(timestamp - self.last_time, 2.0 * self.interval) if self.last_time else self.interval
+        n = self.count
+        record = self.records[n % self.capacity]
+        record["time"] = timestamp
+        record["battery_adc"], record["mq07_adc"], record["light_adc"] = adc
+        record["flags"] = ((TELEMETRY_BATTERY_CRITICAL if battery_critical else 0)
+                           | (TELEMETRY_CO_DANGEROUS if mq07_dangerous else 0))
+        record["battery_v"] = battery_v
+        record["mq07_v"] = mq07_v
+        record["dt"] = max(dt, 0.0)
+        self.short.add(n)
+        self.long.add(n)
+        self._publish()
+        record["co_twa_short"] = self.co_twa_short
+        record["co_twa_long"] = self.co_twa_long
+        self.count = n + 1
+        self.last_time = timestamp
+        self._write_header()  # Publish
+
+    def close(self):
+        """Flush and unmap the log."""
+        self.records = None
+        self.short.records = self.long.records = None
+        try:
+            self.mm.flush()
+            self.mm.close()
+        except (BufferError, ValueError):
+            pass
+        os.close(self.fd)
+
+def read_telemetry(path=TELEMETRY_FILE):
     """
-    Render on-screen display (OSD) with clean layout.
-    Shows battery, air quality, light level, recording icon. Red border if danger.
-    
+    Read a telemetry log for offline analysis (oldest record first).
+
     Args:
-        image (ndarray): Image to render text on
-        battery_voltage (float): Battery voltage
-        battery_status (str): Battery status text
-        battery_critical (bool): Battery critical flag
-        mq07_voltage (float): MQ-07 voltage
-        mq07_status (str): Air quality status
-        mq07_dangerous (bool): Air quality danger flag
-        light_value (int): Light ADC value
-        light_status (str): Light status text
-        recording_active (bool): Whether recording is active
+        path (str): Telemetry ring file
+
+    Returns:
+        ndarray: Structured TELEMETRY_DTYPE records in time order
     """
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    font_scale = 0.9  # Larger font for better visibility
-    thickness = 2
-    
-    # Battery info (top-left)
-    battery_color = (0, 0, 255) if battery_critical else (0, 255, 0)
-    cv2.putText(image, f"Bat: {battery_voltage:.1f}V ({battery_status})",
-                (20, 50), font, font_scale, battery_color, thickness, cv2.LINE_AA)
-    
-    # Air quality (top-left, below battery) - no voltage display
-    air_color = (0, 0, 255) if mq07_dangerous else (0, 255, 0)
-    cv2.putText(image, f"Air: {mq07_status}",
-                (20, 100), font, font_scale, air_color, thickness, cv2.LINE_AA)
-    
-    # Light level info hidden (commented out)
-    
-    # Recording icon
-    render_recording_icon(image, recording_active)
-    
-    # RED BORDER if danger
-    if mq07_dangerous:
-        cv2.rectangle(image, (5, 5), (FB_WIDTH - 5, FB_HEIGHT - 5), (0, 0, 255), 8)
+    with open(path, "rb") as f:
+        magic, record_size, capacity, count = TELEMETRY_HEADER.unpack(f.read(TELEMETRY_HEADER.size))
+    if magic != TELEMETRY_MAGIC or record_size != TELEMETRY_DTYPE.itemsize:
+        raise ValueError(f"Not a telemetry log (or another record layout): {path}")
+    data = np.fromfile(path, dtype=TELEMETRY_DTYPE, count=capacity, offset=TELEMETRY_HEADER_SIZE)
+    if count <= capacity:
+        return data[:count]
+    start = count % capacity
+    return np.concatenate((data[start:], data[:start]))
 
-def display_on_framebuffer(double_frame, battery_voltage, battery_status, battery_critical,
-                            mq07_voltage, mq07_status, mq07_dangerous,
-                            light_value, light_status, fb_handle=None, recording_active=False):
+def telemetry_twa(records, span, field="mq07_v"):
     """
-    Render dual-view frame with OSD to framebuffer.
-    Optimized: reuses buffers, minimal copies, cached file handle, fast resize.
-    
+    Time-weighted average of a field over a trailing window, for every record
+    (vectorized; same definition as RollingWindow).
+
     Args:
-        double_frame (ndarray): Dual camera view (side-by-side)
-        battery_voltage, battery_status, battery_critical: Battery info
-        mq07_voltage, mq07_status, mq07_dangerous: Air quality info
-        light_value, light_status: Light level info
-        fb_handle: Cached framebuffer file handle (optional)
-        recording_active (bool): Whether recording is active
-    
+        records (ndarray): Records from read_telemetry()
+        span (float): Window length in seconds
+
     Returns:
-        ndarray: The final rendered frame with OSD (for recording)
+        ndarray: float64 average at each record
     """
-    global rgb565_buffer
-    
-    # Resize to fit frame area (use INTER_NEAREST for maximum speed on embedded)
-    resized_image = cv2.resize(double_frame, (frame_width, frame_height), interpolation=cv2.INTER_NEAREST)
+    times = records["time"]
+    weighted = np.zeros(len(records) + 1)
+    np.cumsum(records[field].astype(np.float64) * records["dt"], out=weighted[1:])
+    start = np.searchsorted(times, times - span, side="right")
+    return (weighted[1:] - weighted[start]) / span
 
-    # Copy background and place resized image
-    background = background_template.copy()
-    background[y_offset:y_offset + frame_height, x_offset:x_offset + frame_width] = resized_image
+def telemetry_report(records):
+    """
+    Shift summary of a telemetry log.
 
-    # Render OSD using existing renderer
-    try:
-        render_osd(background, battery_voltage, battery_status, battery_critical,
-                   mq07_voltage, mq07_status, mq07_dangerous,
-                   light_value, light_status, recording_active)
-    except Exception:
-        # fallback: minimal text if render_osd fails
-        try:
-            cv2.putText(background, f'Air: {mq07_status}', (230, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            cv2.putText(background, f'Light: {light_value}', (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        except Exception:
-            pass
+    Returns:
+        dict: Duration, CO averages/extremes and battery range
+    """
+    if len(records) == 0:
+        return {"records": 0}
+    co = records["mq07_v"]
+    return {
+        "records": int(len(records)),
+        "start": datetime.fromtimestamp(float(records["time"][0])).isoformat(timespec="seconds"),
+        "end": datetime.fromtimestamp(float(records["time"][-1])).isoformat(timespec="seconds"),
+        "hours": round(float(records["dt"].sum()) / 3600.0, 2),
+        "co_twa_short_max_v": round(float(telemetry_twa(records, CO_TWA_SHORT).max()), 3),
+        "co_twa_long_max_v": round(float(telemetry_twa(records, CO_TWA_LONG).max()), 3),
+        "co_min_v": round(float(co.min()), 3),
+        "co_max_v": round(float(co.max()), 3),
+        "co_dangerous_minutes": round(float(records["dt"][(records["flags"] & TELEMETRY_CO_DANGEROUS) != 0].sum()) / 60.0, 1),
+        "battery_min_v": round(float(records["battery_v"].min()), 2),
+        "battery_max_v": round(float(records["battery_v"].max()), 2),
+    }
 
-    # Convert to RGB565 (optimized: reuse buffer when possible)
-    try:
-        rgb565_image = cv2.cvtColor(background, cv2.COLOR_BGR2BGR565)
-    except Exception as e:
-        if DEBUG_MODE:
-            print('DEBUG: Color conversion to BGR565 failed:', e)
-        rgb565_image = background
+# ============================================================================
+# YUV420 FRAMES
+# ============================================================================
+# I420 frames are stored as one (h * 3 / 2, w) uint8 array: the Y plane,
+# then the U and V planes at half resolution. Full-range BT.601 (the sYCC
+# colour space Picamera2 uses for YUV420 streams).
 
-    # Write to framebuffer (use cached handle if provided)
-    try:
-        if fb_handle is not None:
-            fb_handle.seek(0)
-            fb_handle.write(rgb565_image.tobytes())
-            fb_handle.flush()
-        else:
-            with open('/dev/fb0', 'wb') as fb:
-                fb.write(rgb565_image.tobytes())
+def capture_shape(width, height, fmt=CAPTURE_FORMAT):
+    """
+    Array shape of one captured frame.
+
+    Args:
+        width, height (int): Stream size
+        fmt (str): "RGB888" or "YUV420"
+
+    Returns:
+        tuple: (height, width, 3) or (height * 3 // 2, width)
+    """
+    if fmt == "YUV420":
+        return (height * 3 // 2, width)
+    return (height, width, 3)
+
+def yuv420_planes(frame):
+    """
+    Y, U and V plane views of an I420 frame.
+
+    Returns:
+        tuple: (y, u, v) with shapes (h, w), (h / 2, w / 2), (h / 2, w / 2)
+    """
+    height, width = frame.shape[0] * 2 // 3, frame.shape[1]
+    quarter = (height // 2) * (width // 2)
+    chroma = frame[height:].reshape(-1)
+    return (frame[:height],
+            chroma[:quarter].reshape(height // 2, width // 2),
+            chroma[quarter:2 * quarter].reshape(height // 2, width // 2))
+
+def copy_yuv420(src, dst):
+    """
+    Copy a (possibly row-padded) Picamera2 YUV420 array into an I420 frame.
+
+    Args:
+        src (ndarray): Mapped stream array of shape (h * 3 / 2, stride)
+        dst (ndarray): I420 frame of shape (h * 3 / 2, w)
+    """
+    y, u, v = yuv420_planes(dst)
+    height, stride = y.shape[0], src.shape[1]
+    np.copyto(y, src[:height, :y.shape[1]])
+    # Chroma rows are stride / 2 bytes long, two per array row
+    chroma = src[height:].reshape(-1)
+    rows, half = height // 2, stride // 2
+    np.copyto(u, chroma[:rows * half].reshape(rows, half)[:, :u.shape[1]])
+    np.copyto(v, chroma[rows * half:2 * rows * half].reshape(rows, half)[:, :v.shape[1]])
+
+def bgr_to_yuv420(image, dst, scratch):
+    """
+    Convert a BGR image into an I420 frame (simulated cameras).
+
+    Args:
+        image (ndarray): BGR image (h, w, 3)
+        dst (ndarray): I420 frame (h * 3 / 2, w)
+        scratch (ndarray): (h, w, 3) uint8 work buffer
+    """
+    cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb, dst=scratch)
+    y, u, v = yuv420_planes(dst)
+    np.copyto(y, scratch[..., 0])
+    np.copyto(u, scratch[::2, ::2, 2])
+    np.copyto(v, scratch[::2, ::2, 1])
+
+def yuv420_to_bgr(frame, dst, scratch):
+    """
+    Convert an I420 frame to BGR (recording; the display path uses Yuv565Converter).
+
+    Args:
+        frame (ndarray): I420 frame (h * 3 / 2, w)
+        dst (ndarray): BGR output (h, w, 3)
+        scratch (ndarray): (h, w, 3) uint8 work buffer
+    """
+    y, u, v = yuv420_planes(frame)
+    height, width = y.shape
+    np.copyto(scratch[..., 0], y)
+    pairs = scratch.reshape(height // 2, 2, width // 2, 2, 3)
+    np.copyto(pairs[..., 1], v[:, None, :, None])
+    np.copyto(pairs[..., 2], u[:, None, :, None])
+    cv2.cvtColor(scratch, cv2.COLOR_YCrCb2BGR, dst=dst)
+
+def build_yuv565_lut():
+    """
+    Build the YUV -> RGB565 lookup table.
+    Indexed by (Y >> 2) << 10 | (U >> 3) << 5 | (V >> 3): 6 bits of luma
+    (the resolution of RGB565 green) and 5 bits per chroma channel, each
+    entry computed at the centre of its bin. 64K entries, 128 KB.
+
+    Returns:
+        ndarray: uint16 LUT of 65536 RGB565 pixels (same packing as COLOR_BGR2BGR565)
+    """
+    y = (np.arange(64, dtype=np.float64) * 4 + 2)[:, None, None]
+    u = (np.arange(32, dtype=np.float64) * 8 + 4 - 128)[None, :, None]
+    v = (np.arange(32, dtype=np.float64) * 8 + 4 - 128)[None, None, :]
+    r = np.clip(np.rint(y + 1.402 * v), 0, 255).astype(np.uint16)
+    g = np.clip(np.rint(y - 0.344136 * u - 0.714136 * v), 0, 255).astype(np.uint16)
+    b = np.clip(np.rint(y + 1.772 * u), 0, 255).astype(np.uint16)
+    return ((r >> 3) << 11 | (g >> 2) << 5 | (b >> 3)).ravel()
+
+class Yuv565Converter:
+    """
+    I420 -> RGB565 at camera resolution through one LUT lookup per pixel.
+    Index buffers are preallocated per frame size; chroma is indexed once
+    per 2x2 block and replicated with a broadcast copy.
+    """
+
+    def __init__(self):
+        self.lut = build_yuv565_lut()
+        self.shape = None
+
+    def _allocate(self, height, width):
+        # intp: np.take would otherwise convert the index to a temporary intp array
+        self.shape = (height, width)
+        self.index = np.empty((height, width), dtype=np.intp)
+        self.luma = np.empty((height, width), dtype=np.intp)
+        self.chroma = np.empty((height // 2, width // 2), dtype=np.intp)
+        self.scratch = np.empty((height // 2, width // 2), dtype=np.intp)
+
+    def convert(self, frame, dst):
+        """
+        Convert an I420 frame into a packed RGB565 image.
+
+        Args:
+            frame (ndarray): I420 frame (h * 3 / 2, w)
+            dst (ndarray): uint16 output (h, w)
+        """
+        y, u, v = yuv420_planes(frame)
+        height, width = y.shape
+        if self.shape != (height, width):
+            self._allocate(height, width)
+        np.right_shift(u, 3, out=self.chroma)
+        np.left_shift(self.chroma, 5, out=self.chroma)
+        np.right_shift(v, 3, out=self.scratch)
+        np.bitwise_or(self.chroma, self.scratch, out=self.chroma)
+        np.copyto(self.index.reshape(height // 2, 2, width // 2, 2), self.chroma[:, None, :, None])
+        np.right_shift(y, 2, out=self.luma)
+        np.left_shift(self.luma, 10, out=self.luma)
+        np.bitwise_or(self.index, self.luma, out=self.index)
+        np.take(self.lut, self.index, out=dst, mode="clip")  # "clip": no buffered copy of out
+
+# ============================================================================
+# HARDWARE BACKENDS
+# ============================================================================
+# Camera backends: start(), capture_into(dst) -> sensor timestamp (ns, CLOCK_MONOTONIC),
+#                  set_controls(dict), restart() (stalled capture), stop()
+# ADC backends:    channels, read() -> [value per channel], close()
+# Display:         FramebufferWriter on /dev/fb0, a plain file, or memory (path=None)
+
+_simulation_start = time.monotonic()
+
+def simulation_time():
+    """Seconds since the simulated scene started."""
+    return time.monotonic() - _simulation_start
+
+def simulated_arc_active(t):
+    """True while the scripted welding arc is burning at time t."""
+    return t % SIM_ARC_PERIOD < SIM_ARC_DURATION
+
+def simulated_adc_value(channel, t):
+    """
+    Scripted ADC reading for a channel at time t.
+    Light: ambient ~520 with arc flashes to ~980; MQ-07: triangular CO ramp
+    from Good up into DANGER and back; battery: slow discharge from Full.
+
+    Args:
+        channel (int): MCP3008 channel
+        t (float): Simulation time in seconds
+
+    Returns:
+        float: ADC value (0-1023)
+    """
+    if channel == CH_LIGHT:
+        if simulated_arc_active(t):
+            return 980.0 - 25.0 * abs(np.sin(t * 60.0))  # Arc flicker
+        return 520.0
+    if channel == CH_MQ07:
+        phase = (t % SIM_CO_RAMP_PERIOD) / SIM_CO_RAMP_PERIOD
+        ramp = 1.0 - abs(2.0 * phase - 1.0)
+        return 150.0 + 350.0 * ramp
+    if channel == CH_BATTERY:
+        return max(300.0, 430.0 - t / 60.0)
+    return 0.0
+
+class SimulatedAdc:
+    """Scripted signal generator standing in for the MCP3008 (arc flashes, CO ramps)."""
+
+    def __init__(self, channels, noise=2.0, seed=0):
+        self.channels = tuple(channels)
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+    def read(self):
+        """Return one sample round (same format as Mcp3008Reader.read)."""
+        t = simulation_time()
+        return [min(1023.0, max(0.0, simulated_adc_value(ch, t) + self.rng.normal(0.0, self.noise)))
+                for ch in self.channels]
+
+    def close(self):
+        """Nothing to release."""
+
+class PicameraBackend:
+    """Raspberry Pi camera through Picamera2 (imported lazily, so off-Pi runs don't need it)."""
+
+    def __init__(self, width, height, controls, fmt=CAPTURE_FORMAT, opener=None):
+        from picamera2 import MappedArray
+        self.mapped_array = MappedArray
+        self.format = fmt
+
+        # Opened during boot (CameraOpener), or here with the same backoff (libcamera may still be starting)
+        self.picam2 = opener.result() if opener is not None else open_picamera()
+
+        # Guards the picam2 swap in restart() against set_controls() from the sampler / main threads
+        self.control_lock = Lock()
+        self.controls = dict(controls)  # Everything set so far (re-applied after a restart)
+        self.picam2.set_controls(controls)
+        self.width, self.height = width, height
+        self._configure(self.picam2)
+
+    def _configure(self, picam2):
+        # Configure camera for dual-view (half-width per eye)
+        picam2.configure(picam2.create_preview_configuration(
+            main={"size": (self.width, self.height), "format": self.format}
+        ))
+
+    def start(self):
+        self.picam2.start()
+
+    def reconfigure(self, width, height):
+        """Switch the stream size (stop, configure, start; the process keeps running)."""
+        self.picam2.stop()
+        self.width, self.height = width, height
+        self._configure(self.picam2)
+        self.picam2.start()
+
+    def capture_into(self, dst):
+        """
+        Copy the next camera frame into dst (no capture_array() allocation).
+
+        Returns:
+            int: SensorTimestamp of the frame (ns), capture time if unavailable
+        """
+        request = self.picam2.capture_request()
+        try:
+            with self.mapped_array(request, "main") as mapped:
+                if dst.ndim == 2:
+                    copy_yuv420(mapped.array, dst)
+                else:
+                    np.copyto(dst, mapped.array[:dst.shape[0], :dst.shape[1], :3])
+            return request.get_metadata().get("SensorTimestamp") or time.monotonic_ns()
+        finally:
+            request.release()
+
+    def set_controls(self, controls):
+        with self.control_lock:
+            self.controls.update(controls)
+            if self.picam2 is not None:  # None while restart() re-creates it (applied there)
+                self.picam2.set_controls(controls)
+
+    def restart(self):
+        """
+        Tear down and re-create Picamera2 (stalled capture), keeping size,
+        format and the exposure controls. Controls set meanwhile (an arc
+        strike) are only recorded, and the latest ones are applied to the new
+        instance once it runs.
+        """
+        with self.control_lock:
+            old = self.picam2
+            self.picam2 = None
+
+        def close():
+            try:
+                old.stop()
+                old.close()
+            except Exception as e:
+                print(f"Camera teardown error: {e}")
+
+        # A wedged libcamera may never return from stop(): don't wait for it forever
+        if old is not None:  # None: the previous restart failed to open the camera
+            teardown = Thread(target=close, daemon=True)
+            teardown.start()
+            teardown.join(CAMERA_TEARDOWN_TIMEOUT)
+        picam2 = open_picamera()
+        with self.control_lock:
+            picam2.set_controls(self.controls)
+        self._configure(picam2)
+        picam2.start()
+        with self.control_lock:
+            picam2.set_controls(self.controls)  # Latest exposure (anything set during the restart)
+            self.picam2 = picam2
+
+    def stop(self):
+        if self.picam2 is not None:
+            self.picam2.stop()
+
+class SyntheticCamera:
+    """
+    Synthetic camera producing frames at a fixed rate.
+    Scrolling workpiece pattern whose brightness follows the requested
+    AnalogueGain/ExposureTime, with an arc blob while the scripted arc burns.
+    I420 frames are rendered in BGR and converted.
+    """
+
+    def __init__(self, width, height, controls, fps=SIM_CAMERA_FPS, fmt=CAPTURE_FORMAT, hang_after=None):
+        self.width, self.height = width, height
+        self.format = fmt
+        self.frame_time = 1.0 / fps
+        self.next_frame = time.perf_counter()
+        self.frame_no = 0
+        self.hang_after = hang_after  # Wedge (block in capture_into) this long after start()
+        self.hang_at = None
+        self.released = Event()       # Set by restart()/stop(): the wedged capture returns
+        self.gain = 6.0
+        self.exposure = 10000
+        self.set_controls(controls)
+        self.reconfigure(width, height)
+
+    def reconfigure(self, width, height):
+        """Switch the frame size."""
+        self.width, self.height = width, height
+        # Twice as wide as a frame so each frame is a scrolled window (no per-frame generation)
+        xs = np.linspace(40, 140, 2 * width, dtype=np.float32)[None, :]
+        ys = np.linspace(0, 40, height, dtype=np.float32)[:, None]
+        plate = (xs + ys).astype(np.uint8)
+        plate[::24, :] = 30   # Plate seams
+        plate[:, ::48] = 30
+        self.pattern = cv2.merge([plate, plate, (plate * 0.9).astype(np.uint8)])
+        if self.format == "YUV420":
+            self.bgr = np.empty((height, width, 3), dtype=np.uint8)
+            self.ycrcb = np.empty((height, width, 3), dtype=np.uint8)
+
+    def _target(self, dst):
+        """BGR buffer to render into: dst itself, or the scratch frame for I420."""
+        return self.bgr if dst.ndim == 2 else dst
+
+    def _finish(self, image, dst):
+        """Convert the rendered BGR image into an I420 dst."""
+        if image is not dst:
+            bgr_to_yuv420(image, dst, self.ycrcb)
+
+    def start(self):
+        self.next_frame = time.perf_counter()
+        if self.hang_after is not None:
+            self.hang_at = time.monotonic() + self.hang_after
+
+    def _check_hang(self):
+        """Simulated libcamera wedge: block until restart() or stop()."""
+        if self.hang_at is not None and time.monotonic() >= self.hang_at:
+            self.released.wait()
+            raise RuntimeError("Capture aborted (camera restarted)")
+
+    def restart(self):
+        """Re-create the simulated device (clears the wedge, controls are kept)."""
+        self.hang_at = None
+        self.released.set()
+        self.next_frame = time.perf_counter()
+
+    def capture_into(self, dst):
+        """Block until the next frame is due, then render it into dst."""
+        self._check_hang()
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame + self.frame_time, time.perf_counter())
+        sensor_time = time.monotonic_ns()
+
+        offset = self.frame_no % self.width
+        self.frame_no += 1
+        image = self._target(dst)
+        np.copyto(image, self.pattern[:, offset:offset + self.width])
+
+        # Arc: small saturated blob with glow; camera brightness from gain x exposure
+        light = 8.0 if simulated_arc_active(simulation_time()) else 1.0
+        if light > 1.0:
+            center = (self.width // 2, self.height // 2)
+            cv2.circle(image, center, 30, (120, 140, 160), -1, cv2.LINE_AA)
+            cv2.circle(image, center, 10, (255, 255, 255), -1, cv2.LINE_AA)
+        scale = light * self.gain * self.exposure / 60000.0
+        cv2.convertScaleAbs(image, image, alpha=scale)
+        self._finish(image, dst)
+        return sensor_time
+
+    def set_controls(self, controls):
+        self.gain = controls.get("AnalogueGain", self.gain)
+        self.exposure = controls.get("ExposureTime", self.exposure)
+        if "FrameDurationLimits" in controls:
+            self.frame_time = controls["FrameDurationLimits"][1] / 1e6
+
+    def stop(self):
+        self.released.set()
+
+class VideoFileCamera(SyntheticCamera):
+    """Video file played back (looped) at a fixed rate as the camera source."""
+
+    def __init__(self, width, height, controls, path, fps=SIM_CAMERA_FPS, fmt=CAPTURE_FORMAT, hang_after=None):
+        super().__init__(width, height, controls, fps, fmt, hang_after)
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise RuntimeError(f"Could not open video file: {path}")
+        self.decoded = None
+
+    def capture_into(self, dst):
+        self._check_hang()
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame = max(self.next_frame + self.frame_time, time.perf_counter())
+        sensor_time = time.monotonic_ns()
+
+        ok, self.decoded = self.capture.read(self.decoded)
+        if not ok:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)  # Loop
+            ok, self.decoded = self.capture.read(self.decoded)
+            if not ok:
+                raise RuntimeError("Video file has no frames")
+        image = self._target(dst)
+        cv2.resize(self.decoded, (self.width, self.height), dst=image, interpolation=cv2.INTER_AREA)
+        self._finish(image, dst)
+        return sensor_time
+
+    def stop(self):
+        self.released.set()
+        self.capture.release()
+
+def create_camera(kind, controls, video_path=None, fmt=CAPTURE_FORMAT, opener=None, hang_after=None):
+    """
+    Create a camera backend.
+
+    Args:
+        kind (str): "picamera2", "synthetic" or "video"
+        controls (dict): Initial camera controls
+        video_path (str): Source file for "video"
+        fmt (str): Capture format, "RGB888" or "YUV420"
+        opener (CameraOpener): Picamera2 being opened in the background (fast boot)
+        hang_after (float): Simulated cameras wedge after this many seconds (stall tests)
+    """
+    if kind == "picamera2":
+        return PicameraBackend(CAMERA_WIDTH, CAMERA_HEIGHT, controls, fmt, opener)
+    if kind == "synthetic":
+        return SyntheticCamera(CAMERA_WIDTH, CAMERA_HEIGHT, controls, fmt=fmt, hang_after=hang_after)
+    if kind == "video":
+        return VideoFileCamera(CAMERA_WIDTH, CAMERA_HEIGHT, controls, video_path, fmt=fmt,
+                               hang_after=hang_after)
+    raise ValueError(f"Unknown camera backend: {kind}")
+
+def create_adc(kind, channels):
+    """
+    Create an ADC backend.
+
+    Args:
+        kind (str): "spidev" (MCP3008) or "sim" (scripted signals)
+        channels (tuple): Channels to sample per round
+    """
+    global spi
+    if kind == "spidev":
+        import spidev
+        spi = spidev.SpiDev()
+        spi.open(SPI_BUS, SPI_DEVICE)
+        spi.max_speed_hz = SPI_SPEED
+        print("SPI initialized")
+        return Mcp3008Reader(channels)
+    if kind == "sim":
+        return SimulatedAdc(channels)
+    raise ValueError(f"Unknown ADC backend: {kind}")
+
+def create_display(kind, path=None):
+    """
+    Create the display sink.
+
+    Args:
+        kind (str): "fbdev" (/dev/fb0 or path), "file" (plain file at path) or "memory"
+        path (str): Device or file path
+    """
+    if kind == "fbdev":
+        return FramebufferWriter(path or FB_DEVICE)
+    if kind == "file":
+        return FramebufferWriter(path or "framebuffer.raw", device=False)
+    if kind == "memory":
+        return FramebufferWriter(None)
+    raise ValueError(f"Unknown display backend: {kind}")
+
+# ============================================================================
+# SESSION RECORD / REPLAY
+# ============================================================================
+# A session file is the stream of inputs the main loop saw: every ADC round
+# read by the sensor sampler, every camera frame the main loop rendered and
+# the main loop's work time per frame, in the order they happened. Replay
+# feeds it back through main() on a virtual clock, single-threaded on the
+# input side (ADC rounds and frames in file order), so the same session
+# always produces the same camera control calls and framebuffer contents.
+#
+# File: SESSION_MAGIC, uint32 header length, JSON header, then records of
+# SESSION_RECORD (kind, clock time, payload bytes) + payload:
+#   SESSION_ADC   float64 per channel (raw values from the reader)
+#   SESSION_FRAME SESSION_FRAME_INFO (rows, cols, channels, sensor ns) + frame bytes
+#   SESSION_WORK  float64 seconds of main loop work for the previous frame
+
+SESSION_MAGIC = b"WMSESS01"
+SESSION_RECORD = struct.Struct("<BdI")
+SESSION_FRAME_INFO = struct.Struct("<HHHq")
+SESSION_ADC, SESSION_FRAME, SESSION_WORK = 1, 2, 3
+
+class SystemClock:
+    """Wall-clock time (time.time) for the control logic."""
+
+    def time(self):
+        return time.time()
+
+class VirtualClock:
+    """Replay clock: time moves only when the replay feeds the next recorded event."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def set(self, now):
+        self.now = now
+
+clock = SystemClock()  # Time source of the control logic (main() installs a VirtualClock for --replay)
+
+class SessionRecorder:
+    """
+    Appends ADC rounds, rendered frames and frame work times to a session file.
+    adc() is called from the sampler thread, frame()/work() from the main
+    loop; a lock keeps records whole and in the order they happened.
+    """
+
+    def __init__(self, path, fmt, channels):
+        self.file = open(path, "wb", buffering=SESSION_WRITE_BUFFER)
+        self.lock = Lock()
+        self.frames = 0
+        header = json.dumps({"format": fmt, "channels": list(channels),
+                             "camera": [CAMERA_WIDTH, CAMERA_HEIGHT],
+                             "created": datetime.now().isoformat(timespec="seconds")}).encode()
+        self.file.write(SESSION_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def _write(self, kind, *parts):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(SESSION_RECORD.pack(kind, clock.time(), sum(len(p) for p in parts)))
+            for part in parts:
+                self.file.write(part)
+
+    def adc(self, values):
+        """Record one raw ADC round."""
+        self._write(SESSION_ADC, np.asarray(values, dtype=np.float64).tobytes())
+
+    def frame(self, frame, sensor_ns):
+        """Record the frame the main loop is about to render."""
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        self._write(SESSION_FRAME, SESSION_FRAME_INFO.pack(frame.shape[0], frame.shape[1], channels,
+                                                           int(sensor_ns)), memoryview(frame).cast("B"))
+        self.frames += 1
+
+    def work(self, seconds):
+        """Record the main loop's work time for the last frame."""
+        self._write(SESSION_WORK, struct.pack("<d", seconds))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class SessionAdc:
+    """ADC backend wrapper that records every round into a SessionRecorder."""
+
+    def __init__(self, reader, session):
+        self.reader = reader
+        self.session = session
+        self.channels = reader.channels
+
+    def read(self):
+        values = self.reader.read()
+        self.session.adc(values)
+        return values
+
+    def close(self):
+        self.reader.close()
+
+class ReplaySession:
+    """
+    Recorded session fed back through the main loop.
+    advance() runs the ADC rounds recorded before the next frame through the
+    sampler (synchronously, so listeners such as the arc controller fire in
+    recorded order), then captures the frame. Camera control calls and a
+    checksum of every presented framebuffer go to the replay log; the log's
+    running digest changes whenever behaviour does.
+
+    speed: 1.0 replays in real time (recorded event spacing), 0 as fast as possible.
+    """
+
+    def __init__(self, path, log_path, speed=1.0):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(SESSION_MAGIC)] != SESSION_MAGIC:
+            raise ValueError(f"Not a session file: {path}")
+        header_len, = struct.unpack_from("<I", self.mm, len(SESSION_MAGIC))
+        start = len(SESSION_MAGIC) + 4
+        self.header = json.loads(bytes(self.mm[start:start + header_len]))
+        self.channels = tuple(self.header["channels"])
+        self.format = self.header["format"]
+
+        # Index the records: (kind, time, payload offset, payload length); work time per frame
+        self.events = []
+        self.frame_work = []
+        offset = start + header_len
+        while offset + SESSION_RECORD.size <= len(self.mm):
+            kind, t, length = SESSION_RECORD.unpack_from(self.mm, offset)
+            offset += SESSION_RECORD.size
+            if offset + length > len(self.mm):
+                break  # Truncated last record (session not closed cleanly)
+            if kind == SESSION_WORK:
+                if self.frame_work:
+                    self.frame_work[-1], = struct.unpack_from("<d", self.mm, offset)
+            else:
+                if kind == SESSION_FRAME:
+                    self.frame_work.append(0.0)
+                self.events.append((kind, t, offset, length))
+            offset += length
+        if not self.frame_work:
+            raise ValueError(f"Session has no frames: {path}")
+
+        self.speed = speed
+        self.position = 0
+        self.frame_no = -1
+        self.adc_values = [0.0] * len(self.channels)
+        self.frame_event = None
+        self.controls = 0
+        self.digest = 0
+        self.start_time = self.events[0][1]
+        self.wall_start = None
+        self.log = open(log_path, "w")
+
+    @property
+    def frames(self):
+        """Number of frames in the session."""
+        return len(self.frame_work)
+
+    @property
+    def work(self):
+        """Recorded main loop work time of the current frame (seconds)."""
+        return self.frame_work[self.frame_no]
+
+    def _pace(self, t):
+        """Real-time replay: sleep until the event's offset from the session start."""
+        if self.speed <= 0:
+            return
+        if self.wall_start is None:
+            self.wall_start = time.perf_counter()
+        delay = self.wall_start + (t - self.start_time) / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def advance(self, sampler, frame_processor):
+        """
+        Feed events up to and including the next frame.
+
+        Args:
+            sampler (SensorSampler): Sampler created with threaded=False
+            frame_processor (FrameProcessor): Capture stage created with threaded=False
+
+        Returns:
+            bool: False when the session is exhausted
+        """
+        if self.wall_start is None:
+            self.wall_start = time.perf_counter()
+        while self.position < len(self.events):
+            kind, t, offset, length = self.events[self.position]
+            self.position += 1
+            self._pace(t)
+            clock.set(t)
+            if kind == SESSION_ADC:
+                self.adc_values = np.frombuffer(self.mm, np.float64, length // 8, offset).tolist()
+                sampler.sample_once()
+            elif kind == SESSION_FRAME:
+                self.frame_no += 1
+                self.frame_event = (offset, length)
+                frame_processor.capture_once()
+                return True
+        return False
+
+    def frame_data(self):
+        """
+        Current frame from the session file.
+
+        Returns:
+            tuple: (frame view, sensor timestamp ns)
+        """
+        offset, length = self.frame_event
+        rows, cols, channels, sensor_ns = SESSION_FRAME_INFO.unpack_from(self.mm, offset)
+        shape = (rows, cols, channels) if channels > 1 else (rows, cols)
+        data = np.frombuffer(self.mm, np.uint8, length - SESSION_FRAME_INFO.size,
+                             offset + SESSION_FRAME_INFO.size)
+        return data.reshape(shape), sensor_ns
+
+    def _record(self, line):
+        self.log.write(line + "\n")
+        self.digest = zlib.crc32(line.encode(), self.digest)
+
+    def controls_set(self, controls):
+        """Log a camera control call."""
+        self.controls += 1
+        self._record(f"{self.frame_no:6d} {clock.time() - self.start_time:10.3f} controls "
+                     f"{json.dumps(controls, sort_keys=True)}")
+
+    def frame_done(self, image):
+        """
+        Log the checksum of what the current frame put on screen.
+
+        Args:
+            image: Framebuffer memory (or the composed frame without a framebuffer)
+        """
+        self._record(f"{self.frame_no:6d} {clock.time() - self.start_time:10.3f} frame "
+                     f"{zlib.crc32(image):08x}")
+
+    def close(self):
+        """
+        Finish the replay log.
+
+        Returns:
+            dict: Frames replayed, control calls, digest and wall-clock rate
+        """
+        elapsed = time.perf_counter() - (self.wall_start or time.perf_counter())
+        replayed = self.frame_no + 1
+        summary = {"frames": replayed, "controls": self.controls, "digest": f"{self.digest:08x}",
+                   "seconds": round(elapsed, 3), "fps": round(replayed / elapsed, 1) if elapsed > 0 else 0.0}
+        self.log.write(f"# frames {replayed} controls {self.controls} digest {self.digest:08x}\n")
+        self.log.close()
+        self.mm.close()
+        return summary
+
+class ReplayCamera:
+    """Camera backend returning the session's frames; control calls go to the replay log."""
+
+    def __init__(self, session):
+        self.session = session
+        self.width, self.height = session.header["camera"]
+
+    def start(self):
+        pass
+
+    def reconfigure(self, width, height):
+        """The recorded frames already have the size the governor asked for live."""
+        self.width, self.height = width, height
+
+    def capture_into(self, dst):
+        frame, sensor_ns = self.session.frame_data()
+        if frame.shape != dst.shape:
+            raise RuntimeError(f"Replayed frame {frame.shape} does not fit the capture ring {dst.shape}")
+        np.copyto(dst, frame)
+        return sensor_ns
+
+    def set_controls(self, controls):
+        self.session.controls_set(controls)
+
+    def stop(self):
+        pass
+
+class ReplayAdc:
+    """ADC backend returning the session's recorded rounds."""
+
+    def __init__(self, session):
+        self.session = session
+        self.channels = session.channels
+
+    def read(self):
+        return self.session.adc_values
+
+    def close(self):
+        pass
+
+# ============================================================================
+# LATENCY STATISTICS
+# ============================================================================
+
+# Timestamps carried with each frame through the ring slots (ns, CLOCK_MONOTONIC)
+STAMP_SENSOR, STAMP_CAPTURED, STAMP_COMPOSED = 0, 1, 2
+STAMP_COUNT = 3
+
+LATENCY_STAGES = ("capture", "compose", "present", "total")
+
+class LatencyStats:
+    """
+    Rolling capture-to-photon latency histograms.
+    record() is constant-time with no allocation (fixed-width bins, counter
+    increments); two windows of LATENCY_WINDOW seconds are kept so the
+    percentiles always cover the last one to two windows.
+    The report is rebuilt by tick() (once per second) and published to a
+    stats file and/or a UNIX socket that replies with it on connect:
+        socat - UNIX-CONNECT:/tmp/welding-mask-stats.sock
+    """
+
+    def __init__(self, window=LATENCY_WINDOW, bin_ms=LATENCY_BIN_MS, max_ms=LATENCY_MAX_MS,
+                 stats_file=LATENCY_STATS_FILE, socket_path=LATENCY_STATS_SOCKET):
+        self.window = window
+        self.bin_ms = bin_ms
+        self.bins = int(max_ms / bin_ms)
+        self.ns_to_bin = 1.0 / (bin_ms * 1e6)
+        self.current = np.zeros((len(LATENCY_STAGES), self.bins), dtype=np.int64)
+        self.previous = np.zeros_like(self.current)
+        self.current_max = [0] * len(LATENCY_STAGES)
+        self.previous_max = [0] * len(LATENCY_STAGES)
+        self.window_start = time.monotonic()
+        self.lock = Lock()
+        self.frames = 0
+        self.dropped = 0       # Set by the owner (ring drops)
+        self.duplicates = 0    # Set by the owner (same frame rendered twice)
+        self.skipped = 0       # Set by the owner (camera frames never rendered)
+        self.fps = 0.0
+        self.startup = None    # Set by the owner (boot stage timings, ms since process start)
+        self.capture = None    # Set by the owner (CaptureSupervisor.summary())
+        self.tonemap = None    # Set by the owner (ToneMapper.summary())
+        self.denoise = None    # Set by the owner (TemporalDenoiser.summary())
+        self.preview = None    # Set by the owner (PreviewPublisher.summary())
+        self.memory = None     # Set by the owner (memory_usage())
+        self.report = b"{}"
+        self.stats_file = stats_file
+        self.socket_path = socket_path
+        self.server = None
+        if socket_path:
+            self._start_server()
+
+    def record(self, sensor_ns, captured_ns, composed_ns, presented_ns):
+        """
+        Add one presented frame.
+
+        Args:
+            sensor_ns, captured_ns, composed_ns, presented_ns (int): Stage timestamps
+        """
+        stages = (captured_ns - sensor_ns, composed_ns - captured_ns,
+                  presented_ns - composed_ns, presented_ns - sensor_ns)
+        with self.lock:
+            for stage, ns in enumerate(stages):
+                b = int(ns * self.ns_to_bin)
+                if b < 0:
+                    b = 0
+                elif b >= self.bins:
+                    b = self.bins - 1
+                self.current[stage, b] += 1
+                if ns > self.current_max[stage]:
+                    self.current_max[stage] = ns
+            self.frames += 1
+
+    def summary(self):
+        """
+        Percentiles over the current and previous window.
+
+        Returns:
+            dict: {stage: {p50, p95, p99, max (ms), count}} plus frame counters
+        """
+        with self.lock:
+            hist = self.current + self.previous
+            maxima = [max(a, b) for a, b in zip(self.current_max, self.previous_max)]
+        result = {"frames": self.frames, "fps": round(self.fps, 2), "dropped": self.dropped,
+                  "duplicates": self.duplicates, "skipped": self.skipped}
+        if self.startup is not None:
+            result["startup"] = self.startup
+        if self.capture is not None:
+            result["capture_health"] = self.capture
+        if self.tonemap is not None:
+            result["tonemap"] = self.tonemap
+        if self.denoise is not None:
+            result["denoise"] = self.denoise
+        if self.preview is not None:
+            result["preview"] = self.preview
+        if self.memory is not None:
+            result["memory"] = self.memory
+        for stage, name in enumerate(LATENCY_STAGES):
+            cumulative = np.cumsum(hist[stage])
+            count = int(cumulative[-1])
+            entry = {"count": count, "max": round(maxima[stage] / 1e6, 3)}
+            for label, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+                if count:
+                    b = int(np.searchsorted(cumulative, q * count))
+                    entry[label] = round((b + 0.5) * self.bin_ms, 3)
+                else:
+                    entry[label] = None
+            result[name] = entry
+        return result
+
+    def tick(self):
+        """Rotate windows when due and republish the report (call about once per second)."""
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            with self.lock:
+                self.previous, self.current = self.current, self.previous
+                self.current[:] = 0
+                self.previous_max, self.current_max = self.current_max, [0] * len(LATENCY_STAGES)
+            self.window_start = now
+        summary = self.summary()
+        self.report = (json.dumps(summary) + "\n").encode()
+        if self.stats_file:
+            try:
+                # Atomic replace: readers never see a half-written file
+                tmp_path = self.stats_file + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(self.report)
+                os.replace(tmp_path, self.stats_file)
+            except OSError as e:
+                if DEBUG_MODE:
+                    print(f"Stats file error: {e}")
+        return summary
+
+    def _start_server(self):
+        """Serve the latest report on a UNIX socket (one reply per connection)."""
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(self.socket_path)
+            self.server.listen(2)
+            self.server.settimeout(0.5)
+        except OSError as e:
+            print(f"Stats socket unavailable: {e}")
+            self.server = None
+            return
+        self.running = True
+        self.thread = Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while self.running:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            try:
+                conn.sendall(self.report)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+    def close(self):
+        """Stop the socket server and remove the socket."""
+        if self.server is None:
+            return
+        self.running = False
+        self.thread.join(timeout=2.0)
+        self.server.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+# ============================================================================
+# FRAME CAPTURE THREAD
+# ============================================================================
+
+class FrameRing:
+    """
+    Ring of preallocated frame buffers between two pipeline stages.
+    Single producer / single consumer, handed off by slot index with sequence
+    numbers. The producer never blocks: when the consumer falls behind, the
+    oldest unread frame is overwritten and counted in `dropped`.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, slots=3):
+        if slots < 3:
+            raise ValueError("FrameRing needs at least 3 slots (write, latest, read)")
+        self.buffers = np.zeros((slots,) + tuple(shape), dtype=dtype)
+        self.seqs = [0] * slots
+        self.stamps = np.zeros((slots, STAMP_COUNT), dtype=np.int64)  # Per-slot latency timestamps (ns)
+        self.lock = Lock()
+        self.published = Condition(self.lock)  # Notified on every publish()
+        self.seq = 0             # Sequence number of the newest published frame
+        self.latest = -1         # Slot holding the newest published frame
+        self.reading = -1        # Slot currently held by the consumer
+        self.last_read_seq = 0
+        self.dropped = 0
+        self.retired = False     # Replaced by a resized ring (waiting consumers wake up)
+
+    def acquire_write(self):
+        """
+        Get a slot to fill: the oldest one that is neither latest nor being read.
+
+        Returns:
+            int: Slot index
+        """
+        with self.lock:
+            best = -1
+            for i, seq in enumerate(self.seqs):
+                if i == self.latest or i == self.reading:
+                    continue
+                if best < 0 or seq < self.seqs[best]:
+                    best = i
+            return best
+
+    def publish(self, index):
+        """
+        Mark a filled slot as the newest frame.
+
+        Returns:
+            int: Sequence number assigned to the frame
+        """
+        with self.lock:
+            if self.latest >= 0 and self.seqs[self.latest] > self.last_read_seq:
+                self.dropped += 1  # Previous frame replaced before the consumer saw it
+            self.seq += 1
+            self.seqs[index] = self.seq
+            self.latest = index
+            self.published.notify_all()
+            return self.seq
+
+    def acquire_read(self, after_seq=0):
+        """
+        Hold the newest frame for reading (must be given back with release()).
+
+        Args:
+            after_seq (int): Only return a frame newer than this sequence number
+
+        Returns:
+            tuple: (slot_index, seq) or (-1, 0) if no such frame
+        """
+        with self.lock:
+            return self._hold_latest(after_seq)
+
+    def wait_read(self, after_seq, timeout=None):
+        """
+        Block until a frame newer than after_seq is published, then hold it
+        (like acquire_read). Consumers wake exactly when a frame arrives.
+
+        Args:
+            after_seq (int): Sequence number of the last frame consumed
+            timeout (float): Max seconds to wait
+
+        Returns:
+            tuple: (slot_index, seq) or (-1, 0) on timeout
+        """
+        with self.published:
+            self.published.wait_for(
+                lambda: self.retired or (self.latest >= 0 and self.seqs[self.latest] > after_seq), timeout)
+            return self._hold_latest(after_seq)
+
+    def retire(self):
+        """Wake a consumer waiting in wait_read(): no more frames come to this ring."""
+        with self.lock:
+            self.retired = True
+            self.published.notify_all()
+
+    def _hold_latest(self, after_seq):
+        """Mark the newest frame as being read (lock held by the caller)."""
+        if self.latest < 0 or self.seqs[self.latest] <= after_seq:
+            return -1, 0
+        self.reading = self.latest
+        self.last_read_seq = self.seqs[self.latest]
+        return self.reading, self.last_read_seq
+
+    def release(self, index):
+        """Give a slot obtained from acquire_read() back to the producer."""
+        with self.lock:
+            if self.reading == index:
+                self.reading = -1
+
+class FrameProcessor:
+    """Thread-safe camera frame capture into a preallocated FrameRing."""
+
+    def __init__(self, camera, slots=PIPELINE_SLOTS, fmt=CAPTURE_FORMAT, threaded=True):
+        self.camera = camera
+        self.slots = slots
+        self.format = fmt
+        self.size = (CAMERA_WIDTH, CAMERA_HEIGHT)
+        self.running = True
+        self.capture_lock = Lock()  # Held per capture (and per resize, applied between captures)
+        self.resize_lock = Lock()   # Guards pending_size only (never held across camera calls)
+        self.pending_size = None    # Stream size requested by resize(), applied by the capture thread
+        self.ring = FrameRing(capture_shape(CAMERA_WIDTH, CAMERA_HEIGHT, fmt), slots=slots)
+        self.captured_at = time.monotonic()  # Newest publish (frame age = now - captured_at)
+        self.capture_fps = 0.0               # Capture rate (EMA of frame intervals)
+        self.generation = 0                  # Bumped by restart(): older capture threads exit
+        # threaded=False: the caller drives capture_once() (session replay)
+        self.thread = None
+        if threaded:
+            self.thread = Thread(target=self._capture_frames, args=(0,), daemon=True)
+            self.thread.start()
+
+    @property
+    def frame(self):
+        """Latest captured frame (unsynchronized view, None before the first frame)."""
+        latest = self.ring.latest
+        return self.ring.buffers[latest] if latest >= 0 else None
+
+    def capture_once(self, generation=0):
+        """Capture one camera frame into a ring slot and publish it."""
+        with self.capture_lock:
+            if self.pending_size is not None:
+                self._apply_resize(generation)
+                if generation != self.generation:
+                    return
+            ring = self.ring
+            index = ring.acquire_write()
+            sensor_time = self.camera.capture_into(ring.buffers[index])
+            if generation != self.generation:
+                return  # Came back from a capture abandoned by restart()
+            stamps = ring.stamps[index]
+            stamps[STAMP_CAPTURED] = time.monotonic_ns()
+            stamps[STAMP_SENSOR] = sensor_time or stamps[STAMP_CAPTURED]
+            ring.publish(index)
+            now = time.monotonic()
+            interval = now - self.captured_at
+            if interval > 0:
+                self.capture_fps += 0.1 * (1.0 / interval - self.capture_fps)
+            self.captured_at = now
+
+    def _capture_frames(self, generation):
+        """Continuously capture frames from camera straight into ring slots."""
+        while self.running and generation == self.generation:
+            try:
+                self.capture_once(generation)
+            except Exception as e:
+                print(f"Frame capture error: {e}")
+                time.sleep(0.1)
+
+    def resize(self, width, height):
+        """
+        Request a new camera stream size. Never blocks: the capture thread
+        reconfigures the camera and replaces the ring before its next capture
+        (a later request replaces one not applied yet). A camera that wedges
+        meanwhile is a capture stall; restart() keeps the request, so the new
+        capture thread applies it.
+        """
+        with self.resize_lock:
+            self.pending_size = (width, height)
+
+    def _apply_resize(self, generation):
+        """
+        Reconfigure the camera to pending_size and replace the ring
+        (capture_lock held by the caller). The consumer may still hold a slot
+        of the old ring; it releases it there. Sequence numbers continue (as in
+        restart()), so consumers keyed on them need no reset.
+        """
+        with self.resize_lock:
+            size = self.pending_size
+        if size is None:
+            return
+        try:
+            if size != self.size:
+                self.camera.reconfigure(*size)
+        except Exception:
+            self._clear_resize(size)
+            raise
+        if generation != self.generation:
+            return  # Came back from a reconfigure abandoned by restart()
+        if size != self.size:
+            ring = FrameRing(capture_shape(size[0], size[1], self.format), slots=self.slots)
+            ring.seq = self.ring.seq
+            old = self.ring
+            self.size = size
+            self.ring = ring
+            # Frame age restarts here: the reconfigure time is not a capture stall
+            self.captured_at = time.monotonic()
+            old.retire()
+        self._clear_resize(size)
+
+    def _clear_resize(self, size):
+        """Drop the pending request if it is still size (not replaced meanwhile)."""
+        with self.resize_lock:
+            if self.pending_size == size:
+                self.pending_size = None
+
+    def restart(self):
+        """
+        Recover from a stalled capture: re-create the camera and start a new
+        capture thread with a fresh lock and ring. The old thread may stay
+        blocked inside the wedged camera; it exits without publishing if it
+        ever returns. Sequence numbers continue, so the consumer just sees
+        newer frames.
+        """
+        self.camera.restart()
+        ring = FrameRing(capture_shape(self.size[0], self.size[1], self.format), slots=self.slots)
+        ring.seq = self.ring.seq
+        self.generation += 1
+        self.capture_lock = Lock()
+        self.ring = ring
+        self.thread = Thread(target=self._capture_frames, args=(self.generation,), daemon=True)
+        self.thread.start()
+
+    def get_frame(self):
+        """Get a copy of the latest captured frame (thread-safe)."""
+        index, _ = self.ring.acquire_read()
+        if index < 0:
+            return None
+        try:
+            return self.ring.buffers[index].copy()
+        finally:
+            self.ring.release(index)
+
+    def stop(self):
+        """Stop the capture thread."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+
+class CaptureSupervisor:
+    """
+    Capture stall detection and self-healing camera restart.
+    check() runs once per main loop pass: the age of the newest captured
+    frame past stale_after flags the video as stale (HUD warning, the last
+    frame is still shown but marked); past restart_after the camera is torn
+    down and re-created in a background thread (exposure controls kept).
+    Recovery time (stall detected -> fresh frame) is kept as a metric.
+    """
+
+    def __init__(self, frame_processor, stale_after=CAPTURE_STALE_AFTER,
+                 restart_after=CAPTURE_RESTART_AFTER, retry=CAPTURE_RESTART_RETRY):
+        self.frame_processor = frame_processor
+        self.stale_after = stale_after
+        self.restart_after = restart_after
+        self.retry = retry
+        self.stale = False
+        self.frame_age = 0.0       # Seconds since the newest frame was captured
+        self.stalled_at = None     # Detection time of the current stall
+        self.stall_start = None    # Capture time of the last good frame before it
+        self.restart_thread = None
+        self.last_restart = 0.0
+        self.stalls = 0
+        self.restarts = 0
+        self.restart_ms = None     # Duration of the last camera re-creation
+        self.recovery_ms = None    # Last stall: detection -> first fresh frame
+        self.outage_ms = None      # Last stall: last good frame -> first fresh frame
+        self.max_recovery_ms = 0.0
+
+    def check(self, now=None):
+        """
+        Update the stall state.
+
+        Args:
+            now (float): time.monotonic() (defaults to now)
+
+        Returns:
+            bool: True while the video is stale
+        """
+        now = time.monotonic() if now is None else now
+        captured_at = self.frame_processor.captured_at
+        self.frame_age = now - captured_at
+
+        if self.frame_age < self.stale_after:
+            if self.stalled_at is not None and captured_at > self.stalled_at:
+                self.recovery_ms = round((captured_at - self.stalled_at) * 1000.0, 1)
+                self.outage_ms = round((captured_at - self.stall_start) * 1000.0, 1)
+                self.max_recovery_ms = max(self.max_recovery_ms, self.recovery_ms)
+                self.stalled_at = None
+                print(f"Capture recovered: {self.recovery_ms:.0f} ms after detection "
+                      f"({self.outage_ms:.0f} ms without video)")
+            self.stale = False
+            return False
+
+        if self.stalled_at is None:
+            self.stalled_at = now
+            self.stall_start = captured_at
+            self.stalls += 1
+            print(f"Capture stalled: newest frame is {self.frame_age * 1000:.0f} ms old")
+        restarting = self.restart_thread is not None and self.restart_thread.is_alive()
+        if self.frame_age >= self.restart_after and not restarting and now - self.last_restart >= self.retry:
+            self.last_restart = now
+            self.restart_thread = Thread(target=self._restart, daemon=True)
+            self.restart_thread.start()
+        self.stale = True
+        return True
+
+    def _restart(self):
+        """Re-create the camera and capture thread (background)."""
+        start = time.monotonic()
+        try:
+            self.frame_processor.restart()
+            self.restarts += 1
+            self.restart_ms = round((time.monotonic() - start) * 1000.0, 1)
+            print(f"Camera restarted in {self.restart_ms:.0f} ms")
+        except Exception as e:
+            print(f"Camera restart failed: {e}")
+
+    def summary(self):
+        """
+        Capture health for the stats report.
+
+        Returns:
+            dict: Frame age, capture rate, stall/restart counters, recovery times (ms)
+        """
+        return {"frame_age_ms": round(self.frame_age * 1000.0, 1),
+                "capture_fps": round(self.frame_processor.capture_fps, 1),
+                "stale": self.stale, "stalls": self.stalls, "restarts": self.restarts,
+                "restart_ms": self.restart_ms, "recovery_ms": self.recovery_ms,
+                "outage_ms": self.outage_ms, "max_recovery_ms": self.max_recovery_ms}
+
+# ============================================================================
+# STRIPE WORKERS
+# ============================================================================
+
+class StripeWorkers:
+    """
+    Fixed pool of threads that runs one function over horizontal stripes.
+    run(fn, height) splits [0, height) into `stripes` bands and calls fn(y0, y1)
+    for each; the calling thread takes stripes too. OpenCV releases the GIL
+    inside resize/remap/cvtColor, so the stripes run on separate cores.
+    One stage uses the pool at a time; a second caller meanwhile runs its
+    stripes itself instead of waiting.
+    """
+
+    def __init__(self, workers=STRIPE_WORKERS, stripes=STRIPE_COUNT):
+        self.workers = max(1, workers)
+        self.stripes = max(1, stripes)
+        self.busy = Lock()              # Held by the stage currently using the pool
+        self.cond = Condition()
+        self.generation = 0             # Bumped for every run() (wakes the workers)
+        self.fn = None
+        self.bounds = []
+        self.bounds_cache = {}          # height -> [(y0, y1), ...]
+        self.next = 0                   # Next stripe to hand out
+        self.done = 0                   # Stripes finished in this run
+        self.running = True
+        self.threads = [Thread(target=self._work, daemon=True) for _ in range(self.workers - 1)]
+        for thread in self.threads:
+            thread.start()
+
+    def split(self, height):
+        """
+        Stripe bounds for a frame of the given height (cached per height).
+
+        Returns:
+            list: (y0, y1) row ranges covering [0, height)
+        """
+        bounds = self.bounds_cache.get(height)
+        if bounds is None:
+            count = max(1, min(self.stripes, height))
+            edges = [height * i // count for i in range(count + 1)]
+            bounds = self.bounds_cache[height] = list(zip(edges[:-1], edges[1:]))
+        return bounds
+
+    def _work(self):
+        """Worker thread: wait for a new run, then take stripes until none are left."""
+        seen = 0
+        while True:
+            with self.cond:
+                while self.running and self.generation == seen:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                seen = self.generation
+            self._drain()
+
+    def _drain(self):
+        """Run stripes of the current job until all have been handed out."""
+        while True:
+            with self.cond:
+                if self.next >= len(self.bounds):
+                    return
+                y0, y1 = self.bounds[self.next]
+                self.next += 1
+                fn = self.fn
+            try:
+                fn(y0, y1)
+            except Exception as e:
+                if DEBUG_MODE:
+                    print(f"DEBUG: stripe {y0}-{y1} failed: {e}")
+            with self.cond:
+                self.done += 1
+                if self.done == len(self.bounds):
+                    self.cond.notify_all()
+
+    def run(self, fn, height):
+        """
+        Call fn(y0, y1) over all stripes of [0, height) and wait for them.
+
+        Args:
+            fn (callable): Stripe function; must only touch rows y0..y1 of its output
+            height (int): Rows to cover
+        """
+        if not self.threads or not self.busy.acquire(blocking=False):
+            for y0, y1 in self.split(height):
+                fn(y0, y1)
+            return
+        try:
+            with self.cond:
+                self.fn = fn
+                self.bounds = self.split(height)
+                self.next = 0
+                self.done = 0
+                self.generation += 1
+                self.cond.notify_all()
+            self._drain()
+            with self.cond:
+                while self.done < len(self.bounds):
+                    self.cond.wait()
+                self.fn = None
+        finally:
+            self.busy.release()
+
+    def stop(self):
+        """Stop the worker threads."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+
+# ============================================================================
+# FRAMEBUFFER OUTPUT
+# ============================================================================
+
+class FramebufferWriter:
+    """
+    Memory-mapped framebuffer writer.
+    Maps the framebuffer as a NumPy uint16 view and converts frames straight
+    into it (no intermediate BGR565 image, no tobytes(), no write syscall).
+    With device=True the geometry comes from the fbdev ioctls, and a missing
+    or non-framebuffer path is an error (the node is never created). With
+    device=False a plain file of FB_WIDTH x FB_HEIGHT stands in for /dev/fb0.
+    With path=None the framebuffer is anonymous memory (headless runs).
+    """
+
+    def __init__(self, path=FB_DEVICE, width=FB_WIDTH, height=FB_HEIGHT, device=True):
+        self.path = path
+        self.layout = None
+        self.vsync_supported = True
+        if path is None:
+            self.fd = -1
+            self.width, self.height = width, height
+            self.stride = width * 2
+            self.bpp = 16
+            self.is_device = False
+            self.mm = mmap.mmap(-1, self.stride * self.height)
+            self._map_views()
+            return
+
+        if device:
+            # No O_CREAT: a missing /dev/fb0 (driver not loaded yet) must not become a file
+            self.fd = os.open(path, os.O_RDWR)
+            try:
+                self.width, self.height, self.stride, self.bpp = self._query_geometry()
+            except OSError as e:
+                os.close(self.fd)
+                raise OSError(e.errno, f"{path} is not a framebuffer device: {e.strerror}") from e
+            self.is_device = True
+        else:
+            # Plain file: use the configured geometry and grow the file to fit
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            self.width, self.height = width, height
+            self.stride = width * 2
+            self.bpp = 16
+            self.is_device = False
+            if os.fstat(self.fd).st_size < self.stride * self.height:
+                os.ftruncate(self.fd, self.stride * self.height)
+
+        if self.bpp != 16:
+            os.close(self.fd)
+            raise ValueError(f"Unsupported framebuffer depth: {self.bpp} bpp (expected 16)")
+
+        self.mm = mmap.mmap(self.fd, self.stride * self.height,
+                            mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._map_views()
+
+    def _map_views(self):
+        """Row-strided views: bytes (for cv2 dst=) and uint16 pixels."""
+        self.raw = np.ndarray((self.height, self.stride), dtype=np.uint8, buffer=self.mm)
+        self.pixels = np.ndarray((self.height, self.stride // 2), dtype=np.uint16,
+                                 buffer=self.mm)[:, :self.width]
+
+    def _query_geometry(self):
+        """
+        Read visible resolution, depth and line length from the fbdev driver.
+
+        Returns:
+            tuple: (width, height, stride_bytes, bits_per_pixel)
+        """
+        return query_fb_geometry(self.fd)
+
+    def wait_vsync(self):
+        """
+        Block until the next vertical blank (FBIO_WAITFORVSYNC).
+
+        Returns:
+            bool: False if the driver (or a plain file) doesn't support it
+        """
+        if not self.is_device or not self.vsync_supported:
+            return False
+        try:
+            fcntl.ioctl(self.fd, FBIO_WAITFORVSYNC, b"\0\0\0\0")
+            return True
+        except OSError:
+            self.vsync_supported = False
+            return False
+
+    def region(self, x, y, w, h):
+        """
+        Get a writable (h, w, 2) uint8 view of a framebuffer rectangle,
+        suitable as cv2 dst= for COLOR_BGR2BGR565.
+        """
+        return self.raw[y:y + h, x * 2:(x + w) * 2].reshape(h, w, 2)
+
+    def set_layout(self, rect):
+        """
+        Clear the letterbox border when the frame rectangle changes.
+        Unchanged layout is a no-op, so the border is not rewritten per frame.
+
+        Args:
+            rect (tuple): (x, y, w, h) of the image area
+        """
+        if rect == self.layout:
+            return
+        self.pixels[:] = 0
+        self.layout = rect
+
+    def write(self, image, rects=None, workers=None):
+        """
+        Convert BGR image into the framebuffer in place.
+
+        Args:
+            image (ndarray): BGR image with framebuffer geometry
+            rects (list): Optional (x, y, w, h) rectangles to convert; whole image if None
+            workers (StripeWorkers): Convert tall rectangles stripe-parallel
+        """
+        if rects is None:
+            rects = ((0, 0, self.width, self.height),)
+        for x, y, w, h in rects:
+            if w <= 0 or h <= 0:
+                continue  # e.g. no top letterbox band at DISPLAY_SCALE = 1.0
+            if workers is not None and h >= STRIPE_MIN_ROWS:
+                def convert(y0, y1, x=x, y=y, w=w):
+                    cv2.cvtColor(image[y + y0:y + y1, x:x + w], cv2.COLOR_BGR2BGR565,
+                                 dst=self.region(x, y + y0, w, y1 - y0))
+                workers.run(convert, h)
+            else:
+                cv2.cvtColor(image[y:y + h, x:x + w], cv2.COLOR_BGR2BGR565,
+                             dst=self.region(x, y, w, h))
+
+    def close(self):
+        """Unmap and close the framebuffer."""
+        self.raw = None
+        self.pixels = None
+        try:
+            self.mm.close()
+        except BufferError:
+            pass  # Views still referenced elsewhere; released with them
+        if self.fd >= 0:
+            os.close(self.fd)
+
+# ============================================================================
+# DISPLAY RENDERING
+# ============================================================================
+
+def configure_layout(fb_width, fb_height):
+    """
+    (Re)compute frame positioning and buffers for the given display geometry.
+
+    Args:
+        fb_width (int): Framebuffer width in pixels
+        fb_height (int): Framebuffer height in pixels
+    """
+    global FB_WIDTH, FB_HEIGHT, frame_width, frame_height, x_offset, y_offset
+    global background_canvas, canvas_osd_rects, rgb565_buffer, packed_eye_buffer, OSD_REGIONS
+
+    FB_WIDTH, FB_HEIGHT = fb_width, fb_height
+    frame_width = int(FB_WIDTH * DISPLAY_SCALE)
+    frame_height = int(FB_HEIGHT * DISPLAY_SCALE)
+    x_offset = (FB_WIDTH - frame_width) // 2
+    y_offset = (FB_HEIGHT - frame_height) // 2
+
+    # Canvas reused by every frame (only the OSD rects drawn on it are cleared)
+    background_canvas = np.zeros((FB_HEIGHT, FB_WIDTH, 3), dtype=np.uint8)
+    canvas_osd_rects = []
+
+    # Pre-allocate RGB565 buffer (reused for framebuffer writes without a mapped writer)
+    rgb565_buffer = np.zeros((FB_HEIGHT, FB_WIDTH), dtype=np.uint16)
+    packed_eye_buffer = None    # Packed dual view at camera size (allocated on first use)
+
+    # Letterbox areas the OSD draws into (text/REC band on top, danger border strips)
+    OSD_REGIONS = [
+        (0, 0, FB_WIDTH, min(y_offset, 120)),
+        (0, FB_HEIGHT - 16, FB_WIDTH, 16),
+        (0, 0, 16, FB_HEIGHT),
+        (FB_WIDTH - 16, 0, 16, FB_HEIGHT),
+    ]
+
+# Pre-calculate frame positioning
+configure_layout(FB_WIDTH, FB_HEIGHT)
+
+def osd_over_video(rects, video_rect):
+    """
+    Whether any OSD rect lands on the video area. Such a frame must be
+    composed in the BGR canvas: the OSD is blended over the video pixels.
+
+    Args:
+        rects (list): (x, y, w, h) OSD rectangles
+        video_rect (tuple): (x, y, w, h) of the image area
+    """
+    x, y, w, h = video_rect
+    for rx, ry, rw, rh in rects:
+        if rw > 0 and rh > 0 and rx < x + w and x < rx + rw and ry < y + h and y < ry + rh:
+            return True
+    return False
+
+def rects_outside(rects, video_rect):
+    """
+    Parts of rects outside the video area (up to four bands per rect).
+    Used when the video went to the framebuffer packed: the canvas under
+    the video area is stale and must not be converted over it.
+
+    Args:
+        rects (list): (x, y, w, h) rectangles
+        video_rect (tuple): (x, y, w, h) of the image area
+
+    Returns:
+        list: (x, y, w, h) rectangles
+    """
+    vx, vy, vw, vh = video_rect
+    clipped = []
+    for x, y, w, h in rects:
+        if w <= 0 or h <= 0:
+            continue
+        if not osd_over_video(((x, y, w, h),), video_rect):
+            clipped.append((x, y, w, h))
+            continue
+        top, bottom = max(y, vy), min(y + h, vy + vh)
+        bands = ((x, y, w, top - y), (x, bottom, w, y + h - bottom),
+                 (x, top, vx - x, bottom - top), (vx + vw, top, x + w - vx - vw, bottom - top))
+        clipped.extend(band for band in bands if band[2] > 0 and band[3] > 0)
+    return clipped
+
+def render_recording_icon(image, recording_active):
+    """
+    Render recording icon (red circle) on HUD.
+    
+    Args:
+        image (ndarray): Image to render icon on
+        recording_active (bool): Whether recording is active
+    """
+    if not recording_active:
+        return
+    
+    # Red circle in top-right corner with REC text
+    icon_x = FB_WIDTH - 120
+    icon_y = 50
+    
+    # Pulsing effect (blink every 0.5 seconds)
+    if int(clock.time() * 2) % 2 == 0:
+        cv2.circle(image, (icon_x, icon_y), 20, (0, 0, 255), -1)  # Filled red circle
+        cv2.putText(image, "REC", (icon_x + 30, icon_y + 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
+
+STALE_VIDEO_TEXT = "STALE VIDEO - CAMERA NOT RESPONDING"
+
+def stale_video_banner():
+    """
+    Stale video warning banner: red box across the top centre, text knocked out.
+
+    Returns:
+        tuple: ((x, y, w, h), text_origin, font_scale, thickness)
+    """
+    font_scale, thickness = 1.2, 3
+    (text_w, text_h), _ = cv2.getTextSize(STALE_VIDEO_TEXT, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    w, h = text_w + 60, text_h + 36
+    x, y = (FB_WIDTH - w) // 2, 10
+    return (x, y, w, h), (x + 30, y + 18 + text_h), font_scale, thickness
+
+def draw_stale_video_banner(image, value, text_value, dx=0, dy=0):
+    """Draw the stale video banner (value: box colour, text_value: text colour)."""
+    (x, y, w, h), (tx, ty), font_scale, thickness = stale_video_banner()
+    cv2.rectangle(image, (x + dx, y + dy), (x + w - 1 + dx, y + h - 1 + dy), value, -1)
+    cv2.putText(image, STALE_VIDEO_TEXT, (tx + dx, ty + dy), cv2.FONT_HERSHEY_SIMPLEX,
+                font_scale, text_value, thickness, cv2.LINE_AA)
+
+def co_twa_line(telemetry):
+    """
+    HUD line with the CO time-weighted averages (red once the shift average
+    reaches the MQ-07 warning band).
+
+    Args:
+        telemetry (TelemetryLog): Log maintaining the averages
+
+    Returns:
+        tuple: (text, BGR colour)
+    """
+    short_v, long_v = telemetry.co_twa_short, telemetry.co_twa_long
+    text = f"CO {CO_TWA_SHORT // 60}m/{CO_TWA_LONG // 3600}h: {short_v:.2f}/{long_v:.2f}V"
+    return text, (0, 0, 255) if long_v >= CO_WARNING_VOLTAGE else (0, 255, 0)
+
+def render_osd(image, battery_voltage, battery_status, battery_critical,
+               mq07_voltage, mq07_status, mq07_dangerous,
+               light_value, light_status, recording_active=False, stale_video=False,
+               telemetry=None):
+    """
+    Render on-screen display (OSD) with clean layout.
+    Shows battery, air quality, CO averages, recording icon. Red border if danger.
+    
+    Args:
+        image (ndarray): Image to render text on
+        battery_voltage (float): Battery voltage
+        battery_status (str): Battery status text
+        battery_critical (bool): Battery critical flag
+        mq07_voltage (float): MQ-07 voltage
+        mq07_status (str): Air quality status
+        mq07_dangerous (bool): Air quality danger flag
+        light_value (int): Light ADC value
+        light_status (str): Light status text
+        recording_active (bool): Whether recording is active
+        stale_video (bool): Camera stalled - the video is an old frame
+        telemetry (TelemetryLog): CO averages shown next to the air status (optional)
+    """
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.9  # Larger font for better visibility
+    thickness = 2
+    
+    # Battery info (top-left)
+    battery_color = (0, 0, 255) if battery_critical else (0, 255, 0)
+    cv2.putText(image, f"Bat: {battery_voltage:.1f}V ({battery_status})",
+                (20, 50), font, font_scale, battery_color, thickness, cv2.LINE_AA)
+    
+    # Air quality (top-left, below battery) - no voltage display
+    air_color = (0, 0, 255) if mq07_dangerous else (0, 255, 0)
+    cv2.putText(image, f"Air: {mq07_status}",
+                (20, 100), font, font_scale, air_color, thickness, cv2.LINE_AA)
+
+    # CO time-weighted averages (right of the air status)
+    if telemetry is not None:
+        co_text, co_color = co_twa_line(telemetry)
+        cv2.putText(image, co_text, (400, 100), font, font_scale, co_color, thickness, cv2.LINE_AA)
+    
+    # Light level info hidden (commented out)
+    
+    # Recording icon
+    render_recording_icon(image, recording_active)
+    
+    # RED BORDER if danger
+    if mq07_dangerous:
+        cv2.rectangle(image, (5, 5), (FB_WIDTH - 5, FB_HEIGHT - 5), (0, 0, 255), 8)
+
+    # Stale video warning (capture stalled)
+    if stale_video:
+        draw_stale_video_banner(image, (0, 0, 255), (0, 0, 0))
+
+class HudCompositor:
+    """
+    Cached HUD layer (same look as render_osd).
+    Keeps pre-rendered sprites (premultiplied colour + inverse alpha mask) per
+    OSD element and re-rasterizes an element only when its displayed value
+    changes. Each frame blends just the small sprite bounding boxes.
+    """
+
+    def __init__(self):
+        self.elements = {}       # name -> (key, [sprite, ...])
+        self.drawn_rects = []    # Sprite rects blended in the previous frame
+        self.rasterize_count = 0
+        self.detail = "full"     # "minimal": battery/air text only when in alarm
+        self.telemetry = None    # TelemetryLog: CO averages shown next to the air status
+
+    def _make_sprite(self, rect, color, draw):
+        """
+        Rasterize one sprite.
+
+        Args:
+            rect (tuple): (x, y, w, h) area the drawing may touch
+            color (tuple): BGR colour of the element
+            draw (callable): draw(mask, dx, dy) renders in white onto the mask,
+                             with (dx, dy) the offset from screen coordinates
+
+        Returns:
+            tuple: ((x, y, w, h), premultiplied_bgr, inverse_alpha) or None if empty
+        """
+        x, y, w, h = rect
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, FB_WIDTH), min(y + h, FB_HEIGHT)
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        draw(mask, -x0, -y0)
+
+        # Shrink to the drawn pixels so per-frame blending touches as little as possible
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if rows.size == 0:
+            return None
+        mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        alpha = mask.astype(np.float32)[..., None] / 255.0
+        premultiplied = (alpha * np.array(color, dtype=np.float32) + 0.5).astype(np.uint8)
+        inverse_alpha = cv2.merge([255 - mask] * 3)
+        sprite_rect = (x0 + int(cols[0]), y0 + int(rows[0]), mask.shape[1], mask.shape[0])
+        return sprite_rect, premultiplied, inverse_alpha
+
+    def _text_sprite(self, text, org, color, font_scale=0.9, thickness=2):
+        """Rasterize putText() output as a sprite."""
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        (text_w, text_h), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+        pad = thickness + 2
+        rect = (org[0] - pad, org[1] - text_h - pad, text_w + 2 * pad, text_h + baseline + 2 * pad)
+
+        def draw(mask, dx, dy):
+            cv2.putText(mask, text, (org[0] + dx, org[1] + dy), font, font_scale,
+                        255, thickness, cv2.LINE_AA)
+
+        return self._make_sprite(rect, color, draw)
+
+    def _set(self, name, key, build):
+        """Re-rasterize element only if its key changed (None key hides it)."""
+        cached = self.elements.get(name)
+        if cached is not None and cached[0] == key:
+            return
+        sprites = [s for s in build() if s is not None] if key is not None else []
+        self.elements[name] = (key, sprites)
+        self.rasterize_count += 1
+
+    def update(self, battery_voltage, battery_status, battery_critical,
+               mq07_voltage, mq07_status, mq07_dangerous,
+               light_value, light_status, recording_active=False, stale_video=False):
+        """
+        Refresh sprites for the current sensor values (same args as render_osd).
+        Cheap when nothing changed: only builds the key strings.
+        """
+        full = self.detail == "full"
+        battery_color = (0, 0, 255) if battery_critical else (0, 255, 0)
+        battery_text = f"Bat: {battery_voltage:.1f}V ({battery_status})"
+        self._set("battery", (battery_text, battery_color) if full or battery_critical else None,
+                  lambda: [self._text_sprite(battery_text, (20, 50), battery_color)])
+
+        air_color = (0, 0, 255) if mq07_dangerous else (0, 255, 0)
+        air_text = f"Air: {mq07_status}"
+        self._set("air", (air_text, air_color) if full or mq07_dangerous else None,
+                  lambda: [self._text_sprite(air_text, (20, 100), air_color)])
+
+        # CO time-weighted averages (maintained by the telemetry log, read as attributes)
+        co_key = None
+        if self.telemetry is not None and full:
+            co_key = co_twa_line(self.telemetry)
+        self._set("co_twa", co_key, lambda: [self._text_sprite(co_key[0], (400, 100), co_key[1])])
+
+        # Recording icon (pulsing: visible every other 0.5 s)
+        rec_visible = recording_active and int(clock.time() * 2) % 2 == 0
+        icon_x, icon_y = FB_WIDTH - 120, 50
+
+        def build_rec():
+            def draw(mask, dx, dy):
+                cv2.circle(mask, (icon_x + dx, icon_y + dy), 20, 255, -1)
+                cv2.putText(mask, "REC", (icon_x + 30 + dx, icon_y + 10 + dy),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, 255, 2, cv2.LINE_AA)
+            return [self._make_sprite((icon_x - 24, icon_y - 24, 120, 48), (0, 0, 255), draw)]
+
+        self._set("rec", (icon_x, icon_y) if rec_visible else None, build_rec)
+
+        # Danger border: four thin strips instead of one full-screen box
+        def build_border():
+            def draw(mask, dx, dy):
+                cv2.rectangle(mask, (5 + dx, 5 + dy), (FB_WIDTH - 5 + dx, FB_HEIGHT - 5 + dy), 255, 8)
+            strips = [(0, 0, FB_WIDTH, 16), (0, FB_HEIGHT - 16, FB_WIDTH, 16),
+                      (0, 16, 16, FB_HEIGHT - 32), (FB_WIDTH - 16, 16, 16, FB_HEIGHT - 32)]
+            return [self._make_sprite(strip, (0, 0, 255), draw) for strip in strips]
+
+        self._set("border", (FB_WIDTH, FB_HEIGHT) if mq07_dangerous else None, build_border)
+
+        # Stale video warning: shown at every detail level
+        def build_stale():
+            rect = stale_video_banner()[0]
+            return [self._make_sprite(rect, (0, 0, 255),
+                                      lambda mask, dx, dy: draw_stale_video_banner(mask, 255, 0, dx, dy))]
+
+        self._set("stale", (FB_WIDTH, FB_HEIGHT) if stale_video else None, build_stale)
+
+    def compose(self, image):
+        """
+        Blend visible sprites into image in place.
+
+        Args:
+            image (ndarray): Full-screen BGR canvas
+
+        Returns:
+            list: Rects that changed on screen (drawn now or drawn last frame)
+        """
+        rects = []
+        for _, sprites in self.elements.values():
+            for (x, y, w, h), premultiplied, inverse_alpha in sprites:
+                roi = image[y:y + h, x:x + w]
+                cv2.multiply(roi, inverse_alpha, dst=roi, scale=1.0 / 255.0)
+                cv2.add(roi, premultiplied, dst=roi)
+                rects.append((x, y, w, h))
+
+        dirty = list(set(rects) | set(self.drawn_rects))
+        self.drawn_rects = rects
+        return dirty
+
+    def visible_rects(self):
+        """Rects the next compose() blends (known after update(), before composing)."""
+        return [sprite[0] for _, sprites in self.elements.values() for sprite in sprites]
+
+def write_splash(width, height, splash_dir=SPLASH_DIR):
+    """
+    Precompute the boot splash for a panel size (raw RGB565, read by BootSplash
+    on the next start without numpy/cv2). Does nothing if it already exists.
+
+    Args:
+        width, height (int): Framebuffer size
+        splash_dir (str): Cache directory
+    """
+    path = splash_path(width, height, splash_dir)
+    if os.path.exists(path):
+        return
+    try:
+        image = np.zeros((height, width, 3), dtype=np.uint8)
+        scale = height / 1080.0
+        for text, y, size, color in (("AR WELDING MASK", 0.42, 2.2, (0, 165, 255)),
+                                     ("starting camera...", 0.52, 1.0, (200, 200, 200))):
+            (tw, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, size * scale, 2)
+            cv2.putText(image, text, ((width - tw) // 2, int(height * y)), cv2.FONT_HERSHEY_SIMPLEX,
+                        size * scale, color, max(1, int(3 * scale)), cv2.LINE_AA)
+        os.makedirs(splash_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(cv2.cvtColor(image, cv2.COLOR_BGR2BGR565).tobytes())
+        os.replace(tmp_path, path)
+    except (OSError, cv2.error) as e:
+        if DEBUG_MODE:
+            print(f"Splash cache error: {e}")
+
+def display_on_framebuffer(double_frame, battery_voltage, battery_status, battery_critical,
+                            mq07_voltage, mq07_status, mq07_dangerous,
+                            light_value, light_status, fb_writer=None, recording_active=False,
+                            hud=None, return_frame=True, stale_video=False, telemetry=None):
+    """
+    Render dual-view frame with OSD to framebuffer.
+    Optimized: reuses buffers, minimal copies, mmap'd framebuffer, fast resize.
+    With fb_writer and return_frame=False the video is packed to RGB565 at
+    camera size and scaled straight into the framebuffer (no BGR upscale).
+    Steady-state frames allocate nothing large: the canvas, packed eye and
+    RGB565 image are preallocated and every OpenCV call writes into dst=.
+    
+    Args:
+        double_frame (ndarray): Dual camera view (side-by-side)
+        battery_voltage, battery_status, battery_critical: Battery info
+        mq07_voltage, mq07_status, mq07_dangerous: Air quality info
+        light_value, light_status: Light level info
+        fb_writer (FramebufferWriter): Memory-mapped framebuffer (optional)
+        recording_active (bool): Whether recording is active
+        hud (HudCompositor): Cached HUD layer (optional, falls back to render_osd)
+        return_frame (bool): Whether the returned frame must contain the video
+        stale_video (bool): Camera stalled (HUD shows the stale video warning)
+        telemetry (TelemetryLog): CO averages for render_osd (the HUD has its own)
+    
+    Returns:
+        ndarray: The final rendered frame with OSD (for recording; valid until the next call)
+    """
+    global canvas_osd_rects, packed_eye_buffer
+    video_rect = (x_offset, y_offset, frame_width, frame_height)
+    # Clear the OSD drawn on the canvas last frame (the video area is overwritten)
+    background = background_canvas
+    for x, y, w, h in canvas_osd_rects:
+        background[y:y + h, x:x + w] = 0
+
+    # Sprites first: a frame whose OSD lands on the video keeps the video in the canvas
+    osd_rects = OSD_REGIONS
+    if hud is not None:
+        try:
+            hud.update(battery_voltage, battery_status, battery_critical,
+                       mq07_voltage, mq07_status, mq07_dangerous,
+                       light_value, light_status, recording_active, stale_video)
+            osd_rects = hud.visible_rects()
+        except Exception as e:
+            if DEBUG_MODE:
+                print('DEBUG: OSD render error:', e)
+    packed = fb_writer is not None and not return_frame and not osd_over_video(osd_rects, video_rect)
+    if packed:
+        # Pack at camera size, scale the 16-bit words straight into the framebuffer
+        if packed_eye_buffer is None or packed_eye_buffer.shape != double_frame.shape[:2]:
+            packed_eye_buffer = np.empty(double_frame.shape[:2], dtype=np.uint16)
+        pack_rgb565(double_frame, packed_eye_buffer)
+        fb_writer.set_layout(video_rect)
+        cv2.resize(packed_eye_buffer, (frame_width, frame_height), interpolation=cv2.INTER_NEAREST,
+                   dst=fb_writer.pixels[y_offset:y_offset + frame_height, x_offset:x_offset + frame_width])
+    else:
+        # Resize straight into the frame area (use INTER_NEAREST for maximum speed on embedded)
+        cv2.resize(double_frame, (frame_width, frame_height), interpolation=cv2.INTER_NEAREST,
+                   dst=background[y_offset:y_offset + frame_height, x_offset:x_offset + frame_width])
+
+    # Render OSD (cached sprites if available, otherwise existing renderer)
+    osd_rects = OSD_REGIONS
+    try:
+        if hud is not None:
+            osd_rects = hud.compose(background)
+        else:
+            render_osd(background, battery_voltage, battery_status, battery_critical,
+                       mq07_voltage, mq07_status, mq07_dangerous,
+                       light_value, light_status, recording_active, stale_video, telemetry)
+    except Exception:
+        # fallback: minimal text if render_osd fails
+        osd_rects = OSD_REGIONS
+        try:
+            cv2.putText(background, f'Air: {mq07_status}', (230, 150), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            cv2.putText(background, f'Light: {light_value}', (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        except Exception:
+            pass
+    canvas_osd_rects = osd_rects
+
+    # Write to framebuffer
+    try:
+        if fb_writer is not None:
+            # Convert straight into framebuffer memory: image area plus OSD boxes only,
+            # the rest of the letterbox stays black until the layout changes
+            fb_writer.set_layout(video_rect)
+            fb_writer.write(background, rects_outside(osd_rects, video_rect) if packed
+                            else [video_rect] + osd_rects)
+        else:
+            cv2.cvtColor(background, cv2.COLOR_BGR2BGR565, dst=rgb565_buffer)
+            fd = os.open(FB_DEVICE, os.O_WRONLY)  # No O_CREAT (see FramebufferWriter)
+            try:
+                os.write(fd, rgb565_buffer.data)
+            finally:
+                os.close(fd)
     except Exception as e:
         if DEBUG_MODE:
             print('DEBUG: Framebuffer write error:', e)
@@ -370,6 +3147,1429 @@ def display_on_framebuffer(double_frame, battery_voltage, battery_status, batter
     # Return the final frame for recording
     return background
 
+# ============================================================================
+# STEREO COMPOSITION (VR LENS PRE-DISTORTION)
+# ============================================================================
+
+def build_lens_map(src_size, eye_size, k1, k2, chroma, ipd_offset, eye):
+    """
+    Build an integer (CV_16SC2) remap table for one eye.
+    Folds scaling, IPD offset, barrel pre-distortion and (optionally)
+    per-channel chromatic offset into a single nearest-neighbour lookup.
+    With k1 = k2 = 0 and no chroma/IPD it matches cv2.resize(INTER_NEAREST).
+
+    Args:
+        src_size (tuple): Camera frame (width, height)
+        eye_size (tuple): Eye viewport (width, height) on the display
+        k1, k2 (float): Radial pre-distortion coefficients (r normalized to half eye width)
+        chroma (tuple): Per-channel (B, G, R) radial scale offsets
+        ipd_offset (int): Lens centre shift toward the nose in display pixels
+        eye (int): 0 = left, 1 = right
+
+    Returns:
+        ndarray: int16 map of shape (h, w, 2), or (h, w * 3, 2) with chroma
+                 (indexes the frame viewed as a (h, w * 3) single-channel image)
+    """
+    src_w, src_h = src_size
+    eye_w, eye_h = eye_size
+
+    # Lens centre in eye coordinates; image centre is drawn there
+    cx = eye_w / 2.0 + (ipd_offset if eye == 0 else -ipd_offset)
+    cy = eye_h / 2.0
+    du = np.arange(eye_w, dtype=np.float64)[None, :] - cx
+    dv = np.arange(eye_h, dtype=np.float64)[:, None] - cy
+    r2 = (du * du + dv * dv) / (eye_w / 2.0) ** 2
+    factor = 1.0 + k1 * r2 + k2 * r2 * r2
+
+    per_channel = any(c != 0 for c in chroma)
+    channel_scales = [1.0 + c for c in chroma] if per_channel else [1.0]
+    xs, ys = [], []
+    for scale in channel_scales:
+        # Sample point in eye coordinates, then eye -> camera pixels (floor like INTER_NEAREST)
+        u = eye_w / 2.0 + du * factor * scale
+        v = eye_h / 2.0 + dv * factor * scale
+        sx = np.floor(u * src_w / eye_w).astype(np.int32)
+        sy = np.floor(v * src_h / eye_h).astype(np.int32)
+        outside = (sx < 0) | (sx >= src_w) | (sy < 0) | (sy >= src_h)
+        sx[outside] = -1  # Sampled via BORDER_CONSTANT -> black
+        sy[outside] = -1
+        xs.append(sx)
+        ys.append(sy)
+
+    lens_map = np.empty((eye_h, eye_w * len(xs), 2), dtype=np.int16)
+    if per_channel:
+        for c in range(3):
+            lens_map[:, c::3, 0] = np.where(xs[c] < 0, -1, xs[c] * 3 + c)
+            lens_map[:, c::3, 1] = ys[c]
+    else:
+        lens_map[..., 0] = xs[0]
+        lens_map[..., 1] = ys[0]
+    return lens_map
+
+class StereoCompositor:
+    """
+    Per-eye stereo composition with VR lens pre-distortion.
+    One remap table per eye is built once (or loaded from the on-disk cache
+    keyed by its parameters) and each eye is remapped straight into its half
+    of the output in a single pass - no hstack, no double-wide resize.
+    """
+
+    def __init__(self, src_size, eye_size, k1=LENS_K1, k2=LENS_K2, chroma=LENS_CHROMA,
+                 ipd_offset=LENS_IPD_OFFSET, cache_dir=LENS_MAP_CACHE_DIR):
+        self.src_size = tuple(src_size)
+        self.eye_size = tuple(eye_size)
+        self.per_channel = any(c != 0 for c in chroma)
+        self.maps = [self._load_or_build(eye, k1, k2, tuple(chroma), ipd_offset, cache_dir)
+                     for eye in (0, 1)]
+
+    def _load_or_build(self, eye, k1, k2, chroma, ipd_offset, cache_dir):
+        """Load an eye's map from cache_dir, building and saving it on a miss."""
+        params = (self.src_size, self.eye_size, k1, k2, chroma, ipd_offset, eye)
+        key = hashlib.sha1(repr(params).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"lens_{key}.npy") if cache_dir else None
+
+        if path is not None and os.path.exists(path):
+            try:
+                return np.load(path)
+            except (OSError, ValueError) as e:
+                if DEBUG_MODE:
+                    print(f"DEBUG: lens map cache unreadable ({path}): {e}")
+
+        lens_map = build_lens_map(self.src_size, self.eye_size, k1, k2, chroma, ipd_offset, eye)
+        if path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(path, lens_map)
+            except OSError as e:
+                if DEBUG_MODE:
+                    print(f"DEBUG: could not cache lens map: {e}")
+        return lens_map
+
+    def compose(self, frame, dst):
+        """
+        Remap frame into both eye halves of dst.
+
+        Args:
+            frame (ndarray): Contiguous camera frame (src_size)
+            dst (ndarray): Output view of shape (eye_h, 2 * eye_w, 3)
+        """
+        self.compose_rows(frame, dst, 0, self.eye_size[1])
+
+    def compose_rows(self, frame, dst, y0, y1):
+        """
+        Remap output rows y0..y1 of both eyes (one stripe of compose()).
+        Each output pixel depends only on its own map entry, so stripes
+        composed separately are identical to a single full pass.
+
+        Args:
+            frame (ndarray): Contiguous camera frame (src_size)
+            dst (ndarray): Full output view of shape (eye_h, 2 * eye_w, 3)
+            y0, y1 (int): Output row range
+        """
+        eye_w = self.eye_size[0]
+        src = frame.reshape(frame.shape[0], -1) if self.per_channel else frame
+        for eye, lens_map in enumerate(self.maps):
+            half = dst[y0:y1, eye * eye_w:(eye + 1) * eye_w]
+            if self.per_channel:
+                half = half.reshape(y1 - y0, eye_w * 3)
+            cv2.remap(src, lens_map[y0:y1], None, cv2.INTER_NEAREST, dst=half,
+                      borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+# ============================================================================
+# PACKED RGB565 SCALING
+# ============================================================================
+
+def pack_rgb565(image, dst):
+    """
+    Convert a BGR image into packed RGB565 (framebuffer pixel format).
+
+    Args:
+        image (ndarray): BGR image (h, w, 3)
+        dst (ndarray): uint16 output (h, w)
+    """
+    cv2.cvtColor(image, cv2.COLOR_BGR2BGR565, dst=dst.view(np.uint8).reshape(dst.shape + (2,)))
+
+class PackedScaler:
+    """
+    Nearest-neighbour upscale of a packed RGB565 eye into both halves of the
+    video area, written straight into the framebuffer as 16-bit words.
+    Nearest sampling commutes with the per-pixel 565 conversion, so packing
+    at camera size and scaling afterwards is bit-identical to scaling in BGR
+    and converting at display size - with every display pixel written once.
+    """
+
+    def __init__(self, eye_size):
+        self.eye_size = tuple(eye_size)
+
+    def compose(self, eye, dst):
+        """
+        Scale eye into the left half of dst and copy it to the right half.
+
+        Args:
+            eye (ndarray): uint16 RGB565 eye at camera size
+            dst (ndarray): uint16 output view of shape (eye_h, 2 * eye_w)
+        """
+        eye_w = self.eye_size[0]
+        left = dst[:, :eye_w]
+        cv2.resize(eye, self.eye_size, dst=left, interpolation=cv2.INTER_NEAREST)
+        cv2.copyTo(left, None, dst=dst[:, eye_w:2 * eye_w])
+
+# ============================================================================
+# RENDER PIPELINE
+# ============================================================================
+
+class RenderPipeline:
+    """
+    Compose and present stages of the capture -> compose -> convert/present pipeline.
+    compose() runs on the main thread and fills a preallocated canvas slot;
+    a present thread converts the newest canvas straight into the mmap'd
+    framebuffer (convert and present are one pass into fb memory).
+    Frames are handed off by slot index; stale frames are dropped, never queued.
+    With a StripeWorkers pool both stages split the video area into stripes.
+    Nearest-sampled video skips the BGR canvas: compose packs the eye to
+    RGB565 at camera size (cvtColor, or the YUV LUT for I420 frames) and
+    present scales/remaps it straight into the framebuffer; OSD rects are
+    still converted from the canvas. Linear upscaling, per-channel lens
+    remap and composite recording keep the video in the canvas, and so does
+    any frame whose OSD lands on the video (decided per frame).
+    """
+
+    def __init__(self, fb_writer, hud=None, stereo=None, slots=PIPELINE_SLOTS, stats=None,
+                 vsync=PRESENT_VSYNC, workers=None):
+        self.fb_writer = fb_writer
+        self.hud = hud
+        self.telemetry = None  # Set by the owner (CO averages for render_osd without a HUD)
+        self.stereo = stereo
+        self.stats = stats
+        self.vsync = vsync
+        self.workers = workers
+        self.interpolation = cv2.INTER_NEAREST  # Upscale when the lens remap is off
+        self.canvas_video = False  # Keep the video in the BGR canvas (composite recording)
+        self.yuv = Yuv565Converter()
+        self.yuv_bgr = None                 # I420 eye converted to BGR (frames with OSD on the video)
+        self.yuv_scratch = None
+        self.packed = [None] * slots        # Per-slot RGB565 eye at camera size
+        self.slot_video = [None] * slots    # Remap/scaler that presents the packed eye (None = BGR canvas)
+        self.canvas_ring = FrameRing((FB_HEIGHT, FB_WIDTH, 3), slots=slots)
+        self.slot_rects = [[] for _ in range(slots)]  # OSD rects drawn on each canvas slot
+        self.video_rect = (x_offset, y_offset, frame_width, frame_height)
+        self.scaler = PackedScaler((frame_width // 2, frame_height))
+        self.presented_rects = []
+        self.presented = 0
+        self.first_presented = None  # time.monotonic() of the first presented frame (startup metric)
+        self.running = True
+        self.thread = Thread(target=self._present_frames, daemon=True)
+        self.thread.start()
+
+    def compose(self, frame, battery_voltage, battery_status, battery_critical,
+                mq07_voltage, mq07_status, mq07_dangerous,
+                light_value, light_status, recording_active=False, stamps=None, stale_video=False):
+        """
+        Compose dual view + OSD into the next canvas slot and hand it to the present stage.
+
+        Args:
+            frame (ndarray): Single-eye camera frame
+            (remaining args as display_on_framebuffer)
+            stamps (ndarray): Capture ring timestamps of the frame (for latency stats)
+            stale_video (bool): Camera stalled (HUD shows the stale video warning)
+
+        Returns:
+            ndarray: The composed canvas (valid until the next compose call)
+        """
+        index = self.canvas_ring.acquire_write()
+        canvas = self.canvas_ring.buffers[index]
+
+        # Clear OSD left on this slot by its previous use (letterbox is otherwise untouched)
+        for x, y, w, h in self.slot_rects[index]:
+            canvas[y:y + h, x:x + w] = 0
+
+        # Sprites first: a frame whose OSD lands on the video keeps the video in the canvas
+        osd_rects = OSD_REGIONS
+        if self.hud is not None:
+            try:
+                self.hud.update(battery_voltage, battery_status, battery_critical,
+                                mq07_voltage, mq07_status, mq07_dangerous,
+                                light_value, light_status, recording_active, stale_video)
+                osd_rects = self.hud.visible_rects()
+            except Exception as e:
+                if DEBUG_MODE:
+                    print('DEBUG: OSD render error:', e)
+        osd_on_video = osd_over_video(osd_rects, self.video_rect)
+
+        x, y, w, h = self.video_rect
+        yuv = frame.ndim == 2
+        src_size = (frame.shape[1], frame.shape[0] * 2 // 3 if yuv else frame.shape[0])
+        if yuv and osd_on_video:
+            # The canvas path scales BGR: convert this frame's eye into preallocated buffers
+            if self.yuv_bgr is None or self.yuv_bgr.shape[:2] != (src_size[1], src_size[0]):
+                self.yuv_bgr = np.empty((src_size[1], src_size[0], 3), dtype=np.uint8)
+                self.yuv_scratch = np.empty_like(self.yuv_bgr)
+            yuv420_to_bgr(frame, self.yuv_bgr, self.yuv_scratch)
+            frame, yuv = self.yuv_bgr, False
+        stereo = self.stereo
+        if stereo is not None and (stereo.src_size != src_size or (yuv and stereo.per_channel)):
+            stereo = None
+        if yuv:
+            packed = True
+        elif self.canvas_video or osd_on_video:
+            packed = False
+        elif stereo is not None:
+            packed = not stereo.per_channel
+        else:
+            packed = self.interpolation == cv2.INTER_NEAREST
+
+        self.slot_video[index] = None
+        if packed:
+            # Pack the eye to RGB565 at camera size; present scales/remaps it into the framebuffer
+            eye = self.packed[index]
+            if eye is None or eye.shape != (src_size[1], src_size[0]):
+                eye = self.packed[index] = np.empty((src_size[1], src_size[0]), dtype=np.uint16)
+            if yuv:
+                self.yuv.convert(frame, eye)
+            else:
+                pack_rgb565(frame, eye)
+            self.slot_video[index] = stereo if stereo is not None else self.scaler
+        elif stereo is not None:
+            # Per-eye remap straight into each half
+            video = canvas[y:y + h, x:x + 2 * (w // 2)]
+            if self.workers is not None:
+                self.workers.run(lambda y0, y1: stereo.compose_rows(frame, video, y0, y1), h)
+            else:
+                stereo.compose(frame, video)
+        else:
+            # Scale the eye once into the left half, duplicate into the right half
+            left = canvas[y:y + h, x:x + w // 2]
+            right = canvas[y:y + h, x + w // 2:x + w]
+            cv2.resize(frame, (left.shape[1], h), dst=left, interpolation=self.interpolation)
+            if right.shape == left.shape:
+                # cv2 copy: np.copyto would buffer through a temporary (halves share a base)
+                cv2.copyTo(left, None, dst=right)
+            else:
+                cv2.resize(frame, (right.shape[1], h), dst=right, interpolation=self.interpolation)
+
+        try:
+            if self.hud is not None:
+                self.hud.compose(canvas)
+                self.slot_rects[index] = self.hud.drawn_rects
+            else:
+                render_osd(canvas, battery_voltage, battery_status, battery_critical,
+                           mq07_voltage, mq07_status, mq07_dangerous,
+                           light_value, light_status, recording_active, stale_video, self.telemetry)
+                self.slot_rects[index] = OSD_REGIONS
+        except Exception as e:
+            if DEBUG_MODE:
+                print('DEBUG: OSD render error:', e)
+
+        canvas_stamps = self.canvas_ring.stamps[index]
+        canvas_stamps[STAMP_COMPOSED] = time.monotonic_ns()
+        if stamps is not None:
+            canvas_stamps[STAMP_SENSOR] = stamps[STAMP_SENSOR]
+            canvas_stamps[STAMP_CAPTURED] = stamps[STAMP_CAPTURED]
+        else:
+            canvas_stamps[STAMP_SENSOR] = canvas_stamps[STAMP_CAPTURED] = canvas_stamps[STAMP_COMPOSED]
+        self.canvas_ring.publish(index)
+        return canvas
+
+    def _present_frames(self):
+        """Convert the newest composed canvas into the framebuffer."""
+        last_seq = 0
+        while self.running:
+            index, seq = self.canvas_ring.wait_read(last_seq, 0.1)
+            if index < 0:
+                continue
+            try:
+                if self.vsync and not self.fb_writer.wait_vsync():
+                    self.vsync = False
+                    print("FBIO_WAITFORVSYNC not supported, presenting without vsync")
+                rects = self.slot_rects[index]
+                self.fb_writer.set_layout(self.video_rect)
+                video = self.slot_video[index]
+                if video is not None:
+                    self._present_packed(video, self.packed[index])
+                    # OSD still on screen from a canvas frame: only its letterbox part (the
+                    # packed present just rewrote the video area; the canvas there is stale)
+                    dirty = rects_outside(rects + self.presented_rects, self.video_rect)
+                else:
+                    dirty = [self.video_rect] + rects + self.presented_rects
+                # Image area, this frame's OSD and whatever OSD is still on screen from before
+                self.fb_writer.write(self.canvas_ring.buffers[index], dirty, self.workers)
+                self.presented_rects = rects
+                if self.first_presented is None:
+                    self.first_presented = time.monotonic()
+                self.presented += 1
+                if self.stats is not None:
+                    sensor_ns, captured_ns, composed_ns = self.canvas_ring.stamps[index].tolist()
+                    self.stats.record(sensor_ns, captured_ns, composed_ns, time.monotonic_ns())
+            except Exception as e:
+                if DEBUG_MODE:
+                    print('DEBUG: Framebuffer write error:', e)
+            finally:
+                self.canvas_ring.release(index)
+            last_seq = seq
+
+    def _present_packed(self, video, eye):
+        """
+        Remap a packed RGB565 eye into both halves of the framebuffer video area.
+
+        Args:
+            video (StereoCompositor | PackedScaler): Lens remap or plain scaler
+            eye (ndarray): uint16 RGB565 eye at camera size
+        """
+        x, y, w, h = self.video_rect
+        dst = self.fb_writer.pixels[y:y + h, x:x + 2 * (w // 2)]
+        if self.workers is not None and isinstance(video, StereoCompositor):
+            self.workers.run(lambda y0, y1: video.compose_rows(eye, dst, y0, y1), h)
+        else:
+            video.compose(eye, dst)
+
+    def wait_presented(self, count, timeout=REPLAY_PRESENT_TIMEOUT):
+        """
+        Wait until `count` frames have been presented.
+
+        Returns:
+            bool: False on timeout
+        """
+        deadline = time.perf_counter() + timeout
+        while self.presented < count:
+            if time.perf_counter() > deadline:
+                return False
+            time.sleep(0.0002)
+        return True
+
+    def stop(self):
+        """Stop the present thread."""
+        self.running = False
+        self.thread.join(timeout=2.0)
+
+# ============================================================================
+# FRAME-TIME GOVERNOR
+# ============================================================================
+
+class FrameGovernor:
+    """
+    Closed-loop frame-time governor.
+    Watches the main loop's per-frame work time against the frame budget and
+    moves through QUALITY_LADDER one level at a time: down after
+    GOVERNOR_DOWN_FRAMES consecutive frames over GOVERNOR_HIGH of the budget,
+    up after GOVERNOR_UP_FRAMES consecutive frames under GOVERNOR_LOW. The gap
+    between the thresholds plus a cooldown after every change keeps it from
+    oscillating between two levels.
+    """
+
+    def __init__(self, budget=FRAME_TIME_BUDGET, level=GOVERNOR_START_LEVEL, ladder=QUALITY_LADDER):
+        self.ladder = ladder
+        self.budget = budget
+        self.level = max(0, min(len(ladder) - 1, level))
+        self.over = 0
+        self.under = 0
+        self.cooldown = 0
+        self.changes = 0
+
+    @property
+    def quality(self):
+        """Current ladder entry."""
+        return self.ladder[self.level]
+
+    def observe(self, frame_time):
+        """
+        Add one frame's work time.
+
+        Args:
+            frame_time (float): Seconds of work for the frame
+
+        Returns:
+            dict: New ladder entry if the level changed, else None
+        """
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return None
+
+        load = frame_time / self.budget
+        if load > GOVERNOR_HIGH:
+            self.over += 1
+            self.under = 0
+        elif load < GOVERNOR_LOW:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = self.under = 0  # Inside the hysteresis band: hold
+
+        if self.over >= GOVERNOR_DOWN_FRAMES and self.level < len(self.ladder) - 1:
+            return self._step(1)
+        if self.under >= GOVERNOR_UP_FRAMES and self.level > 0:
+            return self._step(-1)
+        return None
+
+    def _step(self, direction):
+        self.level += direction
+        self.over = self.under = 0
+        self.cooldown = GOVERNOR_COOLDOWN_FRAMES
+        self.changes += 1
+        return self.quality
+
+def apply_quality(quality, frame_processor, pipeline=None, hud=None, recorder=None, stereo=None,
+                  tonemap=None):
+    """
+    Switch the running pipeline to a QUALITY_LADDER entry.
+    Call from the main loop between frames (no capture slot held).
+
+    Args:
+        quality (dict): Ladder entry
+        frame_processor (FrameProcessor): Capture stage (camera stream is resized if needed)
+        pipeline (RenderPipeline): Compose stage (lens remap / interpolation)
+        hud (HudCompositor): HUD (detail)
+        recorder (RecordingEncoder): Encoder (recording scale)
+        stereo (StereoCompositor): Lens remap to use when the level enables it
+        tonemap (ToneMapper): Arc tone mapping (on/off)
+
+    Returns:
+        bool: True if a camera stream resize was requested (the capture thread
+              replaces the ring before its next frame)
+    """
+    width, height = quality["camera"]
+    resized = (frame_processor.pending_size or frame_processor.size) != (width, height)
+    if resized:
+        frame_processor.resize(width, height)
+    if pipeline is not None:
+        pipeline.stereo = stereo if quality["lens"] else None
+        pipeline.interpolation = cv2.INTER_LINEAR if quality["interpolation"] == "linear" else cv2.INTER_NEAREST
+    if hud is not None:
+        hud.detail = quality["hud"]
+    if recorder is not None:
+        recorder.scale = quality["recording_scale"]
+    if tonemap is not None:
+        tonemap.enabled = quality["tonemap"]
+    return resized
+
+# ============================================================================
+# BACKGROUND RECORDING
+# ============================================================================
+
+class PrerollRing:
+    """
+    JPEG-compressed ring of the most recent frames (lives in the encoder process).
+    Frames are encoded into one preallocated byte buffer of memory_mb; the
+    oldest frames are dropped when it is full or when they are older than
+    `seconds`, so memory stays bounded whatever the frame content.
+    """
+
+    def __init__(self, seconds=PREROLL_SECONDS, memory_mb=PREROLL_MEMORY_MB,
+                 quality=PREROLL_JPEG_QUALITY):
+        self.seconds = seconds
+        self.buffer = np.zeros(int(memory_mb * 1024 * 1024), dtype=np.uint8)
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.entries = deque()  # (offset, length, timestamp, sensors, (w, h)), oldest first
+        self.head = 0           # Next write offset
+        self.encode_ms = 0.0    # Mean JPEG encode time per frame (EMA)
+
+    def add(self, image, timestamp, sensors):
+        """
+        Compress a frame into the ring.
+
+        Args:
+            image (ndarray): BGR frame
+            timestamp (float): Capture time (Unix)
+            sensors (tuple): Sidecar values
+
+        Returns:
+            bool: False if the frame could not be stored
+        """
+        start = time.perf_counter()
+        ok, jpeg = cv2.imencode(".jpg", image, self.params)
+        self.encode_ms += 0.05 * ((time.perf_counter() - start) * 1000.0 - self.encode_ms)
+        if not ok or jpeg.size > self.buffer.size:
+            return False
+
+        length = jpeg.size
+        offset = self.head
+        if offset + length > self.buffer.size:
+            # Wrap: the entries between head and the end are the oldest, drop them first
+            while self.entries and self.entries[0][0] >= self.head:
+                self.entries.popleft()
+            offset = 0
+        while self.entries and (self.entries[0][0] < offset + length
+                                and offset < self.entries[0][0] + self.entries[0][1]):
+            self.entries.popleft()
+        while self.entries and self.entries[0][2] < timestamp - self.seconds:
+            self.entries.popleft()
+
+        self.buffer[offset:offset + length] = jpeg.reshape(-1)
+        self.entries.append((offset, length, timestamp, sensors, (image.shape[1], image.shape[0])))
+        self.head = offset + length
+        return True
+
+    def drain(self):
+        """
+        Decode and remove all buffered frames, oldest first.
+
+        Yields:
+            tuple: (image, timestamp, sensors, (w, h))
+        """
+        while self.entries:
+            offset, length, timestamp, sensors, size = self.entries.popleft()
+            image = cv2.imdecode(self.buffer[offset:offset + length], cv2.IMREAD_COLOR)
+            if image is not None:
+                yield image, timestamp, sensors, size
+        self.head = 0
+
+def run_recording_encoder(shm_name, frame_shape, slots, frames, free_slots, written,
+                          fps, codec, segment_seconds, preroll_seconds=0.0,
+                          preroll_frames=None, preroll_encode_ms=None):
+    """
+    Encoder process main loop (see RecordingEncoder).
+    Writes segmented video files plus a CSV sensor sidecar per segment and
+    hands every slot back to free_slots once encoded. Outside a recording,
+    frames go into the JPEG pre-roll ring, which is flushed at the start of
+    the next recording.
+
+    Messages on `frames`:
+        ("start", base_path) | ("frame" | "preroll", slot, timestamp, sensors, (w, h), source)
+        | ("stop",) | ("exit",)
+    `source` is None for a BGR slot, or the (w, h) of an I420 frame stored in
+    the slot bytes (converted and scaled here, off the render process).
+    A frame size change (governor recording scale) starts a new segment.
+    """
+    try:
+        os.nice(10)  # Never compete with the render process for CPU
+    except OSError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buffers = np.ndarray((slots,) + tuple(frame_shape), dtype=np.uint8, buffer=shm.buf)
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    segment_size = None
+    preroll = PrerollRing(preroll_seconds) if preroll_seconds > 0 else None
+    work = {}  # Conversion buffers per shape for I420 slots
+
+    base_path = None
+    video_writer = None
+    sidecar = None
+    segment = 0
+    segment_start = 0.0
+    frame_seq = 0
+
+    def close_segment():
+        nonlocal video_writer, sidecar
+        if video_writer is not None:
+            video_writer.release()
+            video_writer = None
+        if sidecar is not None:
+            sidecar.close()
+            sidecar = None
+
+    def slot_image(index, size, source):
+        """BGR image of a slot at the recording size."""
+        if source is None:
+            return buffers[index][:size[1], :size[0]]
+        width, height = source
+        if (width, height) not in work:
+            work[(width, height)] = (np.empty((height, width, 3), dtype=np.uint8),
+                                     np.empty((height, width, 3), dtype=np.uint8))
+        bgr, scratch = work[(width, height)]
+        yuv = buffers[index].reshape(-1)[:width * height * 3 // 2].reshape(height * 3 // 2, width)
+        yuv420_to_bgr(yuv, bgr, scratch)
+        if (width, height) == size:
+            return bgr
+        return cv2.resize(bgr, size, interpolation=cv2.INTER_AREA)
+
+    def write_frame(image, timestamp, sensors, size):
+        nonlocal video_writer, sidecar, segment, segment_start, segment_size, frame_seq
+        # Open first segment lazily, roll over every segment_seconds or on a size change
+        if (video_writer is None or timestamp - segment_start >= segment_seconds
+                or size != segment_size):
+            if video_writer is not None:
+                segment += 1
+            close_segment()
+            video_writer = cv2.VideoWriter(f"{base_path}_{segment:03d}.mp4", fourcc, fps, size)
+            sidecar = open(f"{base_path}_{segment:03d}.csv", "w")
+            sidecar.write("frame,timestamp,battery_v,mq07_v,light\n")
+            segment_start = timestamp
+            segment_size = size
+        video_writer.write(image)
+        battery_v, mq07_v, light_val = sensors
+        sidecar.write(f"{frame_seq},{timestamp:.3f},{battery_v:.2f},{mq07_v:.2f},{light_val}\n")
+        frame_seq += 1
+        written.value += 1
+
+    while True:
+        message = frames.get()
+        kind = message[0]
+
+        if kind == "frame" or kind == "preroll":
+            _, index, timestamp, sensors, size, source = message
+            try:
+                if kind == "preroll":
+                    if preroll is not None and base_path is None:
+                        preroll.add(slot_image(index, size, source), timestamp, sensors)
+                        preroll_frames.value = len(preroll.entries)
+                        preroll_encode_ms.value = preroll.encode_ms
+                    continue
+                if base_path is None:
+                    continue
+                write_frame(slot_image(index, size, source), timestamp, sensors, size)
+            except Exception as e:
+                print(f"Recording encoder error: {e}")
+            finally:
+                free_slots.put(index)
+        elif kind == "start":
+            close_segment()
+            base_path = message[1]
+            segment = 0
+            frame_seq = 0
+            if preroll is not None:
+                # Seconds before the trigger first (same segment rules as live frames)
+                try:
+                    for image, timestamp, sensors, size in preroll.drain():
+                        write_frame(image, timestamp, sensors, size)
+                except Exception as e:
+                    print(f"Recording encoder error (pre-roll): {e}")
+                preroll_frames.value = 0
+        elif kind == "stop":
+            close_segment()
+            base_path = None
+        elif kind == "exit":
+            close_segment()
+            break
+
+    buffers = None
+    shm.close()
+
+class RecordingEncoder:
+    """
+    Recording in a separate encoder process fed through a shared-memory frame pool.
+    submit() copies the frame into a free slot and queues its index; it never
+    blocks - when every slot is still waiting for the encoder the frame is
+    dropped and counted, so encoder stalls can't stall the display.
+    With preroll_seconds set, frames submitted between recordings feed the
+    encoder's JPEG pre-roll ring (compression runs in the encoder process).
+    """
+
+    def __init__(self, frame_shape, slots=RECORDING_QUEUE_SLOTS, fps=RECORDING_FPS,
+                 codec=RECORDING_CODEC, segment_seconds=RECORDING_SEGMENT_SECONDS,
+                 preroll_seconds=PREROLL_SECONDS):
+        ctx = multiprocessing.get_context("spawn")  # Don't fork the camera/capture threads
+        self.frame_shape = tuple(frame_shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.frame_shape)) * slots)
+        self.slots = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.free_slots = ctx.Queue()
+        for i in range(slots):
+            self.free_slots.put(i)
+        self.frames = ctx.Queue()
+        self.written = ctx.Value('q', 0, lock=False)
+        self.submitted = 0
+        self.dropped = 0
+        self.active = False
+        self.scale = 1.0   # Recording resolution relative to frame_shape (set by the governor)
+        self.preroll_seconds = preroll_seconds
+        self.preroll_frames = ctx.Value('q', 0, lock=False)     # Frames in the pre-roll ring
+        self.preroll_encode_ms = ctx.Value('d', 0.0, lock=False)  # Mean JPEG encode time
+        self.process = ctx.Process(target=run_recording_encoder,
+                                   args=(self.shm.name, self.frame_shape, slots, self.frames,
+                                         self.free_slots, self.written, fps, codec, segment_seconds,
+                                         preroll_seconds, self.preroll_frames, self.preroll_encode_ms),
+                                   daemon=True)
+        self.process.start()
+
+    def start(self, base_path):
+        """
+        Begin a recording session.
+
+        Args:
+            base_path (str): Output path without extension; segments get _NNN.mp4/.csv
+        """
+        self.frames.put(("start", base_path))
+        self.active = True
+
+    def submit(self, frame, sensors):
+        """
+        Queue a frame for encoding (or for the pre-roll) without blocking.
+
+        Args:
+            frame (ndarray): BGR frame (resized to frame_shape x scale if it differs),
+                             or an I420 frame (converted in the encoder process)
+            sensors (tuple): (battery_v, mq07_v, light_val) for the sidecar
+
+        Returns:
+            bool: True if queued, False if dropped
+        """
+        if not self.active and self.preroll_seconds <= 0:
+            return False
+        try:
+            index = self.free_slots.get_nowait()
+        except queue.Empty:
+            if self.active:
+                self.dropped += 1
+            return False
+        height, width = self.frame_shape[:2]
+        if self.scale != 1.0:
+            width, height = int(width * self.scale) & ~1, int(height * self.scale) & ~1
+        source = None
+        if frame.ndim == 2:
+            # I420 camera frame: raw planes into the slot bytes
+            source = (frame.shape[1], frame.shape[0] * 2 // 3)
+            np.copyto(self.slots[index].reshape(-1)[:frame.size].reshape(frame.shape), frame)
+        else:
+            slot = self.slots[index][:height, :width]
+            if frame.shape[:2] == (height, width):
+                np.copyto(slot, frame)
+            else:
+                cv2.resize(frame, (width, height), dst=slot, interpolation=cv2.INTER_AREA)
+        kind = "frame" if self.active else "preroll"
+        self.frames.put_nowait((kind, index, time.time(), sensors, (width, height), source))
+        if self.active:
+            self.submitted += 1
+        return True
+
+    def stop(self):
+        """End the recording session (encoder finishes queued frames first)."""
+        self.frames.put(("stop",))
+        self.active = False
+
+    def close(self):
+        """Flush, stop the encoder process and free the shared memory."""
+        self.frames.put(("exit",))
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.slots = None
+        self.shm.close()
+        self.shm.unlink()
+
+# ============================================================================
+# LIVE PREVIEW
+# ============================================================================
+# One POSIX shared memory block, created by the render process:
+#   header  int64[2]                        sequence number and index of the newest slot
+#   meta    int64[slots, 4]                 per slot: sequence (0 while written), width, height, I420 flag
+#   state   uint8[slots, PREVIEW_STATE_BYTES]   HUD state, NUL-padded JSON
+#   frames  uint8[slots, frame_bytes]       camera frame (BGR, or the I420 planes)
+# The reader copies the newest slot and keeps the copy only if the slot's
+# sequence number is the same before and after (a lapped slot is skipped).
+
+def preview_layout(slots, frame_bytes, buf=None):
+    """
+    Views of the preview ring in a shared memory buffer.
+
+    Args:
+        slots (int): Frame slots
+        frame_bytes (int): Bytes per frame slot
+        buf (memoryview): Shared memory buffer (None: just compute the size)
+
+    Returns:
+        tuple: (header, meta, state, frames) ndarrays, or the total size in bytes without buf
+    """
+    shapes = (((2,), np.int64), ((slots, 4), np.int64),
+              ((slots, PREVIEW_STATE_BYTES), np.uint8), ((slots, frame_bytes), np.uint8))
+    views = []
+    offset = 0
+    for shape, dtype in shapes:
+        if buf is not None:
+            views.append(np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset))
+        offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return tuple(views) if buf is not None else offset
+
+def preview_overlay(image, state):
+    """
+    Draw the HUD state as a text bar along the bottom of a preview image.
+
+    Args:
+        image (ndarray): BGR preview image (drawn in place)
+        state (dict): HUD values published with the frame
+    """
+    height, width = image.shape[:2]
+    scale = width / 640.0
+    parts = [f"BAT {state.get('battery_v', 0.0):.2f}V {state.get('battery', '')}",
+             f"CO {state.get('co_v', 0.0):.2f}V {state.get('air', '')}",
+             f"LIGHT {state.get('light', 0)}"]
+    if state.get("recording"):
+        parts.append("REC")
+    if state.get("stale"):
+        parts.append(STALE_VIDEO_TEXT)
+    bar = int(24 * scale)
+    image[height - bar:] //= 3
+    color = (0, 0, 255) if state.get("co_danger") or state.get("stale") else (255, 255, 255)
+    cv2.putText(image, "  ".join(parts), (int(6 * scale), height - int(7 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5 * scale, color, 1, cv2.LINE_AA)
+
+def run_preview_server(shm_name, slots, frame_bytes, port, bind, fps, width, quality,
+                       viewers, encoded, stop):
+    """
+    Preview server process main loop (see PreviewPublisher).
+    One thread encodes the newest slot (at most `fps` per second, and only
+    while someone is watching); HTTP threads send that one JPEG to every
+    viewer. Runs at PREVIEW_NICE so it yields to the render process.
+
+    Routes:
+        /               page showing the stream
+        /stream.mjpg    multipart MJPEG stream
+        /frame.jpg      next frame as a single JPEG
+        /state          HUD state of the latest frame (JSON)
+    """
+    # Only this process serves HTTP (keeps the import out of the render process boot)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    try:
+        os.nice(PREVIEW_NICE)
+    except OSError:
+        pass
+    shm = shared_memory.SharedMemory(name=shm_name)
+    header, meta, state, frames = preview_layout(slots, frame_bytes, shm.buf)
+    local = np.empty(frame_bytes, dtype=np.uint8)
+    work = {}
+    latest = {"seq": 0, "jpeg": None, "state": b"{}"}
+    ready = Condition()
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    def grab():
+        """Newest complete slot as (seq, BGR image, state JSON), or None."""
+        seq, index = int(header[0]), int(header[1])
+        if seq == 0 or seq == latest["seq"] or int(meta[index, 0]) != seq:
+            return None
+        frame_width, frame_height, yuv = (int(v) for v in meta[index, 1:4])
+        size = frame_width * frame_height * 3 // 2 if yuv else frame_width * frame_height * 3
+        np.copyto(local[:size], frames[index, :size])
+        text = bytes(state[index]).rstrip(b"\0")
+        if int(meta[index, 0]) != seq:
+            return None  # Overwritten while copying
+        if yuv:
+            if (frame_width, frame_height) not in work:
+                work[(frame_width, frame_height)] = (
+                    np.empty((frame_height, frame_width, 3), dtype=np.uint8),
+                    np.empty((frame_height, frame_width, 3), dtype=np.uint8))
+            bgr, scratch = work[(frame_width, frame_height)]
+            yuv420_to_bgr(local[:size].reshape(frame_height * 3 // 2, frame_width), bgr, scratch)
+        else:
+            bgr = local[:size].reshape(frame_height, frame_width, 3)
+        height = max(int(frame_height * width / frame_width) & ~1, 2)
+        return seq, cv2.resize(bgr, (width, height), interpolation=cv2.INTER_AREA), text
+
+    def encode_frames():
+        interval = 1.0 / fps
+        while not stop.is_set():
+            started = time.monotonic()
+            if viewers.value > 0:
+                try:
+                    frame = grab()
+                    if frame is not None:
+                        seq, image, text = frame
+                        try:
+                            preview_overlay(image, json.loads(text or b"{}"))
+                        except ValueError:
+                            pass
+                        ok, jpeg = cv2.imencode(".jpg", image, params)
+                        if ok:
+                            with ready:
+                                latest.update(seq=seq, jpeg=jpeg.tobytes(), state=text or b"{}")
+                                ready.notify_all()
+                            encoded.value += 1
+                except Exception as e:
+                    if DEBUG_MODE:
+                        print(f"Preview encode error: {e}")
+            stop.wait(max(interval - (time.monotonic() - started), 0.001))
+
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # No per-request logging on the mask
+
+        def send_body(self, content_type, body):
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/":
+                self.send_body("text/html", b"<html><body style='margin:0;background:#000'>"
+                                            b"<img src='/stream.mjpg' style='width:100%'></body></html>")
+                return
+            if self.path == "/state":
+                self.send_body("application/json", latest["state"])
+                return
+            if self.path not in ("/stream.mjpg", "/frame.jpg"):
+                self.send_error(404)
+                return
+            with viewers.get_lock():
+                viewers.value += 1
+            try:
+                last = latest["seq"]  # Wait for a fresh frame (the cached one may be old)
+                if self.path == "/stream.mjpg":
+                    self.send_response(200)
+                    self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                    self.send_header("Cache-Control", "no-store")
+                    self.end_headers()
+                while not stop.is_set():
+                    with ready:
+                        ready.wait_for(lambda: latest["seq"] != last or stop.is_set(), timeout=1.0)
+                        seq, jpeg = latest["seq"], latest["jpeg"]
+                    if seq == last or jpeg is None:
+                        continue
+                    last = seq
+                    if self.path == "/frame.jpg":
+                        self.send_body("image/jpeg", jpeg)
+                        return
+                    self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n"
+                                     b"Content-Length: %d\r\n\r\n" % len(jpeg))
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b"\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # Viewer went away
+            finally:
+                with viewers.get_lock():
+                    viewers.value -= 1
+
+    try:
+        server = ThreadingHTTPServer((bind, port), PreviewHandler)
+    except OSError as e:
+        print(f"Preview server unavailable on {bind}:{port}: {e}")
+        shm.close()
+        return
+    server.daemon_threads = True
+    Thread(target=encode_frames, daemon=True).start()
+    Thread(target=server.serve_forever, daemon=True).start()
+    stop.wait()
+    with ready:
+        ready.notify_all()
+    server.shutdown()
+    server.server_close()
+    del header, meta, state, frames
+    shm.close()
+
+class PreviewPublisher:
+    """
+    Live preview of the welder's view for a supervisor or instructor.
+    publish() copies the camera frame and the HUD state into a POSIX shared
+    memory ring, at most `fps` times per second. A separate low-priority
+    process reads the newest slot, scales it, draws the HUD state,
+    JPEG-encodes it and serves it as MJPEG over HTTP. The render process
+    never encodes or touches a socket: its cost is one frame copy per
+    published frame, whether anyone is watching or not.
+    """
+
+    def __init__(self, frame_shape, port=PREVIEW_PORT, bind=PREVIEW_BIND, fps=PREVIEW_FPS,
+                 width=PREVIEW_WIDTH, slots=PREVIEW_SLOTS, quality=PREVIEW_JPEG_QUALITY):
+        ctx = multiprocessing.get_context("spawn")  # Don't fork the camera/capture threads
+        self.frame_bytes = int(np.prod(frame_shape))
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True, size=preview_layout(slots, self.frame_bytes))
+        self.header, self.meta, self.state, self.frames = preview_layout(slots, self.frame_bytes, self.shm.buf)
+        self.header[:] = 0
+        self.meta[:] = 0
+        self.port = port
+        self.interval = 1.0 / fps
+        self.next_publish = 0.0
+        self.seq = 0
+        self.published = 0
+        self.viewers = ctx.Value('i', 0)                    # Connected stream/still requests
+        self.encoded = ctx.Value('q', 0, lock=False)        # JPEGs encoded by the server
+        self.stop_event = ctx.Event()
+        self.process = ctx.Process(target=run_preview_server,
+                                   args=(self.shm.name, slots, self.frame_bytes, port, bind, fps, width,
+                                         quality, self.viewers, self.encoded, self.stop_event),
+                                   daemon=True)
+        self.process.start()
+
+    def due(self, now):
+        """True if a frame published now would be within the rate cap."""
+        return now >= self.next_publish
+
+    def publish(self, frame, state, now):
+        """
+        Copy a frame and HUD state into the next slot (call when due()).
+
+        Args:
+            frame (ndarray): Contiguous BGR or I420 camera frame
+            state (dict): HUD values (JSON-serialisable, drawn by the server)
+            now (float): Current time (clock.time())
+
+        Returns:
+            bool: True if published, False if not due or the frame is larger than a slot
+        """
+        if now < self.next_publish or frame.nbytes > self.frame_bytes:
+            return False
+        # Average rate stays at the cap even though frames arrive on the camera's cadence
+        self.next_publish = max(self.next_publish + self.interval, now - self.interval)
+        self.seq += 1
+        index = self.seq % self.slots
+        meta = self.meta[index]
+        meta[0] = 0  # Slot invalid while it is written
+        np.copyto(self.frames[index, :frame.nbytes], frame.reshape(-1))
+        text = json.dumps(state).encode()[:PREVIEW_STATE_BYTES]
+        self.state[index, :len(text)] = np.frombuffer(text, dtype=np.uint8)
+        self.state[index, len(text):] = 0
+        meta[1] = frame.shape[1]
+        meta[2] = frame.shape[0] * 2 // 3 if frame.ndim == 2 else frame.shape[0]
+        meta[3] = frame.ndim == 2
+        meta[0] = self.seq
+        self.header[1] = index
+        self.header[0] = self.seq
+        self.published += 1
+        return True
+
+    def summary(self):
+        """
+        Returns:
+            dict: viewers connected, frames published, JPEGs encoded
+        """
+        return {"viewers": self.viewers.value, "published": self.published, "encoded": self.encoded.value}
+
+    def close(self):
+        """Stop the server process and free the shared memory."""
+        self.stop_event.set()
+        self.process.join(timeout=3.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.header = self.meta = self.state = self.frames = None
+        self.shm.close()
+        self.shm.unlink()
+
+# ============================================================================
+# FRAME STATISTICS
+# ============================================================================
+
+class FrameStats:
+    """
+    Luminance statistics of the current frame, computed once per frame on a
+    strided subsample (AE_SUBSAMPLE) into preallocated buffers and shared by
+    every stage that needs them (auto-exposure, ...).
+    Luminance is approximated as (B + 2G + R) / 4; I420 frames use the Y plane.
+    """
+
+    def __init__(self, shape, step=AE_SUBSAMPLE):
+        height, width = shape[:2]
+        sample_shape = ((height + step - 1) // step, (width + step - 1) // step)
+        self.shape = (height, width)
+        self.height = height
+        self.step = step
+        # intp: np.bincount takes it without a converted copy
+        self.luma = np.zeros(sample_shape, dtype=np.intp)
+        self.scratch = np.zeros(sample_shape, dtype=np.intp)
+        self.samples = self.luma.size
+        self.levels = np.arange(256, dtype=np.int64)
+        self.hist = np.zeros(256, dtype=np.int64)
+        self.cdf = np.zeros(256, dtype=np.int64)
+        self.mean = 0.0
+        self.seq = -1   # Frame sequence number the stats belong to
+
+    def update(self, frame, seq):
+        """
+        Recompute for a new frame (no-op if seq was already processed).
+
+        Args:
+            frame (ndarray): BGR or I420 frame
+            seq (int): Frame sequence number
+
+        Returns:
+            bool: True if the stats were recomputed
+        """
+        if seq == self.seq:
+            return False
+        if frame.ndim == 2:
+            np.copyto(self.luma, frame[:self.height:self.step, ::self.step])
+        else:
+            sample = frame[::self.step, ::self.step]
+            np.copyto(self.luma, sample[..., 1])
+            np.left_shift(self.luma, 1, out=self.luma)
+            np.copyto(self.scratch, sample[..., 0])
+            np.add(self.luma, self.scratch, out=self.luma)
+            np.copyto(self.scratch, sample[..., 2])
+            np.add(self.luma, self.scratch, out=self.luma)
+            np.right_shift(self.luma, 2, out=self.luma)
+
+        self.hist[:] = np.bincount(self.luma.ravel(), minlength=256)
+        np.cumsum(self.hist, out=self.cdf)
+        self.mean = float(self.hist @ self.levels) / self.samples
+        self.seq = seq
+        return True
+
+    def percentile(self, q):
+        """Luminance level below which a fraction q of the samples lie."""
+        return int(np.searchsorted(self.cdf, q * self.samples))
+
+    def fraction_above(self, level):
+        """Fraction of samples at or above a luminance level."""
+        return 1.0 - self.cdf[level - 1] / self.samples if level > 0 else 1.0
+
+# ============================================================================
+# ARC TONE MAPPING
+# ============================================================================
+
+class ToneMapper:
+    """
+    Arc-aware tone mapping with 8-bit lookup tables.
+    The arc is found on the FrameStats luminance proxy (every AE_SUBSAMPLE-th
+    pixel): samples at or above TONEMAP_ARC_LEVEL are thresholded and the
+    moments of the mask (row/column projections) give the arc's centre and
+    spread. At camera resolution, before upscaling, the background curve
+    (shadow lift, stronger the shorter the exposure) goes over the whole
+    frame and the arc curve (the same curve with a highlight roll-off) over
+    the arc ROI only. Curves are cached per gain / exposure bucket.
+    Without an arc in view frames are passed through untouched.
+    """
+
+    def __init__(self, enabled=TONEMAP_ENABLED):
+        self.enabled = enabled      # Switched by the governor (apply_quality)
+        self.curves = {}            # (gain bucket, exposure bucket) -> (background LUT, arc LUT)
+        self.out = None             # Tone-mapped frame (valid until the next apply)
+        self.mask = None            # Proxy threshold mask (0/1) and its projections
+        self.rows = None
+        self.cols = None
+        self.ys = None              # Proxy coordinates and their squares (moment weights)
+        self.xs = None
+        self.ys2 = None
+        self.xs2 = None
+        self.roi = None             # (x0, y0, x1, y1) of the last arc, camera pixels
+        self.cost_ms = 0.0          # EMA of apply() time, arc frames included
+        self.mapped = 0             # Frames tone-mapped (arc in view)
+
+    def find_arc(self, stats):
+        """
+        Locate the arc on the luminance proxy.
+
+        Args:
+            stats (FrameStats): Statistics of the current frame
+
+        Returns:
+            tuple: (x0, y0, x1, y1) ROI in camera pixels, or None without an arc
+        """
+        luma = stats.luma
+        if self.mask is None or self.mask.shape != luma.shape:
+            # float64 throughout: summing a bool mask would allocate a converted copy per frame
+            self.mask = np.zeros(luma.shape, dtype=np.float64)
+            self.rows = np.zeros(luma.shape[0], dtype=np.float64)
+            self.cols = np.zeros(luma.shape[1], dtype=np.float64)
+            self.ys = np.arange(luma.shape[0], dtype=np.float64)
+            self.xs = np.arange(luma.shape[1], dtype=np.float64)
+            self.ys2 = self.ys * self.ys
+            self.xs2 = self.xs * self.xs
+        # Skip the threshold when the histogram already says there is nothing bright enough
+        if stats.samples - stats.cdf[TONEMAP_ARC_LEVEL - 1] < TONEMAP_ARC_MIN_SAMPLES:
+            return None
+        np.greater_equal(luma, TONEMAP_ARC_LEVEL, out=self.mask, casting="unsafe")
+        np.sum(self.mask, axis=1, out=self.rows)
+        np.sum(self.mask, axis=0, out=self.cols)
+        m00 = float(self.rows.sum())
+
+        # Centroid and spread from the first and second moments of each projection
+        cy = float(self.rows @ self.ys) / m00
+        cx = float(self.cols @ self.xs) / m00
+        sy = max(float(self.rows @ self.ys2) / m00 - cy * cy, 0.0) ** 0.5
+        sx = max(float(self.cols @ self.xs2) / m00 - cx * cx, 0.0) ** 0.5
+
+        step = stats.step
+        height, width = stats.height, luma.shape[1] * step
+        half_w = (TONEMAP_ROI_SIGMAS * sx + 1.0) * step + TONEMAP_ROI_MARGIN
+        half_h = (TONEMAP_ROI_SIGMAS * sy + 1.0) * step + TONEMAP_ROI_MARGIN
+        area = 4.0 * half_w * half_h
+        limit = TONEMAP_ROI_MAX_FRACTION * width * height
+        if area > limit:
+            shrink = (limit / area) ** 0.5
+            half_w *= shrink
+            half_h *= shrink
+        cx, cy = cx * step, cy * step
+        x0, x1 = max(int(cx - half_w), 0), min(int(cx + half_w) + 1, width)
+        y0, y1 = max(int(cy - half_h), 0), min(int(cy + half_h) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    def lookup(self, gain, exposure):
+        """
+        Background and arc curves for a gain / exposure (cached per bucket).
+
+        Args:
+            gain (float): Analogue gain
+            exposure (int): Exposure time in us
+
+        Returns:
+            tuple: (background LUT, arc LUT), uint8 arrays of 256 entries
+        """
+        key = (round(np.log2(max(gain, 1e-3)) / TONEMAP_BUCKET_STOPS),
+               round(np.log2(max(exposure, 1)) / TONEMAP_BUCKET_STOPS))
+        curves = self.curves.get(key)
+        if curves is None:
+            # Curves from the bucket centre, so every frame in a bucket gets the same table
+            product = 2.0 ** ((key[0] + key[1]) * TONEMAP_BUCKET_STOPS)
+            stops = max(float(np.log2(TONEMAP_REFERENCE / product)), 0.0)
+            gamma = max(1.0 - TONEMAP_SHADOW_GAMMA * stops, TONEMAP_GAMMA_MIN)
+            x = np.arange(256, dtype=np.float64) / 255.0
+            background = 255.0 * x ** gamma
+            arc = background.copy()
+            knee = TONEMAP_KNEE / 255.0
+            above = x > knee
+            base = background[TONEMAP_KNEE]
+            arc[above] = base + (255.0 - base) * ((x[above] - knee) / (1.0 - knee)) ** TONEMAP_ARC_GAMMA
+            curves = (np.clip(background + 0.5, 0, 255).astype(np.uint8),
+                      np.clip(arc + 0.5, 0, 255).astype(np.uint8))
+            self.curves[key] = curves
+        return curves
+
+    def apply(self, frame, stats, gain, exposure):
+        """
+        Tone-map a camera frame.
+
+        Args:
+            frame (ndarray): BGR or I420 camera frame (not modified)
+            stats (FrameStats): Statistics of the same frame
+            gain (float): Analogue gain the frame was taken with
+            exposure (int): Exposure time in us
+
+        Returns:
+            ndarray: Tone-mapped frame (valid until the next call), or frame itself
+        """
+        if not self.enabled:
+            self.roi = None
+            return frame
+        start = time.perf_counter()
+        self.roi = roi = self.find_arc(stats)
+        if roi is not None:
+            background, arc = self.lookup(gain, exposure)
+            if self.out is None or self.out.shape != frame.shape:
+                self.out = np.empty_like(frame)
+            if frame.ndim == 2:
+                # I420: curves on the Y plane, chroma copied
+                src, dst = frame[:stats.height], self.out[:stats.height]
+                np.copyto(self.out[stats.height:], frame[stats.height:])
+            else:
+                src, dst = frame, self.out
+            cv2.LUT(src, background, dst=dst)
+            x0, y0, x1, y1 = roi
+            cv2.LUT(src[y0:y1, x0:x1], arc, dst=dst[y0:y1, x0:x1])
+            self.mapped += 1
+            frame = self.out
+        self.cost_ms += 0.1 * ((time.perf_counter() - start) * 1000.0 - self.cost_ms)
+        return frame
+
+    def summary(self):
+        """
+        Returns:
+            dict: enabled, cost_ms (EMA), frames mapped, cached curve buckets, last arc ROI
+        """
+        return {"enabled": self.enabled, "cost_ms": round(self.cost_ms, 3), "mapped": self.mapped,
+                "buckets": len(self.curves), "roi": list(self.roi) if self.roi is not None else None}
+
+# ============================================================================
+# TEMPORAL DENOISE
+# ============================================================================
+
+class TemporalDenoiser:
+    """
+    Recursive temporal noise filter for the high-gain (low-light) regime.
+    Filters the camera frame into a preallocated output frame (the capture
+    ring slot is left as captured) through uint16 accumulators in 8.8 fixed
+    point: acc += (frame - acc) >> DENOISE_SHIFT,
+    computed as acc - (acc >> N) + (frame >> N) so nothing leaves 16 bits.
+    Pixels further than DENOISE_MOTION_LEVEL from the average take the new
+    value outright, so moving edges don't trail. The filter runs only while
+    the gain is high (DENOISE_GAIN_ON / DENOISE_GAIN_OFF). An arc event or a
+    jump in mean luminance restarts it from the new frame, so a strike is
+    never smeared. I420 frames are filtered as one plane. A frame shown again
+    (same sequence number, stalled camera) is not blended into itself.
+    """
+
+    def __init__(self, enabled=DENOISE_ENABLED):
+        self.enabled = enabled
+        self.active = False         # Gain above the switch-on threshold
+        self.acc = None             # Running average (8.8 fixed point)
+        self.cur = None             # Current frame (8.8 fixed point)
+        self.tmp = None
+        self.diff = None
+        self.mask = None            # Moving pixels (255), 2-D view for cv2
+        self.out = None             # Filtered frame (valid until the next apply)
+        self.seq = -1               # Sequence number of the last frame seen
+        self.seq_filtered = False   # Whether that frame went to self.out
+        self.reset_frames = 0       # Frames left to pass through (accumulator restarts)
+        self.arc_events = 0
+        self.last_mean = None
+        self.resets = 0
+        self.filtered = 0
+        self.cost_ms = 0.0          # EMA of the filtering time
+
+    def _allocate(self, shape):
+        """Accumulators for a frame shape (camera size or capture format changed)."""
+        self.acc = np.zeros(shape, dtype=np.uint16)
+        self.cur = np.zeros(shape, dtype=np.uint16)
+        self.tmp = np.zeros(shape, dtype=np.uint16)
+        self.diff = np.zeros(shape, dtype=np.uint16)
+        self.mask = np.zeros((shape[0], self.acc.size // shape[0]), dtype=np.uint8)
+        self.out = np.zeros(shape, dtype=np.uint8)
+
+    def apply(self, frame, stats, gain, arc_events=0, seq=None):
+        """
+        Filter a frame.
+
+        Args:
+            frame (ndarray): BGR or I420 camera frame (not modified)
+            stats (FrameStats): Statistics of the same frame (mean luminance)
+            gain (float): Analogue gain the frame was taken with
+            arc_events (int): ArcExposureController.events (a change restarts the filter)
+            seq (int): Frame sequence number (None: always a new frame)
+
+        Returns:
+            ndarray: The filtered frame (self.out), or frame itself when not filtered
+        """
+        if seq is not None and seq == self.seq:
+            # Same frame again (stalled camera): already filtered, or passed through
+            return self.out if self.seq_filtered and self.out.shape == frame.shape else frame
+        self.seq = -1 if seq is None else seq
+        result = self._filter(frame, stats, gain, arc_events)
+        self.seq_filtered = result is self.out
+        return result
+
+    def _filter(self, frame, stats, gain, arc_events):
+        """Run the filter on a new frame (see apply())."""
+        if not self.enabled:
+            return frame
+        jump = arc_events != self.arc_events or \
+            (self.last_mean is not None and abs(stats.mean - self.last_mean) > DENOISE_RESET_LEVEL)
+        self.arc_events = arc_events
+        self.last_mean = stats.mean
+        if self.active and gain < DENOISE_GAIN_OFF:
+            self.active = False
+        elif not self.active and gain >= DENOISE_GAIN_ON:
+            self.active = True
+            self.reset_frames = max(self.reset_frames, 1)  # Seed the accumulator from this frame
+        if not self.active:
+            return frame
+
+        start = time.perf_counter()
+        if self.acc is None or self.acc.shape != frame.shape:
+            self._allocate(frame.shape)
+            self.reset_frames = max(self.reset_frames, 1)
+        if jump:
+            self.reset_frames = DENOISE_RESET_FRAMES
+            self.resets += 1
+
+        np.left_shift(frame, 8, out=self.cur, dtype=np.uint16)
+        if self.reset_frames:
+            self.reset_frames -= 1
+            np.copyto(self.acc, self.cur)
+            return frame
+
+        rows = frame.shape[0]
+        cv2.absdiff(self.cur, self.acc, dst=self.diff)
+        np.right_shift(self.acc, DENOISE_SHIFT, out=self.tmp)
+        np.subtract(self.acc, self.tmp, out=self.acc)
+        np.right_shift(self.cur, DENOISE_SHIFT, out=self.tmp)
+        np.add(self.acc, self.tmp, out=self.acc)
+        # Motion: take the new value where the difference is well above the noise
+        cv2.compare(self.diff.reshape(rows, -1), DENOISE_MOTION_LEVEL << 8, cv2.CMP_GT, dst=self.mask)
+        cv2.copyTo(self.cur.reshape(rows, -1), self.mask, dst=self.acc.reshape(rows, -1))
+        cv2.convertScaleAbs(self.acc, dst=self.out, alpha=1.0 / 256.0)
+        self.filtered += 1
+        self.cost_ms += 0.1 * ((time.perf_counter() - start) * 1000.0 - self.cost_ms)
+        return self.out
+
+    def summary(self):
+        """
+        Returns:
+            dict: active, cost_ms (EMA) and its share of the frame budget, frames filtered, restarts
+        """
+        return {"active": self.active, "cost_ms": round(self.cost_ms, 3),
+                "budget_pct": round(self.cost_ms / (FRAME_TIME_BUDGET * 10.0), 2),
+                "filtered": self.filtered, "resets": self.resets}
+
 # ============================================================================
 # CAMERA CONTROL
 # ============================================================================
@@ -381,6 +4581,46 @@ adaptive_gain_state = {
     'last_update': 0
 }
 
+def exposure_targets(light_value):
+    """
+    Converged gain / exposure the adaptive controller steers toward for a light level.
+
+    Args:
+        light_value (int): Light ADC value
+
+    Returns:
+        tuple: (target_gain, target_exposure_us)
+    """
+    # error = +300 (too dark) => high gain
+    # error = 0 (perfect) => medium gain
+    # error = -300 (too bright) => low gain
+    error = GAIN_TARGET_LIGHT - light_value
+    gain_normalize = error / 300.0  # Normalize error to [-1, 1] range
+
+    # Target gain: mid-range at neutral, scales toward extremes
+    target_gain = 6.0 + (gain_normalize * 5.0)  # 1-11 range
+    target_gain = max(GAIN_MIN, min(GAIN_MAX, target_gain))  # Clamp
+
+    # Adaptive exposure time (reduce latency by lowering exposure in bright, keeping it higher in dark)
+    if light_value > 750:  # Very bright: minimal exposure for low latency
+        target_exposure = EXPOSURE_TIME_MIN + 1000  # ~2-3ms
+    elif light_value > 550:  # Bright/Normal: medium exposure
+        target_exposure = 7000  # ~7ms
+    elif light_value > 300:  # Dim: longer exposure
+        target_exposure = 11000  # ~11ms
+    else:  # Very dark: maximum exposure
+        target_exposure = EXPOSURE_TIME_MAX  # ~20ms
+    return target_gain, target_exposure
+
+def exposure_controls(gain, exposure, light_value):
+    """Camera controls dict for a gain / exposure at a light level."""
+    return {
+        "AnalogueGain": gain,
+        "ExposureTime": exposure,
+        "Brightness": 0.0 if light_value > 550 else (0.05 if light_value < 250 else 0.0),
+        "Contrast": 1.1 if light_value > 550 else (1.3 if light_value < 250 else 1.2)
+    }
+
 def adjust_camera_exposure(picam2, light_value):
     """
     Adaptive gain controller (PID-like) for smooth, flicker-free exposure.
@@ -388,7 +4628,7 @@ def adjust_camera_exposure(picam2, light_value):
     Reduces latency with lower ExposureTime and NoiseReduction disabled during bright.
     
     Args:
-        picam2: Picamera2 instance
+        picam2: Camera backend (anything with set_controls)
         light_value (int): Light ADC value
     """
     if not LIGHT_ADJUST_ENABLED:
@@ -396,32 +4636,12 @@ def adjust_camera_exposure(picam2, light_value):
     
     try:
         # Adaptive gain: smooth controller based on distance from target
-        error = GAIN_TARGET_LIGHT - light_value
-        
-        # Calculate target gain (proportional controller)
-        # error = +300 (too dark) => high gain
-        # error = 0 (perfect) => medium gain
-        # error = -300 (too bright) => low gain
-        gain_normalize = error / 300.0  # Normalize error to [-1, 1] range
-        
-        # Target gain: mid-range at neutral, scales toward extremes
-        target_gain = 6.0 + (gain_normalize * 5.0)  # 1-11 range
-        target_gain = max(GAIN_MIN, min(GAIN_MAX, target_gain))  # Clamp
-        
+        target_gain, target_exposure = exposure_targets(light_value)
+
         # Smooth interpolation toward target (prevents jitter)
         new_gain = adaptive_gain_state['current_gain'] * (1.0 - GAIN_RATE) + target_gain * GAIN_RATE
         new_gain = max(GAIN_MIN, min(GAIN_MAX, new_gain))
         
-        # Adaptive exposure time (reduce latency by lowering exposure in bright, keeping it higher in dark)
-        if light_value > 750:  # Very bright: minimal exposure for low latency
-            target_exposure = EXPOSURE_TIME_MIN + 1000  # ~2-3ms
-        elif light_value > 550:  # Bright/Normal: medium exposure
-            target_exposure = 7000  # ~7ms
-        elif light_value > 300:  # Dim: longer exposure
-            target_exposure = 11000  # ~11ms
-        else:  # Very dark: maximum exposure
-            target_exposure = EXPOSURE_TIME_MAX  # ~20ms
-        
         # Smooth exposure adjustment
         new_exposure = int(adaptive_gain_state['current_exposure'] * 0.8 + target_exposure * 0.2)
         new_exposure = max(EXPOSURE_TIME_MIN, min(EXPOSURE_TIME_MAX, new_exposure))
@@ -430,13 +4650,7 @@ def adjust_camera_exposure(picam2, light_value):
         if abs(new_gain - adaptive_gain_state['current_gain']) > 0.1 or \
            abs(new_exposure - adaptive_gain_state['current_exposure']) > 500:
             
-            controls = {
-                "AnalogueGain": new_gain,
-                "ExposureTime": new_exposure,
-                "Brightness": 0.0 if light_value > 550 else (0.05 if light_value < 250 else 0.0),
-                "Contrast": 1.1 if light_value > 550 else (1.3 if light_value < 250 else 1.2)
-            }
-            
+            controls = exposure_controls(new_gain, new_exposure, light_value)
             picam2.set_controls(controls)
             adaptive_gain_state['current_gain'] = new_gain
             adaptive_gain_state['current_exposure'] = new_exposure
@@ -448,65 +4662,283 @@ def adjust_camera_exposure(picam2, light_value):
         if DEBUG_MODE:
             print(f"Camera control error: {e}")
 
+class ArcExposureController:
+    """
+    Event-driven exposure response to arc strikes.
+    Watches the light channel at the sampler rate (SensorSampler listener):
+    a steep rise jumps straight to a precomputed arc preset, a steep fall back
+    to the controls in use before the strike. Between events update() runs the
+    smooth adjust_camera_exposure tracking, held off for ARC_HOLD_TIME after a
+    jump so it doesn't drag the exposure back through its smoothing filter.
+    """
+
+    def __init__(self, camera, light_index, rate=SENSOR_SAMPLE_RATE):
+        self.camera = camera
+        self.light_index = light_index
+        self.window = [0.0] * max(2, int(ARC_STEP_WINDOW * rate) + 1)
+        self.pos = 0
+        self.filled = 0
+        self.arc = False
+        self.hold_until = 0.0
+        self.events = 0
+        self.last_event = None      # (timestamp, "strike" | "out")
+        self.lock = Lock()
+
+        gain, exposure = exposure_targets(ARC_PRESET_LIGHT)
+        self.arc_preset = exposure_controls(gain, exposure, ARC_PRESET_LIGHT)
+        self.ambient_preset = None  # Controls in use before the strike
+
+    def on_sample(self, timestamp, values):
+        """
+        Sampler listener: detect light steps over the last ARC_STEP_WINDOW.
+
+        Args:
+            timestamp (float): Sample time (time.time())
+            values (ndarray): Filtered ADC values per channel
+        """
+        light = float(values[self.light_index])
+        oldest = self.window[self.pos]  # Sample from one window ago
+        self.window[self.pos] = light
+        self.pos = (self.pos + 1) % len(self.window)
+        if self.filled < len(self.window):
+            self.filled += 1
+            return
+
+        if not self.arc:
+            if light - oldest >= ARC_STEP_RISE and light >= ARC_LIGHT_MIN:
+                ambient_gain, ambient_exposure = (adaptive_gain_state['current_gain'],
+                                                  adaptive_gain_state['current_exposure'])
+                self.ambient_preset = exposure_controls(ambient_gain, ambient_exposure, oldest)
+                self._apply(self.arc_preset, timestamp, "strike")
+                self.arc = True
+        elif oldest - light >= ARC_STEP_FALL or light < ARC_LIGHT_MIN - ARC_STEP_FALL:
+            self._apply(self.ambient_preset, timestamp, "out")
+            self.arc = False
+
+    def _apply(self, controls, timestamp, event):
+        """Jump to a preset and hand the state over to the smooth controller."""
+        with self.lock:
+            try:
+                self.camera.set_controls(controls)
+            except Exception as e:
+                if DEBUG_MODE:
+                    print(f"Camera control error: {e}")
+                return
+            adaptive_gain_state['current_gain'] = controls["AnalogueGain"]
+            adaptive_gain_state['current_exposure'] = controls["ExposureTime"]
+            self.hold_until = timestamp + ARC_HOLD_TIME
+            self.events += 1
+            self.last_event = (timestamp, event)
+        if DEBUG_MODE:
+            print(f"Arc {event}: gain={controls['AnalogueGain']:.1f} exp={controls['ExposureTime']}µs")
+
+    def update(self, light_value, now):
+        """
+        Steady-state tracking (call at LIGHT_ADJUST_INTERVAL from the main loop).
+
+        Args:
+            light_value (int): Light ADC value
+            now (float): Current time (time.time())
+        """
+        if now < self.hold_until:
+            return
+        with self.lock:
+            adjust_camera_exposure(self.camera, light_value)
+
+class ImageExposureController:
+    """
+    Auto-exposure from frame statistics.
+    Steers the AE_TARGET_PERCENTILE luminance to AE_TARGET_LEVEL in the log
+    domain (exposure first up to AE_EXPOSURE_MAX, then gain). The ADC is only
+    used through the ArcExposureController, whose presets react to a strike
+    before the camera has delivered a single bright frame; image tracking is
+    held off while a preset is settling.
+    """
+
+    def __init__(self, camera, arc_controller=None):
+        self.camera = camera
+        self.arc_controller = arc_controller
+        self.lock = arc_controller.lock if arc_controller is not None else Lock()
+        self.last_seq = 0
+        self.updates = 0
+
+    def update(self, stats, light_value, now):
+        """
+        Adjust exposure from the latest FrameStats (call once per rendered frame).
+
+        Args:
+            stats (FrameStats): Statistics of the current frame
+            light_value (int): Light ADC value (picks Brightness/Contrast)
+            now (float): Current time (time.time())
+        """
+        if stats.seq - self.last_seq < AE_INTERVAL_FRAMES:
+            return
+        if self.arc_controller is not None and now < self.arc_controller.hold_until:
+            return
+        self.last_seq = stats.seq
+
+        if stats.fraction_above(AE_CLIP_LEVEL) > AE_CLIP_FRACTION:
+            error = -0.693  # log(0.5): percentile saturated, true level unknown
+        else:
+            error = np.log(AE_TARGET_LEVEL / max(stats.percentile(AE_TARGET_PERCENTILE), 1))
+        if abs(error) < AE_DEADBAND:
+            return
+
+        with self.lock:
+            gain = adaptive_gain_state['current_gain']
+            exposure = adaptive_gain_state['current_exposure']
+            product = gain * exposure * float(np.exp(AE_RATE * error))
+            product = max(EXPOSURE_TIME_MIN * GAIN_MIN, min(AE_EXPOSURE_MAX * GAIN_MAX, product))
+            new_exposure = int(max(EXPOSURE_TIME_MIN, min(AE_EXPOSURE_MAX, product / GAIN_MIN)))
+            new_gain = max(GAIN_MIN, min(GAIN_MAX, product / new_exposure))
+            try:
+                self.camera.set_controls(exposure_controls(new_gain, new_exposure, light_value))
+            except Exception as e:
+                if DEBUG_MODE:
+                    print(f"Camera control error: {e}")
+                return
+            adaptive_gain_state['current_gain'] = new_gain
+            adaptive_gain_state['current_exposure'] = new_exposure
+            self.updates += 1
+
+# ============================================================================
+# MEMORY USAGE
+# ============================================================================
+
+def memory_usage():
+    """
+    Resident set size of this process, now and at its peak.
+
+    Returns:
+        dict: {"rss_mb", "peak_mb"} (VmRSS / VmHWM, or getrusage without /proc)
+    """
+    usage = {}
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmRSS:"):
+                    usage["rss_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+                elif line.startswith(b"VmHWM:"):
+                    usage["peak_mb"] = round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    if "peak_mb" not in usage:
+        # ru_maxrss is in KB on Linux
+        usage["peak_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+        usage.setdefault("rss_mb", usage["peak_mb"])
+    return usage
+
 # ============================================================================
 # MAIN PROGRAM
 # ============================================================================
 
-def main():
+def main(argv=None):
     """Main program loop."""
-    global spi
-    
+    global clock
+    args = parse_args(argv)
+    if args.telemetry_report:
+        print(json.dumps(telemetry_report(read_telemetry(args.telemetry_file)), indent=1))
+        return
+
     print("Initializing AR Welding Mask System...")
-    
-    # Initialize SPI for MCP3008
-    spi = spidev.SpiDev()
-    spi.open(SPI_BUS, SPI_DEVICE)
-    spi.max_speed_hz = SPI_SPEED
-    print("SPI initialized")
-    
-    # Initialize camera - optimized for low latency spawanie
-    # Retry logic for camera initialization (in case libcamera is still starting)
-    picam2 = None
-    for attempt in range(5):
+
+    # Session replay: recorded ADC rounds and frames on a virtual clock instead of the hardware
+    replay = None
+    if args.replay:
+        replay = ReplaySession(args.replay, args.replay_log or args.replay + ".log", args.replay_speed)
+        clock = VirtualClock(replay.start_time)
+        args.capture_format = replay.format
+        print(f"Replaying {args.replay} ({replay.frames} frames, speed "
+              f"{args.replay_speed if args.replay_speed > 0 else 'max'})")
+
+    # OpenCV's own thread pool (stripe workers take over the cores when enabled)
+    if OPENCV_THREADS >= 0:
+        cv2.setNumThreads(OPENCV_THREADS)
+
+    # Sensor ADC (MCP3008 over SPI, or scripted signals)
+    if replay is not None:
+        adc_reader = ReplayAdc(replay)
+    else:
+        adc_reader = create_adc(args.adc, (CH_BATTERY, CH_MQ07, CH_LIGHT))
+
+    # Session recording (every ADC round from the sampler, every rendered frame from the main loop)
+    session = None
+    if args.record_session:
+        session = SessionRecorder(args.record_session, args.capture_format, adc_reader.channels)
+        adc_reader = SessionAdc(adc_reader, session)
+        print(f"Recording session to {args.record_session}")
+
+    # Sensor sampler thread (all channels at a fixed rate, off the render path)
+    sensor_sampler = SensorSampler(adc_reader, threaded=replay is None)
+    print(f"Sensor sampler started ({SENSOR_SAMPLE_RATE} Hz, {SENSOR_FILTER} filter)")
+
+    # Telemetry log with incremental CO averages (written from the sampler thread)
+    telemetry = None
+    if TELEMETRY_ENABLED and replay is None:
         try:
-            picam2 = Picamera2()
-            print("Camera initialized successfully")
-            break
-        except RuntimeError as e:
-            if attempt < 4:
-                print(f"Camera init failed (attempt {attempt + 1}/5): {e}")
-                time.sleep(2)
-            else:
-                print(f"Camera init failed after 5 attempts: {e}")
-                raise
-    
+            telemetry = TelemetryLog(args.telemetry_file,
+                                     [adc_reader.channels.index(ch) for ch in (CH_BATTERY, CH_MQ07, CH_LIGHT)])
+            sensor_sampler.listeners.append(telemetry.on_sample)
+            print(f"Telemetry log: {args.telemetry_file} ({telemetry.count} records)")
+        except (OSError, ValueError) as e:
+            print(f"Telemetry log unavailable: {e}")
+
+    # Initialize camera - optimized for low latency spawanie
     camera_config = {
         "Sharpness": 1.0,
         "Contrast": 1.2,
         "Brightness": 0.0,
         "Saturation": 1.0,
         "ExposureTime": 8000,           # Lower initial exposure (8ms) for responsiveness
-        "AnalogueGain": 6.0
+        "AnalogueGain": 6.0,
+        # Camera paces the pipeline: renderer wakes on each new frame
+        "FrameDurationLimits": (int(FRAME_TIME_BUDGET * 1e6), int(FRAME_TIME_BUDGET * 1e6))
     }
-    picam2.set_controls(camera_config)
-    
-    # Configure camera for dual-view (half-width per eye)
-    picam2.configure(picam2.create_preview_configuration(
-        main={"size": (CAMERA_WIDTH, CAMERA_HEIGHT), "format": "RGB888"}
-    ))
+    if replay is not None:
+        picam2 = ReplayCamera(replay)
+    else:
+        picam2 = create_camera(args.camera, camera_config, args.video, args.capture_format,
+                               boot.camera if boot is not None else None, args.sim_hang)
     picam2.start()
-    print("Camera initialized")
-    
+    print(f"Camera initialized ({'replay' if replay is not None else args.camera}, {args.capture_format})")
+    if boot is not None:
+        boot.status(0.8)
+
+    # Arc strike / arc out presets straight from the sampler thread
+    arc_controller = None
+    if ARC_RESPONSE_ENABLED and LIGHT_ADJUST_ENABLED:
+        arc_controller = ArcExposureController(picam2, adc_reader.channels.index(CH_LIGHT))
+        sensor_sampler.listeners.append(arc_controller.on_sample)
+
+    # Frame statistics (computed once per frame, shared) and image-driven exposure
+    frame_stats = FrameStats((CAMERA_HEIGHT, CAMERA_WIDTH))
+    image_exposure = None
+    if EXPOSURE_MODE == "image" and LIGHT_ADJUST_ENABLED:
+        image_exposure = ImageExposureController(picam2, arc_controller)
+
+    # Arc-aware tone mapping (reuses the frame statistics; governor switches it off)
+    tonemap = ToneMapper()
+
+    # Temporal denoise (switches itself on at high gain)
+    denoiser = TemporalDenoiser()
+
     # Start frame capture thread
-    frame_processor = FrameProcessor(picam2)
+    frame_processor = FrameProcessor(picam2, fmt=args.capture_format, threaded=replay is None)
     print("Frame processor started")
-    
+
+    # Stall supervisor: stale video warning, camera restart (replay frames are never late)
+    supervisor = CaptureSupervisor(frame_processor) if replay is None else None
+    frame_wait = min(FRAME_WAIT_TIMEOUT, CAPTURE_STALE_AFTER / 2) if supervisor is not None else FRAME_WAIT_TIMEOUT
+
     # Create recording directory if it doesn't exist
-    os.makedirs(RECORDING_OUTPUT_DIR, exist_ok=True)
-    
+    try:
+        os.makedirs(RECORDING_OUTPUT_DIR, exist_ok=True)
+    except OSError as e:
+        print(f"Could not create {RECORDING_OUTPUT_DIR}: {e}")
+
     # Recording state
     recording_active = False
-    video_writer = None
+    recorder = None
     recording_filename = None
     
     # Photoresistor trigger state for recording
@@ -517,41 +4949,142 @@ def main():
     fps_counter = 0
     fps_start_time = time.time()
     last_exposure_adjust = 0
-    frame_counter = 0
     
-    # Cache framebuffer file handle (avoid reopening every frame)
-    fb_handle = None
+    # Map framebuffer once (geometry from ioctls; --display file: configured geometry)
+    fb_writer = None
+    fb_name = args.fb_path or (FB_DEVICE if args.display == "fbdev" else args.display)
     try:
-        fb_handle = open('/dev/fb0', 'wb', buffering=0)
-        print('DEBUG: opened /dev/fb0 (cached handle)')
+        fb_writer = create_display(args.display, args.fb_path)
+        if (fb_writer.width, fb_writer.height) != (FB_WIDTH, FB_HEIGHT):
+            configure_layout(fb_writer.width, fb_writer.height)
+        print(f'DEBUG: mapped {fb_name} ({fb_writer.width}x{fb_writer.height}, '
+              f'stride {fb_writer.stride})')
+        if SPLASH_ENABLED and fb_writer.is_device:
+            write_splash(fb_writer.width, fb_writer.height)
     except Exception as e:
-        print('DEBUG: could not open /dev/fb0 (will try per-frame). Error:', e)
-        fb_handle = None
+        print(f'DEBUG: could not map {fb_name} (will try per-frame). Error:', e)
+        fb_writer = None
     
-    # Cached sensor values (update every other frame to reduce SPI overhead)
+    # Cached HUD layer (OSD re-rasterized only when values change)
+    hud = HudCompositor() if HUD_CACHE_ENABLED else None
+    if hud is not None:
+        hud.telemetry = telemetry
+
+    # Per-eye lens pre-distortion maps (built once, cached on disk)
+    stereo = None
+    if STEREO_REMAP_ENABLED:
+        start = time.time()
+        stereo = StereoCompositor((CAMERA_WIDTH, CAMERA_HEIGHT), (frame_width // 2, frame_height))
+        print(f"Lens maps ready in {(time.time() - start) * 1000:.0f} ms")
+
+    # Capture-to-photon latency histograms (stats file / UNIX socket, refreshed once per second)
+    latency_stats = LatencyStats() if LATENCY_STATS_ENABLED and replay is None else None
+    last_frame_seq = 0
+    double_frame = None     # Fallback path: side-by-side view and I420 conversion buffers
+    fallback_bgr = None
+    duplicate_frames = 0    # Same camera frame rendered again
+    skipped_frames = 0      # Camera frames replaced before the renderer got to them
+
+    # Compose/present stages with preallocated canvas ring (needs the mmap'd framebuffer)
+    pipeline = None
+    stripe_workers = None
+    if fb_writer is not None:
+        if STRIPE_WORKERS > 1:
+            stripe_workers = StripeWorkers()
+            print(f"Stripe workers: {STRIPE_WORKERS} threads, {STRIPE_COUNT} stripes")
+        pipeline = RenderPipeline(fb_writer, hud, stereo, stats=latency_stats, vsync=args.vsync,
+                                  workers=stripe_workers)
+        pipeline.telemetry = telemetry
+
+    # Encoder process (idle until a recording starts; frames via shared memory)
+    recording_source = RECORDING_SOURCE
+    if recording_source == "composite" and args.capture_format == "YUV420" and pipeline is not None:
+        print("Composite recording needs RGB888 capture (YUV420 bypasses the canvas); recording camera frames")
+        recording_source = "camera"
+    if pipeline is not None:
+        pipeline.canvas_video = recording_source == "composite"
+    if recording_source == "composite":
+        recording_shape = (FB_HEIGHT, FB_WIDTH, 3)
+    else:
+        recording_shape = (CAMERA_HEIGHT, CAMERA_WIDTH, 3)
+    try:
+        # Pre-roll only for camera frames (JPEG-compressing full composites can't keep up)
+        recorder = RecordingEncoder(recording_shape,
+                                    preroll_seconds=PREROLL_SECONDS if recording_source == "camera" else 0.0)
+    except Exception as e:
+        print(f"Recording encoder unavailable: {e}")
+
+    # Live preview server (second viewer; encoding and HTTP in its own process)
+    preview = None
+    if args.preview:
+        try:
+            preview = PreviewPublisher((CAMERA_HEIGHT, CAMERA_WIDTH, 3), port=args.preview_port,
+                                       fps=args.preview_fps, width=args.preview_width)
+            print(f"Live preview on port {args.preview_port} ({args.preview_fps:g} FPS, "
+                  f"{args.preview_width} px wide)")
+        except Exception as e:
+            print(f"Live preview unavailable: {e}")
+
+    # Frame-time governor (quality ladder: camera size, lens, interpolation, HUD, recording)
+    governor = None
+    if GOVERNOR_ENABLED:
+        governor = FrameGovernor()
+        apply_quality(governor.quality, frame_processor, pipeline, hud, recorder, stereo, tonemap)
+        print(f"Governor started at quality '{governor.quality['name']}'")
+
+    # Sensor values (refreshed from the sampler snapshot every frame)
     battery_v, battery_st, battery_crit = 0.0, "Unknown", False
     mq07_v, mq07_st, mq07_danger = 0.0, "Unknown", False
     light_val, light_st = 0, "Unknown"
     
+    # Splash off: the pipeline takes over the framebuffer
+    if boot is not None:
+        boot.finish()
+    first_frame_shown = False
+
     print("Main loop started. Press Ctrl+C to exit.")
+    run_until = time.time() + args.duration if args.duration > 0 else None
     try:
-        while True:
-            frame_start = time.time()
-            frame_counter += 1
-
-            # Get latest frame (use direct attribute for compatibility)
-            frame = frame_processor.frame
-            if frame is None:
-                # Sleep minimally if no frame yet (avoid busy-wait)
-                time.sleep(MIN_FRAME_TIME)
-                continue
+        while run_until is None or time.time() < run_until:
+            # Replay: feed the recorded ADC rounds up to the next frame, then capture it
+            if replay is not None and not replay.advance(sensor_sampler, frame_processor):
+                print("Replay finished")
+                break
+
+            # Sleep until the camera publishes a newer frame, then hold its slot
+            # (capture thread won't overwrite it until released). The ring is read
+            # once: a supervisor restart may swap in a new one while the slot is held.
+            ring = frame_processor.ring
+            frame_index, frame_seq = ring.wait_read(last_frame_seq, frame_wait)
+            stale = supervisor is not None and supervisor.check()
+            if frame_index < 0:
+                if not stale:
+                    continue  # No new frame yet
+                # Camera stalled: show the last frame again, under the stale video warning
+                frame_index, frame_seq = ring.acquire_read()
+                if frame_index < 0:
+                    continue
+            work_start = time.perf_counter()
+            frame = ring.buffers[frame_index]
+            frame_stamps = ring.stamps[frame_index]
+            frame_size = (frame.shape[0] if frame.ndim == 3 else frame.shape[0] * 2 // 3, frame.shape[1])
+            if frame_size != frame_stats.shape:
+                # Camera stream resized (governor): statistics follow the frame size
+                frame_stats = FrameStats(frame_size)
+            if frame_seq == last_frame_seq:
+                duplicate_frames += 1
+            elif last_frame_seq:
+                skipped_frames += frame_seq - last_frame_seq - 1
+            last_frame_seq = frame_seq
+            if session is not None:
+                session.frame(frame, frame_stamps[STAMP_SENSOR])
+            frame_stats.update(frame, frame_seq)
 
-            # Read sensors every 2nd frame (compromise: responsiveness vs FPS)
-            if frame_counter % 2 == 0:
+            # Latest filtered sensor snapshot (sampled by SensorSampler, no SPI here)
+            snapshot = sensor_sampler.latest()
+            if snapshot is not None:
                 try:
-                    battery_adc = read_adc(CH_BATTERY)
-                    mq07_adc = read_adc(CH_MQ07)
-                    light_adc = read_adc(CH_LIGHT)
+                    battery_adc, mq07_adc, light_adc = snapshot[1]
 
                     # Calculate sensor values
                     battery_v, battery_st, battery_crit = calculate_battery_voltage(battery_adc)
@@ -562,27 +5095,26 @@ def main():
                     if light_val < RECORDING_TRIGGER_THRESHOLD:
                         # Photoresistor is covered
                         if light_low_start_time is None and trigger_armed:
-                            light_low_start_time = time.time()
+                            light_low_start_time = clock.time()
                         elif light_low_start_time is not None:
                             # Check if held for 5 seconds
-                            if time.time() - light_low_start_time >= RECORDING_TRIGGER_DURATION:
+                            if clock.time() - light_low_start_time >= RECORDING_TRIGGER_DURATION:
                                 # Toggle recording
-                                if not recording_active:
-                                    # Start recording
+                                if not recording_active and recorder is not None:
+                                    # Start recording (segments: <name>_NNN.mp4 + .csv sensor sidecar)
                                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                    recording_filename = os.path.join(RECORDING_OUTPUT_DIR, f"welding_{timestamp}.mp4")
-                                    fourcc = cv2.VideoWriter_fourcc(*RECORDING_CODEC)
-                                    video_writer = cv2.VideoWriter(recording_filename, fourcc, RECORDING_FPS, 
-                                                                   (FB_WIDTH, FB_HEIGHT))
+                                    recording_filename = os.path.join(RECORDING_OUTPUT_DIR, f"welding_{timestamp}")
+                                    preroll_frames = recorder.preroll_frames.value
+                                    recorder.start(recording_filename)
                                     recording_active = True
-                                    print(f"Recording started: {recording_filename}")
-                                else:
+                                    print(f"Recording started: {recording_filename}_*.mp4 (pre-roll: "
+                                          f"{preroll_frames} frames, {recorder.preroll_encode_ms.value:.1f} ms/frame)")
+                                elif recording_active:
                                     # Stop recording
-                                    if video_writer is not None:
-                                        video_writer.release()
-                                        video_writer = None
+                                    recorder.stop()
                                     recording_active = False
-                                    print(f"Recording stopped: {recording_filename}")
+                                    print(f"Recording stopped: {recording_filename}_*.mp4 "
+                                          f"({recorder.submitted} queued, {recorder.dropped} dropped)")
                                     recording_filename = None
                                 
                                 # Reset trigger (require uncovering and re-covering)
@@ -597,51 +5129,149 @@ def main():
                     if DEBUG_MODE:
                         print(f"Sensor read error: {e}")
 
-            # Adjust camera exposure periodically (reduce frequency to avoid flicker)
-            if time.time() - last_exposure_adjust > LIGHT_ADJUST_INTERVAL:
-                adjust_camera_exposure(picam2, light_val)
-                last_exposure_adjust = time.time()
+            # Adjust camera exposure: from frame statistics, or periodically from the photoresistor
+            if image_exposure is not None:
+                image_exposure.update(frame_stats, light_val, clock.time())
+            elif clock.time() - last_exposure_adjust > LIGHT_ADJUST_INTERVAL:
+                if arc_controller is not None:
+                    arc_controller.update(light_val, clock.time())
+                else:
+                    adjust_camera_exposure(picam2, light_val)
+                last_exposure_adjust = clock.time()
 
-            # Create dual-view (same image side-by-side)
-            double_frame = np.hstack((frame, frame))
-
-            # Display on framebuffer with OSD (use cached handle)
+            # Display on framebuffer with OSD
             try:
-                final_frame = display_on_framebuffer(double_frame, battery_v, battery_st, battery_crit,
-                                                      mq07_v, mq07_st, mq07_danger,
-                                                      light_val, light_st, fb_handle, recording_active)
-                
-                # Write frame to video if recording
-                if recording_active and video_writer is not None:
+                # High-gain noise filtered into the denoiser's buffer (the ring slot stays as
+                # captured); recordings get the filtered frame too
+                frame = denoiser.apply(frame, frame_stats, adaptive_gain_state['current_gain'],
+                                       arc_controller.events if arc_controller is not None else 0, frame_seq)
+                # Tone-mapped copy for display (recordings keep the camera frame)
+                view = tonemap.apply(frame, frame_stats, adaptive_gain_state['current_gain'],
+                                     adaptive_gain_state['current_exposure'])
+                if pipeline is not None:
+                    # Compose into a preallocated canvas slot; present thread writes it out
+                    present_target = pipeline.presented + 1
+                    final_frame = pipeline.compose(view, battery_v, battery_st, battery_crit,
+                                                   mq07_v, mq07_st, mq07_danger,
+                                                   light_val, light_st, recording_active, frame_stamps, stale)
+                else:
+                    # Create dual-view (same image side-by-side)
+                    compose_start = time.monotonic_ns()
+                    if view.ndim == 2:
+                        # Fallback path works on BGR (conversion buffers kept across frames)
+                        eye_shape = (view.shape[0] * 2 // 3, view.shape[1], 3)
+                        if fallback_bgr is None or fallback_bgr[0].shape != eye_shape:
+                            bgr = np.empty(eye_shape, dtype=np.uint8)
+                            fallback_bgr = (bgr, np.empty_like(bgr))
+                        yuv420_to_bgr(view, *fallback_bgr)
+                        view = fallback_bgr[0]
+                    eye_w = view.shape[1]
+                    if double_frame is None or double_frame.shape != (view.shape[0], 2 * eye_w, 3):
+                        double_frame = np.empty((view.shape[0], 2 * eye_w, 3), dtype=np.uint8)
+                    np.copyto(double_frame[:, :eye_w], view)
+                    np.copyto(double_frame[:, eye_w:], view)
+                    final_frame = display_on_framebuffer(double_frame, battery_v, battery_st, battery_crit,
+                                                          mq07_v, mq07_st, mq07_danger,
+                                                          light_val, light_st, fb_writer, recording_active,
+                                                          hud, recording_source == "composite", stale,
+                                                          telemetry)
+                    if latency_stats is not None:
+                        # Synchronous path: compose = wait for the main loop, present = whole render
+                        sensor_ns, captured_ns = frame_stamps[STAMP_SENSOR], frame_stamps[STAMP_CAPTURED]
+                        latency_stats.record(int(sensor_ns), int(captured_ns), compose_start,
+                                             time.monotonic_ns())
+
+                # Hand frame to the encoder process when recording or filling the pre-roll
+                # (never blocks, drops when full)
+                if recorder is not None and (recording_active or recorder.preroll_seconds > 0):
                     try:
-                        video_writer.write(final_frame)
+                        recorder.submit(final_frame if recording_source == "composite" else frame,
+                                        (battery_v, mq07_v, light_val))
                     except Exception as e:
                         if DEBUG_MODE:
                             print(f"Video write error: {e}")
+
+                # Live preview: what the welder sees, HUD as values (rate-capped copy, never blocks)
+                if preview is not None and preview.due(clock.time()):
+                    preview.publish(view, {"battery_v": round(battery_v, 2), "battery": battery_st,
+                                           "co_v": round(mq07_v, 2), "air": mq07_st, "co_danger": mq07_danger,
+                                           "light": light_val, "recording": recording_active,
+                                           "stale": stale}, clock.time())
             except Exception as e:
                 if DEBUG_MODE:
                     print(f"Display error: {e}")
+            finally:
+                ring.release(frame_index)
+
+            # Startup metric: time from process start to the first presented frame
+            if not first_frame_shown and (pipeline is None or pipeline.first_presented is not None):
+                first_frame_shown = True
+                shown_at = pipeline.first_presented if pipeline is not None else time.monotonic()
+                startup = boot.startup_ms(shown_at) if boot is not None else \
+                    {"first_frame": round((shown_at - BOOT_START) * 1000.0, 1)}
+                print(f"Time to first frame: {startup['first_frame']:.0f} ms ({json.dumps(startup)})")
+                if latency_stats is not None:
+                    latency_stats.startup = startup
+
+            # Replay: checksum what reached the screen
+            if replay is not None:
+                if pipeline is not None:
+                    pipeline.wait_presented(present_target)
+                replay.frame_done(fb_writer.mm if fb_writer is not None else final_frame)
+
+            # Frame work time (replay uses the recorded one, so the governor repeats its live decisions)
+            work_time = time.perf_counter() - work_start if replay is None else replay.work
+            if session is not None:
+                session.work(work_time)
+
+            # Governor: step quality down/up when the frame work leaves the budget band
+            # (not while stalled: repeated frames say nothing about the load)
+            if governor is not None and not stale:
+                quality = governor.observe(work_time)
+                if quality is not None:
+                    try:
+                        apply_quality(quality, frame_processor, pipeline, hud, recorder, stereo, tonemap)
+                    except Exception as e:
+                        print(f"Quality change failed: {e}")
+                    print(f"Governor: quality '{quality['name']}' (level {governor.level})")
 
             # FPS tracking and timing
             fps_counter += 1
             elapsed_fps = time.time() - fps_start_time
             if elapsed_fps >= 1.0:
                 fps = fps_counter / elapsed_fps
+                dropped = frame_processor.ring.dropped
+                if pipeline is not None:
+                    dropped += pipeline.canvas_ring.dropped
+                latency_info = f" | Skipped: {skipped_frames} | Dup: {duplicate_frames}"
+                memory = memory_usage()
+                if latency_stats is not None:
+                    latency_stats.memory = memory
+                    if supervisor is not None:
+                        latency_stats.capture = supervisor.summary()
+                    latency_stats.tonemap = tonemap.summary()
+                    latency_stats.denoise = denoiser.summary()
+                    if preview is not None:
+                        latency_stats.preview = preview.summary()
+                    latency_stats.dropped = dropped
+                    latency_stats.duplicates = duplicate_frames
+                    latency_stats.skipped = skipped_frames
+                    latency_stats.fps = fps
+                    total = latency_stats.tick()["total"]
+                    if total["count"]:
+                        latency_info += f" | Latency p50/p99: {total['p50']:.1f}/{total['p99']:.1f} ms"
                 if DEBUG_MODE:
+                    rec_info = ""
+                    if recording_active:
+                        rec_info = (f" | Rec: {recorder.written.value}/{recorder.submitted} written, "
+                                    f"{recorder.dropped} dropped")
                     print(f"FPS: {fps:.1f} | Battery: {battery_v:.2f}V ({battery_st}) | "
-                          f"Air: {mq07_st} ({mq07_v:.2f}V) | Light: {light_st} ({light_val})")
+                          f"Air: {mq07_st} ({mq07_v:.2f}V) | Light: {light_st} ({light_val}) | "
+                          f"Dropped: {dropped}{latency_info}{rec_info} | "
+                          f"RSS: {memory['rss_mb']:.0f} MB (peak {memory['peak_mb']:.0f} MB)")
                 fps_counter = 0
                 fps_start_time = time.time()
 
-            # Frame time regulation: sleep to maintain target FPS
-            frame_elapsed = time.time() - frame_start
-            frame_sleep = FRAME_TIME_BUDGET - frame_elapsed
-            if frame_sleep > MIN_FRAME_TIME:
-                time.sleep(frame_sleep)
-            elif frame_sleep > 0:
-                # Very small sleep to avoid busy-wait
-                time.sleep(MIN_FRAME_TIME)
-
     except KeyboardInterrupt:
         print("\nShutdown requested...")
     except Exception as e:
@@ -652,16 +5282,37 @@ def main():
         # Cleanup
         print("Cleaning up...")
         
-        # Stop recording if active
-        if video_writer is not None:
-            video_writer.release()
-            print("Recording stopped and saved.")
-        
+        # Stop recording if active (encoder flushes queued frames before exiting)
+        if recorder is not None:
+            if recording_active:
+                recorder.stop()
+            recorder.close()
+            if recording_active:
+                print("Recording stopped and saved.")
+        if preview is not None:
+            preview.close()
+
+        if pipeline is not None:
+            pipeline.stop()
+        if stripe_workers is not None:
+            stripe_workers.stop()
+        if latency_stats is not None:
+            latency_stats.close()
         frame_processor.stop()
         picam2.stop()
-        spi.close()
-        if fb_handle:
-            fb_handle.close()
+        sensor_sampler.stop()
+        if telemetry is not None:
+            telemetry.close()
+        if session is not None:
+            session.close()
+            print(f"Session saved: {args.record_session} ({session.frames} frames)")
+        if replay is not None:
+            print(f"Replay: {json.dumps(replay.close())}")
+        adc_reader.close()
+        if spi is not None:
+            spi.close()
+        if fb_writer:
+            fb_writer.close()
         print("Shutdown complete.")
 
 if __name__ == "__main__":